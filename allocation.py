@@ -0,0 +1,199 @@
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class disk_usage:
+    '''
+    Bytes used on each disk at each index of a RAID6, in one typed array of
+    indexes x disks grown by doubling, and a flag per chunk stored as a hole
+    because it only holds zeros
+    Reads as the list of lists it replaces: usage[index][disk], len(usage)
+    '''
+    def __init__(self, number_of_disks, chunk_size):
+        self.WIDTH = number_of_disks
+        self.TYPECODE = 'H' if chunk_size < 1 << 16 else 'I'
+        self.values = array.array(self.TYPECODE)
+        self.zeros = bytearray()
+        self.count = 0      # Indexes in use, the array has room for more
+        self.changed = set()    # Indexes set since the last call to changes
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['changed']
+        return state
+
+    # Disk usage saved before the zero flags
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'zeros' not in state:
+            self.zeros = bytearray(len(self.values))
+        self.changed = set()
+
+    ###
+    # Make room for the indexes up to count - 1, new indexes are empty
+    ###
+    def grow(self, count):
+        if count <= self.count:
+            return
+        needed = count * self.WIDTH
+        if needed > len(self.values):
+            capacity = max(needed, 2 * len(self.values), 64 * self.WIDTH)
+            self.zeros.extend(bytes(capacity - len(self.values)))
+            self.values.frombytes(bytes((capacity - len(self.values)) * self.values.itemsize))
+        self.count = count
+
+    def get(self, index, disk):
+        if index >= self.count or index < 0:
+            raise IndexError("Index " + str(index) + " was never written")
+        return self.values[index * self.WIDTH + disk]
+
+    def set(self, index, disk, length):
+        self.grow(index + 1)
+        self.values[index * self.WIDTH + disk] = length
+        self.changed.add(index)
+
+    def is_zero(self, index, disk):
+        return index < self.count and self.zeros[index * self.WIDTH + disk] == 1
+
+    def set_zero(self, index, disk, zero):
+        self.grow(index + 1)
+        self.zeros[index * self.WIDTH + disk] = 1 if zero else 0
+        self.changed.add(index)
+
+    ###
+    # Number of indexes and rows (usage, zero flags) of the indexes set since
+    # the last call, to journal only them, and back
+    ###
+    def changes(self):
+        rows = {}
+        for index in self.changed:
+            start = index * self.WIDTH
+            rows[index] = (self.values[start:start + self.WIDTH].tobytes(), bytes(self.zeros[start:start + self.WIDTH]))
+        self.changed = set()
+        return self.count, rows
+
+    def apply_changes(self, count, rows):
+        self.grow(count)
+        for index, (values, zeros) in rows.items():
+            start = index * self.WIDTH
+            self.values[start:start + self.WIDTH] = array.array(self.TYPECODE, values)
+            self.zeros[start:start + self.WIDTH] = zeros
+
+    ###
+    # Chunks stored as holes
+    ###
+    def zero_chunks(self):
+        return self.zeros.count(1, 0, self.count * self.WIDTH)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index >= self.count or index < 0:
+            raise IndexError("Index " + str(index) + " was never written")
+        return self.values[index * self.WIDTH:(index + 1) * self.WIDTH].tolist()
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    ###
+    # Indexes where at least one of the disks holds data
+    ###
+    def indexes_with_data(self, disks):
+        if numpy is not None and self.count > 0:
+            usage = numpy.frombuffer(self.values, dtype=numpy.dtype(self.TYPECODE), count=self.count * self.WIDTH)
+            return numpy.flatnonzero(usage.reshape(self.count, self.WIDTH)[:, list(disks)].any(axis=1)).tolist()
+        return [index for index in range(self.count)
+                if any(self.values[index * self.WIDTH + disk] > 0 for disk in disks)]
+
+    ###
+    # Bytes stored on a disk, over all its indexes
+    ###
+    def disk_total(self, disk):
+        if numpy is not None and self.count > 0:
+            usage = numpy.frombuffer(self.values, dtype=numpy.dtype(self.TYPECODE), count=self.count * self.WIDTH)
+            return int(usage[disk::self.WIDTH].sum())
+        return sum(self.values[disk:self.count * self.WIDTH:self.WIDTH])
+
+    ###
+    # Build from the list of lists of older metadata
+    ###
+    @classmethod
+    def from_rows(cls, rows, number_of_disks, chunk_size):
+        usage = cls(number_of_disks, chunk_size)
+        usage.grow(len(rows))
+        for index, row in enumerate(rows):
+            for disk, length in enumerate(row):
+                usage.values[index * usage.WIDTH + disk] = length
+        return usage
+
+
+class extent:
+    '''
+    Place of (part of) an object on the disks: first chunk (index, disk), offset
+    in bytes from the start of that chunk and length in bytes, plus the pack
+    it shares with other small objects, the fingerprint of the deduplicated
+    stripe it shares with other objects or the shared extent (see
+    RAID6.SHARED) it is part of for clones and snapshots, if any
+    Used like the dict it replaces: x['index'], x['offset'] = 0, 'pack' in x, dict(x)
+    '''
+    __slots__ = ('index', 'disk', 'offset', 'length', 'pack', 'fingerprint', 'shared')
+    KEYS = ('index', 'disk', 'offset', 'length')
+    OPTIONAL = ('pack', 'fingerprint', 'shared')     # Only keys when set
+
+    def __init__(self, index, disk, offset=0, length=0, pack=None, fingerprint=None, shared=None):
+        self.index = index
+        self.disk = disk
+        self.offset = offset
+        self.length = length
+        self.pack = pack
+        self.fingerprint = fingerprint
+        self.shared = shared
+
+    def __getitem__(self, key):
+        if key in self.OPTIONAL and getattr(self, key) is None:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.KEYS or (key in self.OPTIONAL and getattr(self, key) is not None)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return self.KEYS + tuple(key for key in self.OPTIONAL if getattr(self, key) is not None)
+
+    def copy(self):
+        return extent(self.index, self.disk, self.offset, self.length, self.pack, self.fingerprint, self.shared)
+
+    def __eq__(self, other):
+        try:
+            return dict(self) == dict(other)
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    def __reduce__(self):
+        return (extent, (self.index, self.disk, self.offset, self.length, self.pack, self.fingerprint, self.shared))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    ###
+    # From the dict of older metadata
+    ###
+    @classmethod
+    def from_dict(cls, x):
+        if isinstance(x, cls):
+            return x
+        return cls(x['index'], x['disk'], x.get('offset', 0), x['length'], x.get('pack'), x.get('fingerprint'), x.get('shared'))
@@ -0,0 +1,312 @@
+import abc
+import os
+import shutil
+import struct
+import threading
+
+# Slot header of the image backend: length of the chunk + 1, 0 for a chunk never written
+SLOT_HEADER = struct.Struct('<I')
+
+# fallocate of the C library (Linux) to punch the slots of discarded chunks out of the images
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+try:
+    import ctypes
+    import ctypes.util
+    fallocate = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).fallocate
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+except (ImportError, OSError, AttributeError, TypeError):
+    fallocate = None
+
+
+###
+# fsync a file or a directory, skipping the ones removed or that cannot be opened
+###
+def fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class disk_backend(abc.ABC):
+    '''
+    Storage of the raw chunks of the disks of a RAID6
+    Each disk lives at a location (paths[disk]); the controller shares the paths
+    list, so swapping a spare in is just replacing a location
+    A chunk or a disk that is missing raises FileNotFoundError
+    '''
+    VOLATILE = False    # Chunks are lost with the process, nothing to make durable
+
+    def __init__(self, paths, chunk_bytes):
+        self.paths = paths
+        self.CHUNK_BYTES = chunk_bytes      # Largest chunk stored
+
+    @abc.abstractmethod
+    def read_chunk(self, disk, index):
+        pass
+
+    @abc.abstractmethod
+    def write_chunk(self, disk, index, raw):
+        pass
+
+    ###
+    # Drop a chunk, leaving a hole where it was
+    ###
+    @abc.abstractmethod
+    def discard(self, disk, index):
+        pass
+
+    ###
+    # Whether a disk is usable, or with an index whether it holds that chunk
+    ###
+    @abc.abstractmethod
+    def exists(self, disk, index=None):
+        pass
+
+    ###
+    # Create an empty disk at a location, and remove one with everything on it
+    ###
+    @abc.abstractmethod
+    def create(self, location):
+        pass
+
+    @abc.abstractmethod
+    def destroy(self, location):
+        pass
+
+    ###
+    # Lose a disk, as if it had been pulled out
+    ###
+    def fail(self, disk):
+        self.destroy(self.paths[disk])
+
+    ###
+    # Put the disk at a new location (a spare, or a new empty disk at the same place)
+    ###
+    def replace(self, disk, location=None):
+        if location is None:
+            location = self.paths[disk]
+        self.create(location)
+        self.paths[disk] = location
+
+    ###
+    # Make every chunk written so far durable
+    ###
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class directory_backend(disk_backend):
+    '''
+    One directory per disk and one file per chunk, the original layout
+    '''
+    def __init__(self, paths, chunk_bytes):
+        disk_backend.__init__(self, paths, chunk_bytes)
+        self.written = set()    # Chunk files written or removed since the last sync
+        self.lock = threading.Lock()
+
+    def read_chunk(self, disk, index):
+        with open(self.paths[disk] + str(index), 'rb') as f:
+            return f.read(self.CHUNK_BYTES)
+
+    def write_chunk(self, disk, index, raw):
+        with open(self.paths[disk] + str(index), 'wb') as f:
+            f.write(raw)
+        with self.lock:
+            self.written.add(self.paths[disk] + str(index))
+
+    def discard(self, disk, index):
+        if not os.path.isdir(self.paths[disk]):
+            raise FileNotFoundError("Disk " + str(disk) + " is missing")
+        try:
+            os.remove(self.paths[disk] + str(index))
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.written.add(self.paths[disk] + str(index))
+
+    def exists(self, disk, index=None):
+        if index is not None:
+            return os.path.isfile(self.paths[disk] + str(index))
+        return os.path.isdir(self.paths[disk]) and os.access(self.paths[disk], os.W_OK)
+
+    def create(self, location):
+        os.makedirs(location, exist_ok=True)
+
+    def destroy(self, location):
+        shutil.rmtree(location, ignore_errors=True)
+
+    ###
+    # fsync the chunk files written since the last sync, then their
+    # directories so that new and removed files are durable too
+    # (directories cannot be opened on Windows, their fsync is skipped)
+    ###
+    def sync(self):
+        with self.lock:
+            written, self.written = self.written, set()
+        for file in sorted(written):
+            fsync_path(file)
+        for directory in sorted(set(os.path.dirname(file) for file in written)):
+            fsync_path(directory)
+
+
+class image_backend(disk_backend):
+    '''
+    One image file per disk (named 'image' in the directory of the disk), the
+    chunk of an index being stored in a fixed size slot at index * slot size
+    Avoids one file, and one open, per chunk
+    '''
+    def __init__(self, paths, chunk_bytes):
+        disk_backend.__init__(self, paths, chunk_bytes)
+        self.SLOT_SIZE = SLOT_HEADER.size + chunk_bytes
+        self.files = {}     # location: file descriptor of its image
+        self.lock = threading.Lock()
+
+    ###
+    # Descriptor of the image of a disk, reopened if the image was removed
+    # since it was opened (a removed disk must fail, not keep being read)
+    ###
+    def descriptor(self, disk, create=False):
+        location = self.paths[disk]
+        with self.lock:
+            fd = self.files.get(location)
+            if fd is not None and os.fstat(fd).st_nlink == 0:
+                os.close(fd)
+                fd = None
+                self.files.pop(location)
+            if fd is None:
+                fd = os.open(location + 'image', os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+                self.files[location] = fd
+            return fd
+
+    def read_chunk(self, disk, index):
+        slot = os.pread(self.descriptor(disk), self.SLOT_SIZE, index * self.SLOT_SIZE)
+        length = SLOT_HEADER.unpack(slot[:SLOT_HEADER.size])[0] if len(slot) >= SLOT_HEADER.size else 0
+        if length == 0:
+            raise FileNotFoundError("No chunk " + str(index) + " on disk " + str(disk))
+        return slot[SLOT_HEADER.size:SLOT_HEADER.size + length - 1]
+
+    def write_chunk(self, disk, index, raw):
+        if not os.path.isdir(self.paths[disk]):
+            raise FileNotFoundError("Disk " + str(disk) + " is missing")
+        os.pwrite(self.descriptor(disk, create=True), SLOT_HEADER.pack(len(raw) + 1) + raw, index * self.SLOT_SIZE)
+
+    ###
+    # Slots past the end of the image are holes already; the others are
+    # punched out of the image, which zeroes their header too
+    # The filesystem only frees the blocks punched whole, so the hole grows to
+    # the blocks around the slot when the other slots in them hold no chunk
+    # Without fallocate (other systems, or a filesystem not supporting it) the
+    # slot is only marked as never written and keeps its space
+    ###
+    def discard(self, disk, index):
+        if not os.path.isdir(self.paths[disk]):
+            raise FileNotFoundError("Disk " + str(disk) + " is missing")
+        fd = self.descriptor(disk, create=True)
+        stat = os.fstat(fd)
+        start, end = index * self.SLOT_SIZE, (index + 1) * self.SLOT_SIZE
+        if start >= stat.st_size:
+            return
+        if fallocate is not None:
+            block = stat.st_blksize
+            if self.empty_slots(fd, start // block * block // self.SLOT_SIZE, index):
+                start = start // block * block
+            if self.empty_slots(fd, index + 1, (-(-end // block) * block - 1) // self.SLOT_SIZE + 1):
+                end = -(-end // block) * block
+            if fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, start, end - start) == 0:
+                return
+        os.pwrite(fd, SLOT_HEADER.pack(0), index * self.SLOT_SIZE)
+
+    ###
+    # Whether the slots from first to last (excluded) hold no chunk
+    ###
+    def empty_slots(self, fd, first, last):
+        for index in range(first, last):
+            header = os.pread(fd, SLOT_HEADER.size, index * self.SLOT_SIZE)
+            if len(header) == SLOT_HEADER.size and SLOT_HEADER.unpack(header)[0] != 0:
+                return False
+        return True
+
+    def exists(self, disk, index=None):
+        if index is None:
+            return os.path.isdir(self.paths[disk]) and os.access(self.paths[disk], os.W_OK)
+        try:
+            self.read_chunk(disk, index)
+        except OSError:
+            return False
+        return True
+
+    def create(self, location):
+        os.makedirs(location, exist_ok=True)
+
+    def destroy(self, location):
+        with self.lock:
+            fd = self.files.pop(location, None)
+            if fd is not None:
+                os.close(fd)
+        shutil.rmtree(location, ignore_errors=True)
+
+    def sync(self):
+        with self.lock:
+            for fd in self.files.values():
+                os.fsync(fd)
+
+    def close(self):
+        with self.lock:
+            for fd in self.files.values():
+                os.close(fd)
+            self.files = {}
+
+
+class memory_backend(disk_backend):
+    '''
+    Disks kept in memory; the RAID6 keeps its metadata in memory too and has
+    no write-intent bitmap, only staging files of writes go under its root
+    Used to measure the cost of the RAID6 itself and to run several arrays in one process
+    '''
+    VOLATILE = True
+
+    def __init__(self, paths, chunk_bytes):
+        disk_backend.__init__(self, paths, chunk_bytes)
+        self.disks = {}     # location: {index: raw chunk}
+
+    def read_chunk(self, disk, index):
+        try:
+            return self.disks[self.paths[disk]][index]
+        except KeyError:
+            raise FileNotFoundError("No chunk " + str(index) + " on disk " + str(disk))
+
+    def write_chunk(self, disk, index, raw):
+        chunks = self.disks.get(self.paths[disk])
+        if chunks is None:
+            raise FileNotFoundError("Disk " + str(disk) + " is missing")
+        chunks[index] = bytes(raw)
+
+    def discard(self, disk, index):
+        chunks = self.disks.get(self.paths[disk])
+        if chunks is None:
+            raise FileNotFoundError("Disk " + str(disk) + " is missing")
+        chunks.pop(index, None)
+
+    def exists(self, disk, index=None):
+        chunks = self.disks.get(self.paths[disk])
+        return chunks is not None and (index is None or index in chunks)
+
+    def create(self, location):
+        self.disks.setdefault(location, {})
+
+    def destroy(self, location):
+        self.disks.pop(location, None)
+
+
+BACKENDS = {'directory': directory_backend,
+            'image': image_backend,
+            'memory': memory_backend}
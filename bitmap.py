@@ -0,0 +1,75 @@
+import os
+import time
+
+
+class intent_bitmap:
+    '''
+    Persistent write-intent bitmap, one bit per region of REGION_SIZE indexes
+    A region is marked dirty on disk before any of its chunks is written and
+    cleared lazily once its parity is known to be durable, so after a crash
+    only the dirty regions need their parity recomputed
+    '''
+    def __init__(self, file, region_size=64):
+        self.FILE = file
+        self.REGION_SIZE = region_size
+
+        self.bits = bytearray()
+        self.writing = set()        # Indexes written since their parity was last restored
+        self.last_flush = time.time()
+
+        if os.path.exists(self.FILE):
+            with open(self.FILE, 'rb') as f:
+                self.bits = bytearray(f.read())
+
+    def is_dirty(self, region):
+        byte = region // 8
+        return byte < len(self.bits) and self.bits[byte] & (1 << (region % 8)) != 0
+
+    ###
+    # Called before writing a chunk of an index, only the first write to a
+    # clean region costs a bitmap write
+    ###
+    def mark_dirty(self, index):
+        self.writing.add(index)
+        region = index // self.REGION_SIZE
+        if self.is_dirty(region):
+            return
+        byte = region // 8
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        self.bits[byte] |= 1 << (region % 8)
+        self.persist()
+
+    ###
+    # Called once the parity of an index matches its data again
+    ###
+    def mark_clean(self, index):
+        self.writing.discard(index)
+
+    def mark_clean_all(self):
+        self.writing.clear()
+
+    def dirty_regions(self):
+        return [region for region in range(len(self.bits) * 8) if self.is_dirty(region)]
+
+    ###
+    # Clear the regions without index being written, the caller must make sure
+    # the chunks written so far are durable first
+    ###
+    def flush(self):
+        busy = set(index // self.REGION_SIZE for index in self.writing)
+        changed = False
+        for region in self.dirty_regions():
+            if region not in busy:
+                self.bits[region // 8] &= ~(1 << (region % 8)) & 0xff
+                changed = True
+        if changed:
+            self.persist()
+        self.last_flush = time.time()
+
+    def persist(self):
+        with open(self.FILE + '.tmp', 'wb') as f:
+            f.write(self.bits)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.FILE + '.tmp', self.FILE)
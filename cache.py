@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+
+class stripe_cache:
+    '''
+    LRU cache of decoded indexes (data and parity chunks of one stripe)
+    bounded by a byte budget
+    '''
+    def __init__(self, budget):
+        self.budget = budget      # Maximum number of bytes kept, 0 disables the cache
+        self.used = 0
+        self.entries = OrderedDict()    # index: (value, size), least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    ###
+    # Return the cached value of an index or None
+    ###
+    def get(self, index):
+        with self.lock:
+            try:
+                value, size = self.entries[index]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(index)
+            self.hits += 1
+            return value
+
+    ###
+    # Store the value of an index, evicting the least recently used indexes
+    # until the byte budget is respected
+    ###
+    def put(self, index, value, size):
+        with self.lock:
+            if size > self.budget:
+                return
+            if index in self.entries:
+                self.used -= self.entries.pop(index)[1]
+            self.entries[index] = (value, size)
+            self.used += size
+            self.evict()
+
+    def evict(self):
+        while self.used > self.budget and len(self.entries) > 0:
+            index, (value, size) = self.entries.popitem(last=False)
+            self.used -= size
+            self.evictions += 1
+
+    ###
+    # Drop an index, called every time one of its chunks is written
+    ###
+    def invalidate(self, index):
+        with self.lock:
+            if index in self.entries:
+                self.used -= self.entries.pop(index)[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+    def resize(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self.entries),
+                    'bytes': self.used, 'budget': self.budget}
@@ -4,6 +4,46 @@ import shutil
 import parity
 import struct
 import time
+import pickle
+import threading
+import functools
+import zlib
+import lzma
+import hashlib
+import cache
+import journal
+import bitmap
+import spare
+import prefetch
+import backend as storage
+import reshape
+import allocation
+import lanes
+import merkle
+import ingest
+import latency
+import concurrent.futures
+
+
+###
+# Run a method holding the lock of the RAID6; with a journal, the outermost
+# call then waits for its commits to be durable out of the lock, so that the
+# operations of other threads share the fsync
+###
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.LOCK:
+            self.DEPTH += 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self.DEPTH -= 1
+            outermost = self.DEPTH == 0
+        if outermost and self.JOURNAL is not None:
+            self.JOURNAL.wait()
+        return result
+    return wrapper
 
 
 class RAID6:
@@ -15,9 +55,17 @@ class RAID6:
     # Allow the user to define certains characteristics of the RAID6, like the CHUNK_SIZE
     # or the number of disk
     # It will also reinitialize any previous disk created
+    # parity_disks other than 2 switches from P+Q to a k+m Reed-Solomon code
+    # journal_path enables a write-ahead journal stored in that directory
+    # reset=False reopens the disks and metadata of a previous run instead
+    # spares are directories swapped in for failed disks and rebuilt in the background
+    # path is the root of the disks and metadata, arrays with different roots can coexist
+    # backend stores the chunks: 'directory' (a file per chunk), 'image' (a file per disk),
+    # 'memory', or a function (disk paths, chunk bytes) -> backend
     ###
-    def __init__(self, number_of_disk=8, chunk_size=128):
-        self.PATH = 'disks/'
+    def __init__(self, number_of_disk=8, chunk_size=128, parity_disks=2, journal_path=None, reset=True, spares=None,
+                 path='disks/', backend='directory'):
+        self.PATH = os.path.join(path, '')
         self.NUMBER_OF_DISKS = number_of_disk    # Safe to modify
         self.BYTE_SIZE = 8
         self.CHUNK_SIZE = chunk_size       # Safe to modify
@@ -25,8 +73,9 @@ class RAID6:
         self.current_index = 0      # Index where to write next
         self.current_disk_index = 0 # Disk where to write next
 
-        self.P_INDEX =  self.NUMBER_OF_DISKS - 2    # Index of the P disk
-        self.Q_INDEX =  self.NUMBER_OF_DISKS - 1    # Index of the Q disk
+        self.PARITY_DISKS = parity_disks        # Number of parity chunks per index
+        self.P_INDEX =  self.NUMBER_OF_DISKS - self.PARITY_DISKS    # Index of the P disk (first parity disk)
+        self.Q_INDEX =  self.NUMBER_OF_DISKS - 1    # Index of the Q disk (last parity disk)
 
         self.ENFORCING_CHECK = True # Check the parity byte each read
 
@@ -34,74 +83,523 @@ class RAID6:
 
         if number_of_disk>8:
             self.WRITING_INFO='q'
+        self.VALUE_SIZE = struct.calcsize(self.WRITING_INFO)   # Bytes used by one stored value
+        self.VALUE_SHIFT = pow(2,self.NUMBER_OF_DISKS)//2       # Stored values are shifted to fit a signed type
+
+        self.CACHE = cache.stripe_cache(64 * 1024 * 1024)    # Decoded indexes, byte budget can be changed with CACHE.resize
+        self.PREFETCHER = prefetch.read_ahead(self)     # Read-ahead of sequentially read indexes
+
+        self.LATENCY = latency.disk_latency(self.NUMBER_OF_DISKS)  # Read latency of each disk
+        self.HEDGED_READS = False   # Rebuild late chunks from the parity instead of waiting for them, safe to modify
+        self.HEDGE_FACTOR = 2.0     # Late means slower than this many times the median p95 read latency
+        self.HEDGE_BACKLOG = 4      # A disk with more requests waiting is late without being asked
 
-        #name:[{index, disk, offset, length}, ...]
+        self.LANES = lanes.member_lanes(self.NUMBER_OF_DISKS)  # One I/O thread per disk
+        self.PARALLEL_IO = False    # Read and write the chunks of an index on all its disks at once, safe to modify
+        self.QUEUED = []            # Data chunks written to the disks with the parity of their index
+        self.ZERO_CHUNKS = True     # Store chunks holding only zeros as holes, safe to modify
+
+        #name:[extent(index, disk, offset, length), ...]
         self.FILES_INFO = {}        # Info to get the files accross multiples blocks
 
         #available_place
         self.ERASED_INFO = []       # Blocks erased and that can be reused
 
-        self.DISKS_INFO = []        # Info on disk utilization
+        self.DISKS_INFO = allocation.disk_usage(self.NUMBER_OF_DISKS, self.CHUNK_SIZE)    # Info on disk utilization
+
+        self.LAZY_PARITY = set()    # Free indexes skipped by a rebuild, zero filled on their next write
+
+        self.READ_COUNT = {}        # name: number of reads, most read files are rebuilt first
+
+        #pack id:{extent, objects}
+        self.PACKS = {}             # Extents shared by small objects written with write_many
+
+        #name:{codec, level, size, stored}
+        self.OBJECT_INFO = {}       # Compression of the objects written with a codec
+        self.CODECS = {'zlib': (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+                       'lzma': (lambda data, level: lzma.compress(data, preset=6 if level is None else level), lzma.decompress)}
+        self.COMPRESSION_RATIO = 0.9    # Data not compressed below this ratio is stored raw
+        self.COMPRESSION_SAMPLE = 64 * 1024     # Bytes compressed to detect incompressible data
+
+        #fingerprint:{extent, refs}
+        self.STRIPES = {}           # Deduplicated stripes and the number of extents using each
+        self.DEDUP = False          # Store identical stripes of the objects once, safe to modify
+        self.SHARED = {}            # Extents shared by clones and snapshots and the number of extents using each
+        self.SNAPSHOTS = {}         # Snapshot name: {'time': ..., 'objects': {name: references to its extents, ...}}
+
+        #name:merkle_tree
+        self.DIGESTS = {}           # Merkle tree of the (uncompressed) data of each object
+        self.DIGEST_BLOCK_SIZE = 8 * 1024   # Bytes per leaf of the new trees, safe to modify
+
+        self.DISK_PATHS = [self.PATH + 'disk_' + str(i) + '/' for i in range(self.NUMBER_OF_DISKS)]    # Directory of each disk
+        self.SPARES = [os.path.join(x, '') for x in spares or []]    # Spare directories not in use yet
+        self.REBUILDING = {}        # disk being rebuilt on a spare: indexes already rebuilt
+
+        if isinstance(backend, str):
+            backend = storage.BACKENDS[backend]
+        self.BACKEND_FACTORY = backend
+        self.BACKEND = backend(self.DISK_PATHS, self.CHUNK_SIZE * self.VALUE_SIZE)   # Shares DISK_PATHS
+
+        self.LOCK = threading.RLock()
+        self.DEPTH = 0              # Nested synchronized calls of the thread holding LOCK
+        self.SPARE_MANAGER = spare.spare_manager(self)
+        self.RESHAPE = None         # Migration to a new geometry running
 
         self.parity = parity.parity(number_of_disk)
+        self.erasure = None
+        if self.PARITY_DISKS != 2:
+            self.erasure = parity.reed_solomon(self.P_INDEX, self.PARITY_DISKS)
+
+        self.JOURNAL = None
+        self.JOURNAL_LIMIT = 16 * 1024 * 1024   # Journal bytes (chunks and metadata) kept before being applied to the disks
+        self.JOURNALED = {}         # Field: state of the metadata last journaled (digests of entries, set or digest)
+        self.BITMAP = None
+        self.BITMAP_FLUSH_DELAY = 1.0   # Seconds between two lazy clears of the write-intent bitmap
 
         # Removing old directory
-        try:
-            shutil.rmtree(self.PATH)
-        except:
-            pass
-        for i in range(self.NUMBER_OF_DISKS):
-            directory = "disk_" + str(i)
-            if not os.path.exists(self.PATH + directory):
-                os.makedirs(self.PATH + directory)
+        if reset:
+            for location in self.DISK_PATHS + self.SPARES:
+                self.BACKEND.destroy(location)
+            try:
+                shutil.rmtree(self.PATH)
+            except:
+                pass
+            os.makedirs(self.PATH)
+            for location in self.DISK_PATHS + self.SPARES:
+                self.BACKEND.create(location)
+        else:
+            # A missing disk is a failed disk, it must not be silently recreated
+            if not os.path.exists(self.PATH):
+                os.makedirs(self.PATH)
+            self.load_metadata()
+        if journal_path is not None:
+            self.JOURNAL = journal.write_journal(journal_path, reset=reset)
+            self.replay_journal()
+        elif not self.BACKEND.VOLATILE:
+            # The journal already keeps parity consistent, the bitmap is only needed without it
+            self.BITMAP = bitmap.intent_bitmap(self.PATH + 'bitmap')
+            self.resync_dirty()
+
+        if len(self.SPARES) > 0 or len(self.REBUILDING) > 0:
+            self.SPARE_MANAGER.start()
+        if self.RESHAPE is not None:
+            self.RESHAPE.start()
+
+    ###
+    # Metadata needed to reopen the RAID6
+    ###
+    def metadata(self):
+        info = self.metadata_fields()
+        info['geometry'] = (self.NUMBER_OF_DISKS, self.CHUNK_SIZE, self.PARITY_DISKS)
+        info['DISKS_INFO'] = self.DISKS_INFO
+        return pickle.dumps(info)
+
+    def metadata_fields(self):
+        return {'current_index': self.current_index,
+                'current_disk_index': self.current_disk_index,
+                'FILES_INFO': self.FILES_INFO,
+                'ERASED_INFO': self.ERASED_INFO,
+                'LAZY_PARITY': self.LAZY_PARITY,
+                'READ_COUNT': self.READ_COUNT,
+                'DISK_PATHS': self.DISK_PATHS,
+                'SPARES': self.SPARES,
+                'REBUILDING': self.REBUILDING,
+                'PACKS': self.PACKS,
+                'OBJECT_INFO': self.OBJECT_INFO,
+                'DIGESTS': self.DIGESTS,
+                'STRIPES': self.STRIPES,
+                'SHARED': self.SHARED,
+                'SNAPSHOTS': self.SNAPSHOTS,
+                'RESHAPE': None if self.RESHAPE is None else self.RESHAPE.state()}
+
+    ###
+    # Metadata changed since it was last journaled, logged by each commit
+    # instead of the whole metadata: the entries of the dictionaries and the
+    # members of the sets added or removed, the other fields that changed and
+    # the rows of DISKS_INFO that were set
+    # Entries and fields are compared through the digest of their pickle
+    ###
+    def metadata_delta(self):
+        delta = {'fields': {}, 'entries': {}, 'members': {}, 'DISKS_INFO': self.DISKS_INFO.changes()}
+        for field, value in self.metadata_fields().items():
+            # The reshape state is None without a reshape, it is journaled whole
+            if isinstance(value, dict) and field != 'RESHAPE':
+                seen = self.JOURNALED.setdefault(field, {})
+                changed = {}
+                for key, entry in value.items():
+                    raw = pickle.dumps(entry)
+                    digest = hashlib.blake2b(raw, digest_size=16).digest()
+                    if seen.get(key) != digest:
+                        seen[key] = digest
+                        changed[key] = raw
+                removed = [key for key in seen if key not in value]
+                for key in removed:
+                    del seen[key]
+                if len(changed) > 0 or len(removed) > 0:
+                    delta['entries'][field] = (changed, removed)
+            elif isinstance(value, set):
+                seen = self.JOURNALED.get(field, set())
+                if value != seen:
+                    delta['members'][field] = (value - seen, seen - value)
+                    self.JOURNALED[field] = set(value)
+            else:
+                raw = pickle.dumps(value)
+                digest = hashlib.blake2b(raw, digest_size=16).digest()
+                if self.JOURNALED.get(field) != digest:
+                    self.JOURNALED[field] = digest
+                    delta['fields'][field] = raw
+        return pickle.dumps(delta)
+
+    def apply_metadata_delta(self, raw):
+        delta = pickle.loads(raw)
+        self.DISKS_INFO.apply_changes(*delta['DISKS_INFO'])
+        for field, (changed, removed) in delta['entries'].items():
+            value = getattr(self, field)
+            for key, entry in changed.items():
+                value[key] = pickle.loads(entry)
+            for key in removed:
+                value.pop(key, None)
+        for field, (added, removed) in delta['members'].items():
+            getattr(self, field).update(added)
+            getattr(self, field).difference_update(removed)
+        for field, value in delta['fields'].items():
+            value = pickle.loads(value)
+            if field == 'RESHAPE':
+                self.resume_reshape(value)
+            elif field == 'DISK_PATHS':
+                self.DISK_PATHS[:] = value     # Shared with the backend
+            else:
+                setattr(self, field, value)
+        self.CACHE.clear()
+
+    def save_metadata(self):
+        # Disks in memory do not outlive the process, neither does their metadata
+        if self.BACKEND.VOLATILE:
+            return
+        with open(self.PATH + 'metadata.tmp', 'wb') as f:
+            f.write(self.metadata())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.PATH + 'metadata.tmp', self.PATH + 'metadata')
+
+    def load_metadata(self, raw=None):
+        if raw is None:
+            if not os.path.exists(self.PATH + 'metadata'):
+                return
+            with open(self.PATH + 'metadata', 'rb') as f:
+                raw = f.read()
+        info = pickle.loads(raw)
+        if info['geometry'] != (self.NUMBER_OF_DISKS, self.CHUNK_SIZE, self.PARITY_DISKS):
+            raise ValueError("Disks were created with (disks, chunk size, parity disks) = " + str(info['geometry']))
+        self.current_index = info['current_index']
+        self.current_disk_index = info['current_disk_index']
+        self.FILES_INFO = info['FILES_INFO']
+        self.ERASED_INFO = info['ERASED_INFO']
+        self.DISKS_INFO = info['DISKS_INFO']
+        # Metadata written before extents and disk usage were compacted
+        if isinstance(self.DISKS_INFO, list):
+            self.DISKS_INFO = allocation.disk_usage.from_rows(self.DISKS_INFO, self.NUMBER_OF_DISKS, self.CHUNK_SIZE)
+            self.FILES_INFO = dict((name, [allocation.extent.from_dict(x) for x in extents]) for name, extents in self.FILES_INFO.items())
+            self.ERASED_INFO = [allocation.extent.from_dict(x) for x in self.ERASED_INFO]
+        self.LAZY_PARITY = info.get('LAZY_PARITY', set())
+        self.READ_COUNT = info.get('READ_COUNT', {})
+        self.DISK_PATHS[:] = info.get('DISK_PATHS', self.DISK_PATHS)
+        self.SPARES = info.get('SPARES', self.SPARES)
+        self.REBUILDING = info.get('REBUILDING', {})
+        self.PACKS = info.get('PACKS', {})
+        for pack in self.PACKS.values():
+            pack['extent'] = allocation.extent.from_dict(pack['extent'])
+        self.OBJECT_INFO = info.get('OBJECT_INFO', {})
+        self.DIGESTS = info.get('DIGESTS', {})
+        self.STRIPES = info.get('STRIPES', {})
+        self.SHARED = info.get('SHARED', {})
+        self.SNAPSHOTS = info.get('SNAPSHOTS', {})
+        self.CACHE.clear()
+
+        self.resume_reshape(info.get('RESHAPE'))
+
+    ###
+    # Resume an interrupted reshape
+    ###
+    def resume_reshape(self, state):
+        if state is None:
+            self.RESHAPE = None
+        elif self.RESHAPE is None:
+            self.RESHAPE = reshape.reshape_job(self, **state)
+        else:
+            self.RESHAPE.cursor = state['cursor']
+
+    ###
+    # End of a user operation: log it in the journal, applying the journal
+    # to the disks once it holds more than JOURNAL_LIMIT bytes
+    # Every commit logs the metadata changed by the operation, which counts in the limit
+    ###
+    def commit(self):
+        if self.JOURNAL is None:
+            if self.BITMAP is not None and time.time() - self.BITMAP.last_flush >= self.BITMAP_FLUSH_DELAY:
+                self.flush_bitmap()
+            return
+        self.JOURNAL.commit(self.metadata_delta())
+        if self.JOURNAL.size > self.JOURNAL_LIMIT:
+            self.checkpoint()
+
+    ###
+    # Apply every journaled chunk to the disks and empty the journal, the
+    # metadata saved is then the base of the journaled changes
+    # Chunks of missing disks are skipped, they will be rebuilt on read
+    ###
+    def checkpoint(self):
+        if self.JOURNAL is None:
+            return
+        # Journal what changed since the last commit too: if the RAID6 stops
+        # before the journal is emptied, replaying it over the saved metadata ends at it
+        self.JOURNAL.commit(self.metadata_delta())
+        self.JOURNAL.sync()
+        for (disk, index), raw in self.JOURNAL.pending.items():
+            try:
+                self.BACKEND.write_chunk(disk, index, raw)
+            except FileNotFoundError:
+                pass
+        self.BACKEND.sync()
+        self.save_metadata()
+        self.JOURNAL.truncate()
+
+    ###
+    # Redo the operations committed in the journal before a crash, their
+    # metadata changes are applied over the metadata of the last checkpoint
+    ###
+    def replay_journal(self):
+        chunks, deltas = self.JOURNAL.replay()
+        for raw in deltas:
+            self.apply_metadata_delta(raw)
+        self.JOURNAL.pending = chunks
+        self.checkpoint()
+
+    ###
+    # Make the written chunks and the metadata durable, then clear the
+    # bitmap regions that are not being written
+    ###
+    def flush_bitmap(self):
+        self.BACKEND.sync()
+        self.save_metadata()
+        if self.BITMAP is not None:
+            self.BITMAP.flush()
+
+    ###
+    # Recompute the parity of the regions that were dirty when the RAID6
+    # was last stopped, instead of the parity of every index
+    ###
+    def resync_dirty(self):
+        regions = self.BITMAP.dirty_regions()
+        if len(regions) == 0:
+            return
+        print("[!] Unclean shutdown; Resyncing", len(regions), "region(s) ...")
+        for region in regions:
+            start = region * self.BITMAP.REGION_SIZE
+            for index in range(start, min(start + self.BITMAP.REGION_SIZE, len(self.DISKS_INFO))):
+                self.restore_parity(index)
+        self.BITMAP.mark_clean_all()
+        self.flush_bitmap()
+
+    ###
+    # Flush everything to the disks, the RAID6 can then be reopened with reset=False
+    ###
+    @synchronized
+    def close(self):
+        self.SPARE_MANAGER.stop()
+        if self.RESHAPE is not None:
+            self.RESHAPE.stop()
+            self.RESHAPE.target.close()
+        if self.JOURNAL is not None:
+            self.checkpoint()
+            self.JOURNAL.close()
+        else:
+            self.flush_bitmap()
+        self.PREFETCHER.close()
+        self.LANES.shutdown()
+        self.BACKEND.close()
 
     ###
     # Simple function allowing to increase the disk index to know where to write next
     ###
     def increase_disk_index(self, ret=False):
-        self.current_disk_index = (self.current_disk_index + 1) % (self.NUMBER_OF_DISKS - 2)
+        self.current_disk_index = (self.current_disk_index + 1) % self.P_INDEX
 
     ###
     # Simple function allowing to update the disk info to know if a block is 
     # full.
     ###
     def update_disk_info(self, index, disk_index, length):
-        try:
-            self.DISKS_INFO[index][disk_index] = length
-        except:
-            self.DISKS_INFO.append([0 for i in range(self.NUMBER_OF_DISKS)]) 
-            self.DISKS_INFO[index][disk_index] = length
+        self.DISKS_INFO.set(index, disk_index, length)
+
+    ###
+    # Read all the values stored in the chunk of a disk at a given index
+    # Raise an exception if the disk or the chunk is missing
+    # A chunk stored as a hole is read as zeros without reading the disk, which
+    # must still be there so failed disks are found by any read
+    ###
+    def read_chunk(self, disk, index):
+        if self.DISKS_INFO.is_zero(index, disk):
+            if not self.BACKEND.exists(disk):
+                raise FileNotFoundError("Disk " + str(disk) + " is missing")
+            return [0] * self.CHUNK_SIZE
+        raw = None
+        if self.JOURNAL is not None:
+            raw = self.JOURNAL.lookup(disk, index)
+        if raw is None:
+            start = time.perf_counter()
+            raw = self.BACKEND.read_chunk(disk, index)
+            self.LATENCY.record(disk, time.perf_counter() - start)
+        count = len(raw) // self.VALUE_SIZE
+        values = struct.unpack(str(count) + self.WRITING_INFO, raw[:count * self.VALUE_SIZE])
+        return [x + self.VALUE_SHIFT for x in values]
+
+    ###
+    # Store values in the chunk of a disk at a given index, padding it with
+    # 0 up to length values
+    # Every chunk write goes through here so the cached index is dropped
+    # With a journal the chunk is only logged, it reaches the disk at the next checkpoint
+    ###
+    def write_chunk(self, disk, index, values, length=0):
+        # A disk being rebuilt must have this index rebuilt before it changes
+        if len(self.REBUILDING) > 0:
+            self.rebuild_index(index)
+
+        raw = self.place_chunk(disk, index, values, length)
+        if self.BITMAP is not None:
+            self.BITMAP.mark_dirty(index)
+        if raw is None:
+            # The journal would only be replayed over the hole, the old chunk is left in place
+            if self.JOURNAL is None:
+                self.BACKEND.discard(disk, index)
+        elif self.JOURNAL is not None:
+            self.JOURNAL.append(disk, index, raw)
+        else:
+            self.BACKEND.write_chunk(disk, index, raw)
+        self.CACHE.invalidate(index)
+        self.PREFETCHER.invalidate(index)
+
+    ###
+    # Bytes to store for a chunk, None when the chunk only holds zeros and is
+    # stored as a hole (flagged in DISKS_INFO, nothing written)
+    ###
+    def place_chunk(self, disk, index, values, length=0):
+        if self.ZERO_CHUNKS and max(len(values), length) == self.CHUNK_SIZE and not any(values):
+            self.DISKS_INFO.set_zero(index, disk, True)
+            return None
+        if self.DISKS_INFO.is_zero(index, disk):
+            self.DISKS_INFO.set_zero(index, disk, False)
+        return self.pack_chunk(values, length)
+
+    def pack_chunk(self, values, length=0):
+        values = [int(x) - self.VALUE_SHIFT for x in values]
+        if len(values) < length:
+            values.extend([-self.VALUE_SHIFT] * (length - len(values)))
+        return struct.pack(str(len(values)) + self.WRITING_INFO, *values)
+
+    ###
+    # Write several chunks [(disk, index, values[, length]), ...], at once on
+    # their disks with PARALLEL_IO (or parallel=True)
+    # Journaled chunks are only logged, they are written one after the other
+    ###
+    def write_chunks(self, writes, parallel=None):
+        if parallel is None:
+            parallel = self.PARALLEL_IO
+        if not parallel or self.JOURNAL is not None or len(writes) < 2:
+            for write in writes:
+                self.write_chunk(*write)
+            return
+
+        indexes = set(write[1] for write in writes)
+        if len(self.REBUILDING) > 0:
+            for index in indexes:
+                self.rebuild_index(index)
+        if self.BITMAP is not None:
+            for index in indexes:
+                self.BITMAP.mark_dirty(index)
+        calls = []
+        for write in writes:
+            raw = self.place_chunk(*write)
+            if raw is None:
+                calls.append((write[0], self.BACKEND.discard, (write[0], write[1])))
+            else:
+                calls.append((write[0], self.BACKEND.write_chunk, (write[0], write[1], raw)))
+        results = self.LANES.run(calls)
+        for index in indexes:
+            self.CACHE.invalidate(index)
+            self.PREFETCHER.invalidate(index)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    ###
+    # Data chunks of an index being written wait here with PARALLEL_IO, to be
+    # written together right before the parity of the index
+    ###
+    def queue_chunk(self, disk, index, values, length=0):
+        if not self.PARALLEL_IO:
+            return self.write_chunk(disk, index, values, length)
+        # Rebuilt now, the usage of the index changes before its chunks are written
+        if len(self.REBUILDING) > 0:
+            self.rebuild_index(index)
+        self.QUEUED.append((disk, index, list(values), length))
+
+    def flush_chunks(self):
+        if len(self.QUEUED) > 0:
+            writes, self.QUEUED = self.QUEUED, []
+            self.write_chunks(writes)
 
-            
 
     def restore_parity(self, index_number):
+        self.flush_chunks()
+        if index_number in self.LAZY_PARITY:
+            self.initialize_lazy_index(index_number)
+
         # Get chunk data from the index
         data, par = self.read_one_chunk(index_number,self_recovering=False)
-        current_data = [[] for loop in range(self.CHUNK_SIZE)]
-        for x in data:
-            for i in range(len(x)):
-                current_data[i].append(x[i])
+        if self.erasure is not None:
+            return self.restore_erasure_parity(index_number, data)
 
         # Compute P and Q list on a byte to byte basis
-        P = []
-        Q = []
-        for x in current_data:
-            if len(x) > 0:
-                P.append(self.parity.compute_P(x))
-                Q.append(self.parity.compute_Q(x))
+        P, Q = self.parity.encode(data)
 
         self.update_disk_info(index_number, (self.P_INDEX + index_number) % self.NUMBER_OF_DISKS, len(P))
         self.update_disk_info(index_number, (self.Q_INDEX + index_number) % self.NUMBER_OF_DISKS, len(Q))
 
         # Store the parity
-        with open(self.PATH + 'disk_' + str((self.P_INDEX + index_number) % self.NUMBER_OF_DISKS) + '/' + str(index_number), 'wb') as f:
-            for x in P:
-                f.write(struct.pack(self.WRITING_INFO, x - (pow(2,self.NUMBER_OF_DISKS)//2)))
-        with open(self.PATH + 'disk_' + str((self.Q_INDEX + index_number) % self.NUMBER_OF_DISKS) + '/' + str(index_number), 'wb') as f:
-            for x in Q: 
-                f.write(struct.pack(self.WRITING_INFO, x - (pow(2,self.NUMBER_OF_DISKS)//2))) #for example -128 to 128 for 2^8 (8 disks case)
+        self.write_chunks([((self.P_INDEX + index_number) % self.NUMBER_OF_DISKS, index_number, P),
+                           ((self.Q_INDEX + index_number) % self.NUMBER_OF_DISKS, index_number, Q)])
+        if self.BITMAP is not None:
+            self.BITMAP.mark_clean(index_number)
 
 
+    ###
+    # A free index skipped by a rebuild has no chunk on the rebuilt disks
+    # Zero fill them before the index is used again
+    ###
+    def initialize_lazy_index(self, index_number):
+        self.LAZY_PARITY.discard(index_number)
+        for disk in range(self.NUMBER_OF_DISKS):
+            try:
+                self.read_chunk(disk, index_number)
+            except Exception:
+                self.write_chunk(disk, index_number, [], self.CHUNK_SIZE)
+
+    ###
+    # Compute and store the M Reed-Solomon parity chunks of an index
+    # Missing or short data chunks count as zeros
+    ###
+    def restore_erasure_parity(self, index_number, data):
+        data = [x + [0] * (self.CHUNK_SIZE - len(x)) for x in data]
+        writes = []
+        for j, chunk in enumerate(self.erasure.encode(data)):
+            disk = (self.P_INDEX + j + index_number) % self.NUMBER_OF_DISKS
+            self.update_disk_info(index_number, disk, self.CHUNK_SIZE)
+            writes.append((disk, index_number, chunk))
+        self.write_chunks(writes)
+        if self.BITMAP is not None:
+            self.BITMAP.mark_clean(index_number)
+
     ###
     # Write data to RAID6 disks with the associated name
     # Will create a temporary file in disks/
@@ -118,25 +616,77 @@ class RAID6:
     # Write data to RAID 6 with the associated name from the file
     # If we want to write the file to a specific chunk, give a list in chunk_to_write
     # Offset allow to write from a certain part of the file (update)
+    # With name=None the data is written but not added to FILES_INFO
+    # compress ('zlib' or 'lzma', with an optional level) compresses the data before
+    # striping it, unless it turns out to be incompressible
     ###
-    def write_data_from_file(self, file, name, chunk_to_write=[], offset=0):
+    @synchronized
+    def write_data_from_file(self, file, name, chunk_to_write=[], offset=0, compress=None, level=None):
+        # Objects written during a reshape go to the new geometry
+        if self.RESHAPE is not None and name is not None and len(chunk_to_write) == 0:
+            if name in self.FILES_INFO:
+                self.delete_data(name)
+            return self.RESHAPE.target.write_data_from_file(file, name, offset=offset, compress=compress, level=level)
+
+        # Raw extents cannot be added to a compressed object, nor compressed ones to
+        # a raw object: the object is rewritten whole, with the data at its end
+        if name in self.FILES_INFO and len(chunk_to_write) == 0 and (name in self.OBJECT_INFO or compress is not None):
+            with open(file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            if compress is None:
+                return self.rewrite_object(name, self.object_size(name), data)
+            codec, current = self.compression(name)
+            if level is None and compress == codec:
+                level = current
+            data = self.read_object(name) + data
+            self.delete_data(name)
+            with open(self.PATH + 'temp_range', 'wb') as f:
+                f.write(data)
+            return self.write_data_from_file(self.PATH + 'temp_range', name, compress=compress, level=level)
+
+        # Writing an existing name without extents adds to the object, its tree is recomputed when needed
+        if name is not None:
+            if name in self.FILES_INFO and len(chunk_to_write) == 0:
+                self.DIGESTS.pop(name, None)
+            else:
+                self.DIGESTS[name] = merkle.merkle_tree.from_file(file, self.DIGEST_BLOCK_SIZE)
+
+        if compress is not None and name is not None:
+            file = self.compress_file(file, name, compress, level)
+
+        # Only the file from offset is written
         stat_info = os.stat(file)
-        size = stat_info.st_size
+        size = stat_info.st_size - offset
+
+        if self.DEDUP and name is not None and len(chunk_to_write) == 0 and compress is None and \
+                size >= self.P_INDEX * self.CHUNK_SIZE:
+            return self.write_deduplicated(file, name, offset)
         
         # Determining if the data can be write on previously used data
         if len(chunk_to_write) == 0:
             places_to_write = []
             for x in self.ERASED_INFO[:]:
-                places_to_write.append(x)
                 self.ERASED_INFO.remove(x)
+                if size < x['length']:
+                    # Only use the chunks needed, the remaining ones stay free
+                    used_chunks = -(-size // self.CHUNK_SIZE)
+                    first = x['index'] * self.P_INDEX + x['disk'] + used_chunks
+                    if x['length'] - used_chunks * self.CHUNK_SIZE > 0:
+                        self.ERASED_INFO.append(allocation.extent(first // self.P_INDEX, first % self.P_INDEX, 0, x['length'] - used_chunks * self.CHUNK_SIZE))
+                    x = allocation.extent(x['index'], x['disk'], 0, size)
+                places_to_write.append(x)
                 size -= x['length']
                 if size <= 0:
                     break
             if size > 0:
-                places_to_write.append({'index': self.current_index, 'disk': self.current_disk_index, 'offset': 0, 'length': size})
+                places_to_write.append(allocation.extent(self.current_index, self.current_disk_index, 0, size))
         else:
             places_to_write = chunk_to_write
 
+        # Chunks left queued by a write that failed are dropped
+        self.QUEUED = []
+
         # Opening the input file
         with open(file, "rb") as in_file:
             # Setting the offset accordingly
@@ -176,10 +726,7 @@ class RAID6:
                 # Loading data if we have an offset
                 lenght_data = starting_offset
                 if heading_offset > 0:
-                    chunk_data = []
-                    with open(self.PATH + 'disk_' + str((disk + index) % self.NUMBER_OF_DISKS) + '/' + str(index), 'rb') as f:
-                        for _ in range(heading_offset):
-                            chunk_data.append(struct.unpack("b", f.read(1))[0] + 128)
+                    chunk_data = self.read_chunk((disk + index) % self.NUMBER_OF_DISKS, index)[:heading_offset]
                 else:
                     chunk_data = []
 
@@ -196,10 +743,7 @@ class RAID6:
 
                     # Writing the data to one disk
                     if (len(chunk_data) == self.CHUNK_SIZE):
-                        with open(self.PATH + 'disk_' + str((disk + index) % self.NUMBER_OF_DISKS) + '/' + str(index), 'wb') as f:
-                            for j in range(self.CHUNK_SIZE):
-                                x = chunk_data[j]
-                                f.write(struct.pack(self.WRITING_INFO, x - (pow(2,self.NUMBER_OF_DISKS)//2))) # write an int                            
+                        self.queue_chunk((disk + index) % self.NUMBER_OF_DISKS, index, chunk_data)
                         
                         # Updating RAID6 writing data
                         self.update_disk_info(index, (disk + index) % self.NUMBER_OF_DISKS, self.CHUNK_SIZE)
@@ -216,14 +760,8 @@ class RAID6:
                     
                 # If there is a uncomplete chunk, write trailing 0 to have proper parity calculation
                 if len(chunk_data) > 0:
-                    with open(self.PATH + 'disk_' + str((index + disk) % self.NUMBER_OF_DISKS) + '/' + str(index), 'wb') as f:
-                        for j in range(len(chunk_data)):
-                            x = chunk_data[j]
-                            f.write(struct.pack(self.WRITING_INFO, x - (pow(2,self.NUMBER_OF_DISKS)//2))) # write an int
-
-                        for j in range(len(chunk_data), self.CHUNK_SIZE):	
-                            f.write(struct.pack(self.WRITING_INFO, 0 - (pow(2,self.NUMBER_OF_DISKS))//2)) # write an int	
-                    self.update_disk_info(self.current_index, (index + disk) % self.NUMBER_OF_DISKS, len(chunk_data))
+                    self.queue_chunk((index + disk) % self.NUMBER_OF_DISKS, index, chunk_data, self.CHUNK_SIZE)
+                    self.update_disk_info(index, (index + disk) % self.NUMBER_OF_DISKS, len(chunk_data))
                     if live:
                         self.increase_disk_index()
                     disk += 1
@@ -239,13 +777,157 @@ class RAID6:
 
 
                 # Write the file info to the FILES_INFO index
+                if name is None:
+                    continue
                 try:
-                    self.FILES_INFO[name].append({'index':starting_index, 'disk':starting_disk, 'offset':0, 'length':lenght_data})
+                    self.FILES_INFO[name].append(allocation.extent(starting_index, starting_disk, 0, lenght_data))
                 except:
-                    self.FILES_INFO[name] = [{'index':starting_index, 'disk':starting_disk, 'offset':0, 'length':lenght_data}]
+                    self.FILES_INFO[name] = [allocation.extent(starting_index, starting_disk, 0, lenght_data)]
 
+        self.flush_chunks()
+        self.commit()
         return True
 
+    ###
+    # Write an object stripe by stripe, a stripe (the data chunks of an index)
+    # already stored for this or another object is only referenced
+    # New stripes start on a fresh index, the end of the object that does not
+    # fill a stripe is written as usual
+    ###
+    def write_deduplicated(self, file, name, offset=0):
+        stripe = self.P_INDEX * self.CHUNK_SIZE
+        extents = []
+        new = []
+        with open(file, 'rb') as in_file:
+            in_file.seek(offset)
+            while True:
+                data = in_file.read(stripe)
+                if len(data) < stripe:
+                    break
+                fingerprint = hashlib.sha256(data).digest()
+                if fingerprint in self.STRIPES:
+                    self.STRIPES[fingerprint]['refs'] += 1
+                else:
+                    self.STRIPES[fingerprint] = {'extent': None, 'refs': 1}
+                    new.append((fingerprint, data))
+                extents.append(fingerprint)
+
+        if len(new) > 0:
+            self.align_index()
+        first = self.current_index
+        for i, (fingerprint, data) in enumerate(new):
+            self.STRIPES[fingerprint]['extent'] = allocation.extent(first + i, 0, 0, stripe)
+        self.FILES_INFO.setdefault(name, []).extend(allocation.extent(self.STRIPES[fingerprint]['extent']['index'], 0, 0, stripe,
+                                                                      fingerprint=fingerprint) for fingerprint in extents)
+
+        if len(new) > 0:
+            with open(self.PATH + 'temp_dedup', 'wb') as f:
+                for fingerprint, data in new:
+                    f.write(data)
+            self.write_data_from_file(self.PATH + 'temp_dedup', None,
+                                      chunk_to_write=[allocation.extent(first, 0, 0, len(new) * stripe)])
+
+        rest = offset + len(extents) * stripe
+        if os.stat(file).st_size > rest:
+            # The tree of the whole object was computed before
+            tree = self.DIGESTS.get(name)
+            self.write_data_from_file(file, name, offset=rest)
+            if tree is not None:
+                self.DIGESTS[name] = tree
+        else:
+            self.commit()
+        return True
+
+    ###
+    # Move the write position to the start of the next index, the rest of the
+    # current index is left free
+    ###
+    def align_index(self):
+        if self.current_disk_index > 0:
+            self.ERASED_INFO.append(allocation.extent(self.current_index, self.current_disk_index, 0,
+                                                      (self.P_INDEX - self.current_disk_index) * self.CHUNK_SIZE))
+            self.current_index += 1
+            self.current_disk_index = 0
+
+    ###
+    # Write whole stripes from the next index with their parity already
+    # computed, [[parity chunk, ...], ...] one list per stripe (see parity.encode)
+    # buffer holds the data chunks one after the other, the chunks past
+    # length bytes are left unwritten
+    # Every chunk of the stripes is written at once on its disk
+    # Return the first index written
+    ###
+    def write_stripes(self, buffer, parities, length):
+        self.align_index()
+        first = self.current_index
+        chunks = -(-length // self.CHUNK_SIZE)
+        writes = []
+        usage = []
+        for c in range(chunks):
+            index = first + c // self.P_INDEX
+            disk = (index + c % self.P_INDEX) % self.NUMBER_OF_DISKS
+            writes.append((disk, index, list(buffer[c * self.CHUNK_SIZE:(c + 1) * self.CHUNK_SIZE]), self.CHUNK_SIZE))
+            usage.append((index, disk, min(self.CHUNK_SIZE, length - c * self.CHUNK_SIZE)))
+        for s, chunk_parities in enumerate(parities):
+            for r, chunk in enumerate(chunk_parities):
+                disk = (self.P_INDEX + r + first + s) % self.NUMBER_OF_DISKS
+                writes.append((disk, first + s, chunk))
+                usage.append((first + s, disk, len(chunk)))
+        self.write_chunks(writes, parallel=True)
+
+        # Set once written, the chunks of a disk being rebuilt are rebuilt first
+        for index, disk, used in usage:
+            self.update_disk_info(index, disk, used)
+        if self.BITMAP is not None:
+            for s in range(len(parities)):
+                self.BITMAP.mark_clean(first + s)
+        self.current_index = first + chunks // self.P_INDEX
+        self.current_disk_index = chunks % self.P_INDEX
+        return first
+
+    ###
+    # Number of deduplicated stripes, references to them and bytes saved
+    ###
+    def dedup_stats(self):
+        stripe = self.P_INDEX * self.CHUNK_SIZE
+        references = sum(x['refs'] for x in self.STRIPES.values())
+        return {'stripes': len(self.STRIPES), 'references': references,
+                'saved_bytes': (references - len(self.STRIPES)) * stripe}
+
+    ###
+    # Compress a file to a temporary file and record the codec and level in OBJECT_INFO
+    # Return the file to write, the original one if compressing is not worth it
+    ###
+    def compress_file(self, file, name, codec, level=None):
+        if codec not in self.CODECS:
+            raise ValueError("Unknown codec: " + str(codec))
+        compressor = self.CODECS[codec][0]
+        with open(file, 'rb') as f:
+            data = f.read()
+
+        # Incompressible data (e.g. JPEG) is detected on a sample
+        sample = data[:self.COMPRESSION_SAMPLE]
+        if len(sample) == 0 or len(compressor(sample, 1 if codec == 'zlib' else 0)) >= len(sample) * self.COMPRESSION_RATIO:
+            return file
+        compressed = compressor(data, level)
+        if len(compressed) >= len(data) * self.COMPRESSION_RATIO:
+            return file
+
+        with open(self.PATH + 'temp_compressed', 'wb') as f:
+            f.write(compressed)
+        self.OBJECT_INFO[name] = {'codec': codec, 'level': level, 'size': len(data), 'stored': len(compressed)}
+        return self.PATH + 'temp_compressed'
+
+    ###
+    # Codec and level an object was compressed with, (None, None) for a raw object
+    # Objects are rewritten with both, so they stay compressed the same way
+    ###
+    def compression(self, name):
+        info = self.OBJECT_INFO.get(name)
+        if info is None:
+            return None, None
+        return info['codec'], info.get('level')
+
     ###
     # Determining if an index is the P_index since P is store in a cyclic way
     ###
@@ -273,63 +955,264 @@ class RAID6:
     # Some disks can be excluded while recovering data
     # Self recovering can be turned off in order to accomodate reading incomplete index
     ###
+    @synchronized
     def read_one_chunk(self, chunk_index, exclude=[], already_recovered=False, self_recovering=True):
         # If trying to read out of bounds indexes
         if chunk_index > self.current_index:
             return False
-        data = [[] for loop in range(self.NUMBER_OF_DISKS - 2)]
-        p = []
-        q = []
+
+        # Plain reads are served from the cache when possible
+        cacheable = len(exclude) == 0 and self_recovering
+        if cacheable:
+            cached = self.CACHE.get(chunk_index)
+            if cached is not None:
+                return cached
+
+            # Chunks of disks not rebuilt yet are recomputed from the other disks
+            degraded = self.degraded_disks(chunk_index)
+            if len(degraded) > 0:
+                return self.degraded_read(chunk_index, degraded)
+
+            self.PREFETCHER.access(chunk_index)
+            prefetched = self.PREFETCHER.take(chunk_index)
+            if prefetched is not None:
+                result = self.use_prefetched(chunk_index, prefetched)
+                if result is not None:
+                    self.CACHE.put(chunk_index, result, sum(len(x) for x in result[0] + list(result[1])) * self.VALUE_SIZE)
+                    return result
+
+            if self.HEDGED_READS:
+                chunks = self.hedged_read(chunk_index)
+                result = None if chunks is None else self.use_prefetched(chunk_index, chunks)
+                if result is not None:
+                    self.CACHE.put(chunk_index, result, sum(len(x) for x in result[0] + list(result[1])) * self.VALUE_SIZE)
+                    return result
+
+        data = [[] for loop in range(self.P_INDEX)]
+        parities = [[] for loop in range(self.PARITY_DISKS)]
         failed = []
 
+        # Chunks read at once on all the disks
+        fetched = {}
+        if self.PARALLEL_IO:
+            disks = [disk for disk in range(self.NUMBER_OF_DISKS) if disk not in exclude]
+            fetched = dict(zip(disks, self.LANES.run([(disk, self.read_chunk, (disk, chunk_index)) for disk in disks])))
+
         ### MAIN READING LOOP ###
         for i in range(self.NUMBER_OF_DISKS):
+            disk = (chunk_index + i) % self.NUMBER_OF_DISKS
             # Ignoring excluded disks
-            if (chunk_index + i) % self.NUMBER_OF_DISKS in exclude:
+            if disk in exclude:
                 continue
             try:
                 # Reading and storing data in lists
-                with open(self.PATH + 'disk_' + str((chunk_index + i) % self.NUMBER_OF_DISKS) + '/' + str(chunk_index), 'rb') as f:
-                    for _ in range(self.CHUNK_SIZE):
-                        if self.WRITING_INFO=='b':
-                            readbyte=1
-                        else:
-                            readbyte=8
-                        try:
-                            # since parity P and Q when using larger configurations set than 6+2 are more than 1 byte of data, we use 'long long int' which is 'q' for struct.pack/ unpack
-                            # thus we read by f.read(8) since 'q' takes 8 bytes of space.
-                            if i % self.NUMBER_OF_DISKS == self.P_INDEX:
-                                p.append(struct.unpack(self.WRITING_INFO, f.read(readbyte))[0] + (pow(2,self.NUMBER_OF_DISKS)//2))
-                            elif i % self.NUMBER_OF_DISKS == self.Q_INDEX:
-                                q.append(struct.unpack(self.WRITING_INFO, f.read(readbyte))[0] + (pow(2,self.NUMBER_OF_DISKS)//2))
-                            else:
-                                data[i].append(struct.unpack(self.WRITING_INFO, f.read(readbyte))[0] + (pow(2,self.NUMBER_OF_DISKS)//2))
-                        except Exception as e: 
-                            break
-            
+                # since parity P and Q when using larger configurations set than 6+2 are more than 1 byte of data, we use 'long long int' which is 'q' for struct.pack/ unpack
+                values = fetched[disk] if disk in fetched else self.read_chunk(disk, chunk_index)
+                if isinstance(values, Exception):
+                    raise values
             # If a disk fails logging it
             except Exception as e: 
                 #print(e)
-                if self_recovering and self.DISKS_INFO[chunk_index][(chunk_index + i) % self.NUMBER_OF_DISKS] > 0:
-                    failed.append((chunk_index + i) % self.NUMBER_OF_DISKS)
+                if self_recovering and self.DISKS_INFO.get(chunk_index, disk) > 0:
+                    failed.append(disk)
+                continue
+
+            if i >= self.P_INDEX:
+                parities[i - self.P_INDEX] = values
+            else:
+                data[i] = values
 
         # If a disk have failed and self recovery activated, trying to recover it
         if len(failed) > 0 and self_recovering: 
             if self.ENFORCING_CHECK and len(exclude) == 0:
                 if not already_recovered:            
+                    # Swap spares in and keep serving degraded reads while they are rebuilt
+                    if self.SPARE_MANAGER.replace(failed):
+                        return self.degraded_read(chunk_index, failed)
+                    # No in place recovery while other disks are being rebuilt
+                    if len(self.REBUILDING) > 0:
+                        return self.degraded_read(chunk_index, failed + self.degraded_disks(chunk_index))
                     print("[!] Error disk:",failed,"; Attempting recovery ...")
+                    busy = set(self.BITMAP.writing) if self.BITMAP is not None else set()
                     self.recovering_disks(failed)
+                    # The rebuilt indexes match their parity again, the ones
+                    # an operation was already writing stay dirty
+                    if self.BITMAP is not None:
+                        for index in self.lost_indexes(failed):
+                            if index not in busy:
+                                self.BITMAP.mark_clean(index)
+                    self.commit()
                     return self.read_one_chunk(chunk_index, exclude, True)
                 else:
                     raise IOError("Unrecoverable error")
 
-                if p != self.parity.compute_P(data) or q != self.parity.compute_Q(data):
+                if parities[0] != self.parity.compute_P(data) or parities[-1] != self.parity.compute_Q(data):
                     raise IOError("Error")
                 
         # Disk successfully recovered
         if already_recovered:
             print("[✓] Error recovered !")
-        return data, (p,q)
+        if cacheable and len(failed) == 0:
+            self.CACHE.put(chunk_index, (data, tuple(parities)), sum(len(x) for x in data + parities) * self.VALUE_SIZE)
+        return data, tuple(parities)
+
+    ###
+    # Split the chunks read by the prefetcher in data and parity
+    # Return None if a chunk that should exist is missing, the normal read
+    # path then takes care of the recovery
+    ###
+    def use_prefetched(self, chunk_index, chunks):
+        for position, x in enumerate(chunks):
+            if x is None:
+                if self.DISKS_INFO.get(chunk_index, (chunk_index + position) % self.NUMBER_OF_DISKS) > 0:
+                    return None
+                chunks[position] = []
+        return chunks[:self.P_INDEX], tuple(chunks[self.P_INDEX:])
+
+    ###
+    # Read the chunks of all the members of an index, by position in the index
+    # A chunk that could not be read is None
+    ###
+    def read_members(self, chunk_index):
+        if self.HEDGED_READS:
+            chunks = self.hedged_read(chunk_index)
+            if chunks is not None:
+                return chunks
+        disks = [(chunk_index + position) % self.NUMBER_OF_DISKS for position in range(self.NUMBER_OF_DISKS)]
+        if self.PARALLEL_IO:
+            chunks = self.LANES.run([(disk, self.read_chunk, (disk, chunk_index)) for disk in disks])
+            return [None if isinstance(chunk, Exception) else chunk for chunk in chunks]
+        chunks = []
+        for disk in disks:
+            try:
+                chunks.append(self.read_chunk(disk, chunk_index))
+            except Exception:
+                chunks.append(None)
+        return chunks
+
+    ###
+    # Read all the members of an index at once, and once the latency budget is
+    # spent rebuild the chunks still late from the parity rather than waiting
+    # for a slow disk, as soon as enough chunks arrived to do so
+    # Return None when a chunk could not be read or no latency is known yet
+    ###
+    def hedged_read(self, chunk_index):
+        budget = self.LATENCY.budget(self.HEDGE_FACTOR)
+        if budget is None or chunk_index >= len(self.DISKS_INFO):
+            return None
+
+        futures = {}
+        backlogged = []
+        for position in range(self.NUMBER_OF_DISKS):
+            disk = (chunk_index + position) % self.NUMBER_OF_DISKS
+            if self.LANES.backlog[disk] > self.HEDGE_BACKLOG:
+                backlogged.append(position)
+            else:
+                futures[self.LANES.submit(disk, self.read_chunk, disk, chunk_index)] = position
+        if len(backlogged) > self.PARITY_DISKS:
+            backlogged = []
+            for position in range(self.NUMBER_OF_DISKS):
+                if position not in futures.values():
+                    disk = (chunk_index + position) % self.NUMBER_OF_DISKS
+                    futures[self.LANES.submit(disk, self.read_chunk, disk, chunk_index)] = position
+        done, late = concurrent.futures.wait(futures, timeout=budget)
+        while len(late) + len(backlogged) > self.PARITY_DISKS:
+            arrived, late = concurrent.futures.wait(late, return_when=concurrent.futures.FIRST_COMPLETED)
+            done |= arrived
+
+        chunks = [[] for loop in range(self.NUMBER_OF_DISKS)]
+        for future in done:
+            position = futures[future]
+            try:
+                chunks[position] = future.result()
+            except Exception:
+                if self.DISKS_INFO.get(chunk_index, (chunk_index + position) % self.NUMBER_OF_DISKS) > 0:
+                    return None
+
+        # Late chunks are left to their reader, the index is rebuilt without them
+        missing = []
+        for position in [futures[future] for future in late] + backlogged:
+            disk = (chunk_index + position) % self.NUMBER_OF_DISKS
+            if self.DISKS_INFO.get(chunk_index, disk) > 0:
+                missing.append(position)
+                self.LATENCY.record_hedged(disk)
+        if len(missing) == 0:
+            return chunks
+        data, par = self.decode_index(chunks[:self.P_INDEX], tuple(chunks[self.P_INDEX:]), sorted(missing))
+        return list(data) + list(par)
+
+    ###
+    # Disks being rebuilt that do not hold this index yet
+    ###
+    def degraded_disks(self, chunk_index):
+        return [disk for disk, done in self.REBUILDING.items() if chunk_index not in done]
+
+    ###
+    # Read an index without some disks, recomputing their chunks with the parity
+    ###
+    def degraded_read(self, chunk_index, missing_disks):
+        data, par = self.read_one_chunk(chunk_index, exclude=missing_disks, self_recovering=False)
+        missing = set((disk - chunk_index) % self.NUMBER_OF_DISKS for disk in missing_disks)
+
+        # Other chunks that should be there but could not be read
+        for position, x in enumerate(list(data) + list(par)):
+            if len(x) == 0 and self.DISKS_INFO.get(chunk_index, (chunk_index + position) % self.NUMBER_OF_DISKS) > 0:
+                missing.add(position)
+
+        return self.decode_index(data, par, sorted(missing))
+
+    ###
+    # Fill the missing chunks (given by their position in the index) of an index
+    # Data chunks are padded to CHUNK_SIZE
+    ###
+    def decode_index(self, data, par, missing):
+        if len(missing) > self.PARITY_DISKS:
+            raise IOError("Unrecoverable error")
+        data = [list(x) + [0] * (self.CHUNK_SIZE - len(x)) for x in data]
+
+        if self.erasure is not None:
+            chunks = []
+            for position, x in enumerate(data + [list(x) + [0] * (self.CHUNK_SIZE - len(x)) for x in par]):
+                chunks.append(None if position in missing else x)
+            rebuilt = [[int(v) for v in x] for x in self.erasure.reconstruct(chunks)]
+            return rebuilt[:self.P_INDEX], tuple(rebuilt[self.P_INDEX:])
+
+        P, Q = par
+        lost = [position for position in missing if position < self.P_INDEX]
+        packed = [[x[k] for x in data] for k in range(self.CHUNK_SIZE)]
+        for k in range(self.CHUNK_SIZE):
+            if len(lost) == 2:
+                packed[k][lost[0]], packed[k][lost[1]] = self.parity.recover_two_chunk(packed[k], P[k], Q[k], lost[0], lost[1])
+            elif len(lost) == 1 and self.P_INDEX not in missing:
+                packed[k][lost[0]] = self.parity.recover_one_chunk_with_P(packed[k], P[k])
+            elif len(lost) == 1:
+                packed[k][lost[0]] = self.parity.recover_one_chunk_with_Q(packed[k], Q[k], lost[0])
+
+        data = [[x[i] for x in packed] for i in range(self.P_INDEX)]
+        if self.P_INDEX in missing:
+            P = [self.parity.compute_P(x) for x in packed]
+        if self.Q_INDEX in missing:
+            Q = [self.parity.compute_Q(x) for x in packed]
+        return data, (P, Q)
+
+    ###
+    # Write the chunks of an index missing on the disks being rebuilt
+    ###
+    def rebuild_index(self, index):
+        missing_disks = self.degraded_disks(index)
+        if len(missing_disks) == 0:
+            return
+        for disk in missing_disks:
+            self.REBUILDING[disk].add(index)
+        if index >= len(self.DISKS_INFO):
+            return
+
+        missing_disks = [disk for disk in missing_disks if self.DISKS_INFO.get(index, disk) > 0]
+        if len(missing_disks) == 0:
+            return
+        data, par = self.degraded_read(index, missing_disks)
+        chunks = list(data) + list(par)
+        self.write_chunks([(disk, index, chunks[(disk - index) % self.NUMBER_OF_DISKS]) for disk in missing_disks])
 
     ###
     # Read data to console given an index, disk and length to read
@@ -350,7 +1233,7 @@ class RAID6:
         # While data to be read
         while i < length:
             data, par = self.read_one_chunk(local_index)
-            i += self.CHUNK_SIZE * (self.NUMBER_OF_DISKS - 2)
+            i += self.CHUNK_SIZE * self.P_INDEX
             final_data.extend(data)
             local_index += 1
         
@@ -394,7 +1277,7 @@ class RAID6:
                 chunk_data = data[j]
 
                 if (i + len(chunk_data) <= length):
-                    size_readable = self.DISKS_INFO[local_index][self.actual_disk_index(local_index, j)]
+                    size_readable = self.DISKS_INFO.get(local_index, self.actual_disk_index(local_index, j))
                     chunk_data = chunk_data[:size_readable]
                     i += len(chunk_data[:size_readable])
                     out_file.write(bytes(chunk_data[:size_readable]))
@@ -412,7 +1295,7 @@ class RAID6:
                 for j in range(len(data)):
                     chunk_data = data[j]
                     if (i + len(chunk_data) <= length):
-                        size_readable = self.DISKS_INFO[local_index][self.actual_disk_index(local_index, j)]
+                        size_readable = self.DISKS_INFO.get(local_index, self.actual_disk_index(local_index, j))
                         chunk_data = chunk_data[:size_readable]
                         i += len(chunk_data[:size_readable])
                         out_file.write(bytes(chunk_data[:size_readable]))
@@ -425,29 +1308,106 @@ class RAID6:
         return True
 
 
+    ###
+    # Read the bytes of an extent of FILES_INFO
+    # The offset of the extent is a number of bytes from the start of its first chunk
+    ###
+    def read_extent(self, extent):
+        position = extent['index'] * self.P_INDEX + extent['disk'] + extent['offset'] // self.CHUNK_SIZE
+        skip = extent['offset'] % self.CHUNK_SIZE
+        remaining = extent['length']
+        out = bytearray()
+        while remaining > 0:
+            index = position // self.P_INDEX
+            data, par = self.read_one_chunk(index)
+            for j in range(position % self.P_INDEX, self.P_INDEX):
+                chunk_data = data[j][skip:skip + remaining]
+                if len(chunk_data) == 0:
+                    raise IOError("Missing chunk at index " + str(index))
+                out.extend(bytes(chunk_data))
+                remaining -= len(chunk_data)
+                skip = 0
+                if remaining <= 0:
+                    break
+            position = (index + 1) * self.P_INDEX
+        return bytes(out)
+
+    ###
+    # Indexes spanned by an extent of FILES_INFO or ERASED_INFO
+    ###
+    def extent_indexes(self, extent):
+        first = extent['index'] * self.P_INDEX + extent['disk']
+        chunks = max(1, -(-(extent['offset'] + extent['length']) // self.CHUNK_SIZE))
+        return range(first // self.P_INDEX, (first + chunks - 1) // self.P_INDEX + 1)
+
+    ###
+    # Extents holding live data: the ones of the objects, the most read first,
+    # then the ones only kept by snapshots and the whole shared extents, parts
+    # of which may not be referenced by any object anymore
+    ###
+    def live_extents(self):
+        names = sorted(self.FILES_INFO, key=lambda name: self.READ_COUNT.get(name, 0), reverse=True)
+        for name in names:
+            for extent in self.FILES_INFO[name]:
+                yield extent
+        for snapshot in self.SNAPSHOTS.values():
+            for entry in snapshot['objects'].values():
+                for extent in entry['extents']:
+                    yield extent
+        for shared in self.SHARED.values():
+            yield shared['extent']
+
+    ###
+    # Indexes to rebuild, holding live data, the ones of the most read files first
+    # Indexes without live data are not rebuilt but marked in LAZY_PARITY
+    ###
+    def rebuild_order(self):
+        max_index = self.current_index
+        #if current disk index is 0 means the last index is the largest index with the stored data under this resepective file name
+        if self.current_disk_index == 0:
+            max_index -= 1
+
+        order = []
+        live = set()
+        for extent in self.live_extents():
+            for index in self.extent_indexes(extent):
+                if index <= max_index and index not in live and index not in self.LAZY_PARITY:
+                    live.add(index)
+                    order.append(index)
+
+        for index in range(max_index + 1):
+            if index not in live:
+                self.LAZY_PARITY.add(index)
+        return order
+
+    ###
+    # Indexes of rebuild_order where the lost disks held something
+    ###
+    def lost_indexes(self, disks):
+        holding = set(self.DISKS_INFO.indexes_with_data(disks))
+        return [index for index in self.rebuild_order() if index in holding]
+
     ###
     # Allow to recover up to 2 deleted disks
     # Use the parity file to do all the computations
+    # Only indexes holding live data are rebuilt, see rebuild_order
     ###
     def recovering_disks(self, disks_number):
-        # Recreate the folder
+        # Replace the lost disks with empty ones
         for i in disks_number:
-            try:
-                os.makedirs("disks/disk_" + str(i))
-            except:
-                pass
+            self.BACKEND.replace(i)
+
+        if self.erasure is not None:
+            return self.recovering_disks_erasure(disks_number)
+
+        indexes = self.lost_indexes(disks_number)
                 
         # One disk recovery case
         if len(disks_number) == 1:
             disk_number = disks_number[0]
-            index = 0
-            max_index = self.current_index
-            #if current disk index is 0 means the last index is the largest index with the stored data under this resepective file name
-            if self.current_disk_index  == 0:
-                max_index -= 1
 
             # Recovering all the indexes
-            while index <= max_index:
+            for index in indexes:
                 data, par = self.read_one_chunk(index, disks_number)
 
                 P,Q = par
@@ -464,29 +1424,20 @@ class RAID6:
                         dat.append(self.parity.recover_one_chunk_with_P(data_packed[i], P[i]))
 
                     try:
-                        if self.DISKS_INFO[index][disk_number] < self.CHUNK_SIZE:
-                            dat = dat[:self.DISKS_INFO[index][disk_number]]
+                        if self.DISKS_INFO.get(index, disk_number) < self.CHUNK_SIZE:
+                            dat = dat[:self.DISKS_INFO.get(index, disk_number)]
                     except:
                         return
 
-                    with open(self.PATH + 'disk_' + str(disk_number) + '/' + str(index), 'wb') as f:
-                        for value in dat:
-                            f.write(struct.pack(self.WRITING_INFO, value - (pow(2,self.NUMBER_OF_DISKS)//2)))
+                    self.write_chunk(disk_number, index, dat)
 
                 # Use case 2 when P parity is corrupted
                 elif P == []:
-                    with open(self.PATH + 'disk_' + str(disk_number) + '/' + str(index), 'wb') as f:
-                        for i in range(len(data_packed)):
-                            p = self.parity.compute_P(data_packed[i])
-                            f.write(struct.pack(self.WRITING_INFO, p - (pow(2,self.NUMBER_OF_DISKS)//2)))
+                    self.write_chunk(disk_number, index, [self.parity.compute_P(x) for x in data_packed])
                 
                 # Use case 3 when Q parity is corrupted
                 elif Q == []:
-                    with open(self.PATH + 'disk_' + str(disk_number) + '/' + str(index), 'wb') as f:
-                        for i in range(len(data_packed)):
-                            q = self.parity.compute_Q(data_packed[i])
-                            f.write(struct.pack(self.WRITING_INFO, q - (pow(2,self.NUMBER_OF_DISKS)//2)))
-                index += 1
+                    self.write_chunk(disk_number, index, [self.parity.compute_Q(x) for x in data_packed])
 
         ## Two disk recovery case
         elif len(disks_number) == 2:
@@ -494,13 +1445,7 @@ class RAID6:
             disk1_number = disks_number[0]
             disk2_number = disks_number[1]
 
-            i = 0
-            max_index = self.current_index
-
-            #if current disk index is 0 means the last index is the largest index with the stored data under this resepective file name
-            if self.current_disk_index ==0:
-                max_index -=1
-            while i <= max_index:
+            for i in indexes:
                 data, par = self.read_one_chunk(i, disks_number)
                 P,Q = par
 
@@ -522,11 +1467,13 @@ class RAID6:
                     #Get current position of the data in the list
                     actual_index1 = (disk1_number - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS
                     actual_index2 = (disk2_number - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS
-                    with open(self.PATH + 'disk_' + str(disk1_number) + '/' + str(i), 'wb') as f1, open(self.PATH + 'disk_' + str(disk2_number) + '/' + str(i), 'wb') as f2:
-                        for k in range(len(data_packed)):   
-                            a,b = self.parity.recover_two_chunk(data_packed[k], P[k], Q[k], actual_index1, actual_index2)
-                            f1.write(struct.pack(self.WRITING_INFO, a - (pow(2,self.NUMBER_OF_DISKS)//2)))
-                            f2.write(struct.pack(self.WRITING_INFO, b - (pow(2,self.NUMBER_OF_DISKS)//2)))
+                    chunk1 = []
+                    chunk2 = []
+                    for k in range(len(data_packed)):   
+                        a,b = self.parity.recover_two_chunk(data_packed[k], P[k], Q[k], actual_index1, actual_index2)
+                        chunk1.append(a)
+                        chunk2.append(b)
+                    self.write_chunks([(disk1_number, i, chunk1), (disk2_number, i, chunk2)])
                 
                 # Use case 3 when parity P and a data chunk is corrupted
                 elif P == [] :
@@ -536,14 +1483,13 @@ class RAID6:
                         data_index = disk2_number
                         p_index = disk1_number
 
-                    with open(self.PATH + 'disk_' + str(data_index) + '/' + str(i), 'wb') as f1, open(self.PATH + 'disk_' + str(p_index) + '/' + str(i), 'wb') as f2:
-                        #Get current position of the data in the list
-                        actual_index = int((data_index - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS)
-                        #data.insert(actual_index, 0)
-                        for k in range(len(data_packed)):
-                            data_packed[k][actual_index] = self.parity.recover_one_chunk_with_Q(data_packed[k], Q[k], actual_index)
-                            f1.write(struct.pack(self.WRITING_INFO, data_packed[k][actual_index] - (pow(2,self.NUMBER_OF_DISKS)//2)))
-                            f2.write(struct.pack(self.WRITING_INFO, self.parity.compute_P(data_packed[k]) - (pow(2,self.NUMBER_OF_DISKS)//2)))
+                    #Get current position of the data in the list
+                    actual_index = int((data_index - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS)
+                    #data.insert(actual_index, 0)
+                    for k in range(len(data_packed)):
+                        data_packed[k][actual_index] = self.parity.recover_one_chunk_with_Q(data_packed[k], Q[k], actual_index)
+                    self.write_chunks([(data_index, i, [x[actual_index] for x in data_packed]),
+                                       (p_index, i, [self.parity.compute_P(x) for x in data_packed])])
                         
                 # Use case 4 when Parity Q and a data chunk is corrupted
                 elif Q == [] :
@@ -553,31 +1499,116 @@ class RAID6:
                         data_index = disk2_number
                         q_index = disk1_number
 
-                    with open(self.PATH + 'disk_' + str(data_index) + '/' + str(i), 'wb') as f1, open(self.PATH + 'disk_' + str(q_index) + '/' + str(i), 'wb') as f2:
-                        #Get current position of the data in the list
-                        actual_index = int((data_index - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS)
-                        for k in range(len(data_packed)):
-                            data_packed[k][actual_index] = self.parity.recover_one_chunk_with_P(data_packed[k], P[k])
-                            f1.write(struct.pack(self.WRITING_INFO, data_packed[k][actual_index] - (pow(2,self.NUMBER_OF_DISKS)//2)))
-                            f2.write(struct.pack(self.WRITING_INFO, self.parity.compute_Q(data_packed[k]) - (pow(2,self.NUMBER_OF_DISKS)//2)))
-                        
+                    #Get current position of the data in the list
+                    actual_index = int((data_index - (i % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS)
+                    for k in range(len(data_packed)):
+                        data_packed[k][actual_index] = self.parity.recover_one_chunk_with_P(data_packed[k], P[k])
+                    self.write_chunks([(data_index, i, [x[actual_index] for x in data_packed]),
+                                       (q_index, i, [self.parity.compute_Q(x) for x in data_packed])])
 
-                i += 1
+    ###
+    # Recover up to PARITY_DISKS deleted disks with the Reed-Solomon code
+    # Each index is decoded in one pass, the decoding matrix being shared by
+    # every index with the same erasure pattern
+    ###
+    def recovering_disks_erasure(self, disks_number):
+        if len(disks_number) > self.PARITY_DISKS:
+            raise IOError("Unrecoverable error")
+
+        for index in self.lost_indexes(disks_number):
+            data, par = self.read_one_chunk(index, disks_number)
+
+            # Logical position in the index of each failed disk
+            missing = [(disk - (index % self.NUMBER_OF_DISKS) + self.NUMBER_OF_DISKS) % self.NUMBER_OF_DISKS for disk in disks_number]
+            chunks = []
+            for position, x in enumerate(list(data) + list(par)):
+                if position in missing:
+                    chunks.append(None)
+                else:
+                    chunks.append(x + [0] * (self.CHUNK_SIZE - len(x)))
+
+            rebuilt = self.erasure.reconstruct(chunks)
+            self.write_chunks([(disk, index, rebuilt[position]) for disk, position in zip(disks_number, missing)
+                               if self.DISKS_INFO.get(index, disk) > 0])
 
     ###
     # Deleting data based on their respective name in FILES_INFO
     # Data will still be on disk but can be rewritten on
     ###
+    @synchronized
     def delete_data(self, name):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.delete_data(name)
         try:
             position_info = self.FILES_INFO.pop(name)
+            self.READ_COUNT.pop(name, None)
+            self.OBJECT_INFO.pop(name, None)
+            self.DIGESTS.pop(name, None)
             for x in position_info:
-                self.ERASED_INFO.append(x)
+                self.release_extent(name, x)
 
+            self.commit()
             return True
         except:
             return False
 
+    ###
+    # Drop the reference of an owner (an object, or a shared extent) to one of
+    # its extents, freeing the chunks once nothing uses them anymore
+    ###
+    def release_extent(self, owner, x):
+        # A shared extent is freed with its last reference
+        if 'shared' in x:
+            shared = self.SHARED[x['shared']]
+            shared['refs'] -= 1
+            if shared['refs'] == 0:
+                self.release_extent(('shared', x['shared']), self.SHARED.pop(x['shared'])['extent'])
+            return
+        # A pack is only freed once all its objects are deleted
+        if 'pack' in x:
+            pack = self.PACKS[x['pack']]
+            pack['objects'].discard(owner)
+            if len(pack['objects']) == 0:
+                self.ERASED_INFO.append(self.PACKS.pop(x['pack'])['extent'])
+            return
+        # A deduplicated stripe is freed with its last reference
+        if 'fingerprint' in x:
+            stripe = self.STRIPES[x['fingerprint']]
+            stripe['refs'] -= 1
+            if stripe['refs'] == 0:
+                self.ERASED_INFO.append(self.STRIPES.pop(x['fingerprint'])['extent'])
+            return
+        self.ERASED_INFO.append(x)
+
+    ###
+    # A new reference to an extent of an object, for a clone or a snapshot
+    # The extent becomes shared: it is freed with its last reference and the
+    # bytes written to it go to new chunks (copy on write)
+    ###
+    def share_extent(self, name, x):
+        if 'shared' not in x:
+            shared_id = max(self.SHARED) + 1 if len(self.SHARED) > 0 else 0
+            self.SHARED[shared_id] = {'extent': x.copy(), 'refs': 1}
+            # The shared extent now stands for the object in its pack
+            if 'pack' in x:
+                self.PACKS[x['pack']]['objects'].discard(name)
+                self.PACKS[x['pack']]['objects'].add(('shared', shared_id))
+            x['pack'] = None
+            x['fingerprint'] = None
+            x['shared'] = shared_id
+        self.SHARED[x['shared']]['refs'] += 1
+        return x.copy()
+
+    ###
+    # Whether the chunks of an extent are only used by the object owning it,
+    # so it can be written in place
+    ###
+    def owns_extent(self, x):
+        if 'shared' not in x:
+            return True
+        shared = self.SHARED[x['shared']]
+        return shared['refs'] == 1 and 'fingerprint' not in shared['extent']
+
     ###
     # Print FILES_INFO
     ###
@@ -589,7 +1620,25 @@ class RAID6:
     # Will compare data to only store changed data
     # Stored data different from update are appended to ERASED_INFO
     ###
-    def update_data_from_file(self, filename, name):
+    @synchronized
+    def update_data_from_file(self, filename, name, compress=None, level=None):
+        if self.RESHAPE is not None:
+            if self.holder(name) is not self:
+                return self.RESHAPE.target.update_data_from_file(filename, name, compress, level)
+            if compress is None:
+                compress, level = self.compression(name)
+            self.delete_data(name)
+            return self.RESHAPE.target.write_data_from_file(filename, name, compress=compress, level=level)
+
+        # Packed, deduplicated, shared or compressed objects are rewritten elsewhere,
+        # compressed ones with their codec and level unless others are given
+        if compress is not None or name in self.OBJECT_INFO or any('pack' in x or 'fingerprint' in x or 'shared' in x
+                                                                   for x in self.FILES_INFO[name]):
+            if compress is None:
+                compress, level = self.compression(name)
+            self.delete_data(name)
+            return self.write_data_from_file(filename, name, compress=compress, level=level)
+
         stat_info = os.stat(filename)
         total_size = stat_info.st_size
 
@@ -608,6 +1657,7 @@ class RAID6:
                     break
         '''
         file_info = self.FILES_INFO[name]
+        self.FILES_INFO[name] = []
         total_size_saved = 0
         for x in file_info:
             total_size_saved += x['length']
@@ -619,60 +1669,48 @@ class RAID6:
         similar_size = 0
         similar_ = similar_size
         
+        # The object is rewritten over its extents, each extent owns whole chunks
+        # Chunks not needed anymore are freed
         writing_to = []
-        totally_written = False
         already_written = 0
-        for x in file_info[:]:
-            #Removing trailing data blocks
-            if totally_written:
-                file_info.remove(x)
+        for x in file_info:
+            remaining = size_to_write - already_written
+            if remaining <= 0:
                 self.ERASED_INFO.append(x)
-            similar_ -= x['length']
-            if similar_ < 0:
-                a = x.copy()
-                file_info.remove(x)
-                added_size_to_fill = 0
-
-                if a['length'] % self.CHUNK_SIZE != 0:
-                    added_size_to_fill = a['length']
-                    a['length'] = a['length'] + (self.CHUNK_SIZE - a['length'] % self.CHUNK_SIZE)
-                    added_size_to_fill = a['length'] - added_size_to_fill
-                if similar_ + a['length'] > 0:
-                    a['offset'] = 0 
-
-                
-                already_written += a['length'] - a['offset']
-                if a['length'] - a['offset'] >= size_to_write:
-                    totally_written = True
-                    old_size = a['length']
-                    a['length'] = size_to_write + similar_ + a['length'] - added_size_to_fill
-                    #freeing space
-                    index = a['index']
-                    disk = a['disk']
-                    data_w = 0
-                    while data_w < a['length']:
-                        data_w += self.CHUNK_SIZE
-                        disk = (disk + 1) 
-                        if disk == self.P_INDEX:
-                            index += 1
-                            disk = 0
-                    self.ERASED_INFO.append({'index':index, 'disk':disk, 'offset':0, 'length':old_size - data_w})
-
-                writing_to.append(a)
+                continue
+            capacity = -(-x['length'] // self.CHUNK_SIZE) * self.CHUNK_SIZE
+            if capacity >= remaining:
+                used_chunks = -(-remaining // self.CHUNK_SIZE)
+                first = x['index'] * self.P_INDEX + x['disk'] + used_chunks
+                if x['length'] - used_chunks * self.CHUNK_SIZE > 0:
+                    self.ERASED_INFO.append(allocation.extent(first // self.P_INDEX, first % self.P_INDEX, 0, x['length'] - used_chunks * self.CHUNK_SIZE))
+                capacity = remaining
+            writing_to.append(allocation.extent(x['index'], x['disk'], 0, capacity))
+            already_written += capacity
 
         if already_written < size_to_write:
-            writing_to.append({'index':self.current_index, 'disk':self.current_disk_index, 'offset':0, 'length':size_to_write - already_written})
+            writing_to.append(allocation.extent(self.current_index, self.current_disk_index, 0, size_to_write - already_written))
         
         print("writing_to", writing_to)
         print("offset", similar_size)
+        if len(writing_to) == 0:
+            self.DIGESTS[name] = merkle.merkle_tree(self.DIGEST_BLOCK_SIZE)
+            self.commit()
+            return True
         return self.write_data_from_file(filename, name, chunk_to_write=writing_to, offset=similar_size)
 
     ###
     # Get the stored data from their respective name in FILES_INFO
     ###
+    @synchronized
     def get_data_from_name(self, name):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.get_data_from_name(name)
         try:
             position_info = self.FILES_INFO[name]
+            self.READ_COUNT[name] = self.READ_COUNT.get(name, 0) + 1
+            if name in self.OBJECT_INFO or any(x['offset'] > 0 for x in position_info):
+                return ''.join(chr(c) for c in self.read_object(name))
             data = ""
             for x in position_info:
                 data += self.read_data(x['index'], x['disk'], x['length'])
@@ -683,9 +1721,17 @@ class RAID6:
     ###
     # Write the stored data to a file from their respective name in FILES_INFO
     ###
+    @synchronized
     def print_data_to_file(self, filename, name):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.print_data_to_file(filename, name)
         try:
             position_info = self.FILES_INFO[name]
+            self.READ_COUNT[name] = self.READ_COUNT.get(name, 0) + 1
+            if name in self.OBJECT_INFO or any(x['offset'] > 0 for x in position_info):
+                with open(filename, 'wb') as out_file:
+                    out_file.write(self.read_object(name))
+                return True
             success = self.read_data_to_file(filename, position_info[0]['index'], position_info[0]['disk'], position_info[0]['length'])
             for x in position_info[1:]:
                 success = success and self.read_data_to_file(filename, x['index'], x['disk'], x['length'], add=True)
@@ -694,4 +1740,610 @@ class RAID6:
             print(e)
             return False
 
+    ###
+    # Write several small objects at once, packed one after the other so
+    # they share chunks and indexes and the parity is computed once per index
+    # objects is a dict (or a list of pairs) name: bytes
+    ###
+    @synchronized
+    def write_many(self, objects):
+        if isinstance(objects, dict):
+            objects = list(objects.items())
+        if self.RESHAPE is not None:
+            for name, value in objects:
+                if name in self.FILES_INFO:
+                    self.delete_data(name)
+            return self.RESHAPE.target.write_many(objects)
+        for name, value in objects:
+            if name in self.FILES_INFO:
+                self.delete_data(name)
+
+        buffer = b''.join(value for name, value in objects)
+        if len(buffer) == 0:
+            for name, value in objects:
+                self.FILES_INFO[name] = []
+                self.DIGESTS[name] = merkle.merkle_tree(self.DIGEST_BLOCK_SIZE)
+            self.commit()
+            return True
+
+        with open(self.PATH + 'temp', 'wb') as f:
+            f.write(buffer)
+
+        # The pack is appended at the end so its chunks are contiguous
+        extent = allocation.extent(self.current_index, self.current_disk_index, 0, len(buffer))
+        pack_id = max(self.PACKS) + 1 if len(self.PACKS) > 0 else 0
+        self.PACKS[pack_id] = {'extent': extent, 'objects': set()}
+
+        offset = 0
+        for name, value in objects:
+            self.FILES_INFO[name] = [allocation.extent(extent['index'], extent['disk'], offset, len(value), pack_id)]
+            self.DIGESTS[name] = merkle.merkle_tree.from_bytes(value, self.DIGEST_BLOCK_SIZE)
+            self.PACKS[pack_id]['objects'].add(name)
+            offset += len(value)
+
+        return self.write_data_from_file(self.PATH + 'temp', None, chunk_to_write=[extent.copy()])
+
+    ###
+    # Store every file of a directory tree as an object named prefix + its path
+    # relative to root, in whole stripes with the parity computed by worker
+    # processes (see ingest.ingest)
+    ###
+    def ingest(self, root, prefix='', readers=ingest.READERS, workers=None, batch_bytes=ingest.BATCH_BYTES):
+        return ingest.ingest(self, root, prefix, readers, workers, batch_bytes)
+
+    ###
+    # Read several objects, returning a dict name: bytes
+    # Objects are read in disk order so the ones sharing an index read it once
+    ###
+    @synchronized
+    def read_many(self, names):
+        result = {}
+        if self.RESHAPE is not None:
+            moved = [name for name in names if self.holder(name) is not self]
+            if len(moved) > 0:
+                result.update(self.RESHAPE.target.read_many(moved))
+            names = [name for name in names if name not in result]
+
+        for name in sorted(names, key=self.object_position):
+            self.READ_COUNT[name] = self.READ_COUNT.get(name, 0) + 1
+            result[name] = self.read_object(name)
+        return result
+
+    ###
+    # Position of the start of an object on the disks, in bytes
+    ###
+    def object_position(self, name):
+        extents = self.FILES_INFO[name]
+        if len(extents) == 0:
+            return 0
+        return (extents[0]['index'] * self.P_INDEX + extents[0]['disk']) * self.CHUNK_SIZE + extents[0]['offset']
+
+    ###
+    # Read a whole object, decompressing it if needed
+    ###
+    def read_object(self, name):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.read_object(name)
+        data = b''.join(self.read_extent(x) for x in self.FILES_INFO[name])
+        if name in self.OBJECT_INFO:
+            data = self.CODECS[self.OBJECT_INFO[name]['codec']][1](data)
+        return data
+
+    ###
+    # Read length bytes of an object starting at offset
+    # Only the chunks holding the range are read, except for compressed objects
+    # which have to be decompressed from their start
+    ###
+    @synchronized
+    def read_range(self, name, offset, length):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.read_range(name, offset, length)
+        if name in self.OBJECT_INFO:
+            return self.read_object(name)[offset:offset + length]
+
+        out = bytearray()
+        for x in self.FILES_INFO[name]:
+            if len(out) >= length:
+                break
+            if offset >= x['length']:
+                offset -= x['length']
+                continue
+            part = x.copy()
+            part['offset'] = x['offset'] + offset
+            part['length'] = min(length - len(out), x['length'] - offset)
+            out.extend(self.read_extent(part))
+            offset = 0
+        return bytes(out)
+
+    ###
+    # Write data in an object from offset, in place
+    # Only the chunks holding the range and the parity of their indexes are
+    # read and written, the parity being updated with the difference
+    # Writing past the end extends the object (a gap is zero filled)
+    # Compressed objects and objects sharing deduplicated stripes are rewritten whole,
+    # the parts of extents shared with clones or snapshots get new chunks
+    ###
+    @synchronized
+    def write_range(self, name, offset, data):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.write_range(name, offset, data)
+        size = self.object_size(name)
+        if offset < 0:
+            raise ValueError("Negative offset " + str(offset) + " in " + name)
+        if offset > size:
+            data = bytes(offset - size) + data
+            offset = size
+        if len(data) == 0:
+            return True
+        if name in self.OBJECT_INFO or any('fingerprint' in x for x in self.FILES_INFO[name]):
+            return self.rewrite_object(name, offset, data)
+
+        tree = self.DIGESTS.get(name)
+        inside = data[:max(0, size - offset)]
+        if all(self.owns_extent(x) for x in self.FILES_INFO[name]):
+            self.patch_object(name, offset, inside)
+        else:
+            self.copy_on_write(name, offset, inside)
+        if len(inside) < len(data):
+            self.extend_object(name, data[len(inside):])
+            size = offset + len(data)
+
+        # Leaves of the blocks written are recomputed from the array
+        if tree is not None:
+            self.DIGESTS[name] = tree
+            first = offset // tree.BLOCK_SIZE
+            end = min(size, -(-(offset + len(data)) // tree.BLOCK_SIZE) * tree.BLOCK_SIZE)
+            tree.update(first, self.read_range(name, first * tree.BLOCK_SIZE, end - first * tree.BLOCK_SIZE), size)
+        self.commit()
+        return True
 
+    ###
+    # Add data at the end of an object, created if needed
+    ###
+    @synchronized
+    def append(self, name, data):
+        if self.holder(name) is not self:
+            return self.RESHAPE.target.append(name, data)
+        if name not in self.FILES_INFO:
+            return self.write_many({name: data})
+        return self.write_range(name, self.object_size(name), data)
+
+    ###
+    # Bytes of an object, before compression
+    ###
+    def object_size(self, name):
+        if name in self.OBJECT_INFO:
+            return self.OBJECT_INFO[name]['size']
+        return sum(x['length'] for x in self.FILES_INFO[name])
+
+    def rewrite_object(self, name, offset, data):
+        whole = bytearray(self.read_object(name))
+        whole[offset:offset + len(data)] = data
+        codec, level = self.compression(name)
+        with open(self.PATH + 'temp_range', 'wb') as f:
+            f.write(whole)
+        self.delete_data(name)
+        return self.write_data_from_file(self.PATH + 'temp_range', name, compress=codec, level=level)
+
+    ###
+    # Overwrite bytes inside an object, index by index
+    ###
+    def patch_object(self, name, offset, data):
+        # index: {data disk: [(byte in the chunk, bytes), ...]}
+        changes = {}
+        start, done = offset, 0
+        for x in self.FILES_INFO[name]:
+            if done >= len(data):
+                break
+            if start >= x['length']:
+                start -= x['length']
+                continue
+            end = done + min(len(data) - done, x['length'] - start)
+            position, byte = divmod((x['index'] * self.P_INDEX + x['disk']) * self.CHUNK_SIZE + x['offset'] + start, self.CHUNK_SIZE)
+            while done < end:
+                length = min(end - done, self.CHUNK_SIZE - byte)
+                changes.setdefault(position // self.P_INDEX, {}).setdefault(position % self.P_INDEX, []).append((byte, data[done:done + length]))
+                done += length
+                position, byte = position + 1, 0
+            start = 0
+
+        for index in sorted(changes):
+            self.patch_index(index, changes[index])
+
+    ###
+    # Write parts of the data chunks of an index, {data disk: [(byte, bytes), ...]},
+    # updating the parity with the difference only: reading the old chunks and
+    # the parity, P ^= old ^ new and Q ^= g^disk * (old ^ new)
+    # An index missing a chunk is decoded and gets its parity recomputed
+    ###
+    def patch_index(self, index, changes):
+        chunks = {}
+        parities = None
+        if index not in self.LAZY_PARITY and len(self.degraded_disks(index)) == 0:
+            try:
+                for j in changes:
+                    disk = (index + j) % self.NUMBER_OF_DISKS
+                    chunks[j] = self.read_chunk(disk, index) if self.DISKS_INFO.get(index, disk) > 0 else []
+                parities = [self.read_chunk((self.P_INDEX + r + index) % self.NUMBER_OF_DISKS, index)
+                            for r in range(self.PARITY_DISKS)]
+            except Exception:
+                parities = None
+        if parities is None:
+            data, par = self.read_one_chunk(index)
+            chunks = dict((j, data[j]) for j in changes)
+
+        writes = []
+        parities = None if parities is None else [x + [0] * (self.CHUNK_SIZE - len(x)) for x in parities]
+        for j, parts in changes.items():
+            disk = (index + j) % self.NUMBER_OF_DISKS
+            old = list(chunks[j]) + [0] * (self.CHUNK_SIZE - len(chunks[j]))
+            new = list(old)
+            for byte, part in parts:
+                new[byte:byte + len(part)] = part
+                if byte + len(part) > self.DISKS_INFO.get(index, disk):
+                    self.update_disk_info(index, disk, byte + len(part))
+                if parities is None:
+                    continue
+                for b in range(byte, byte + len(part)):
+                    delta = old[b] ^ new[b]
+                    if delta == 0:
+                        continue
+                    for r in range(self.PARITY_DISKS):
+                        parities[r][b] ^= self.parity_coefficient(r, j, delta)
+            writes.append((disk, index, new))
+
+        if parities is None:
+            self.write_chunks(writes)
+            self.restore_parity(index)
+            return
+        for r in range(self.PARITY_DISKS):
+            disk = (self.P_INDEX + r + index) % self.NUMBER_OF_DISKS
+            self.update_disk_info(index, disk, self.CHUNK_SIZE)
+            writes.append((disk, index, parities[r]))
+        self.write_chunks(writes)
+        if self.BITMAP is not None:
+            self.BITMAP.mark_clean(index)
+
+    ###
+    # Change of parity chunk r for a change delta of data chunk j
+    ###
+    def parity_coefficient(self, r, j, delta):
+        if self.erasure is not None:
+            return self.erasure.F.Multiply(self.erasure.MATRIX[r][j], delta)
+        if r == 0:
+            return delta
+        return self.parity.F.Multiply(2**j, delta)
+
+    ###
+    # Overwrite bytes inside an object sharing extents with clones or snapshots
+    # The parts of the shared extents written are replaced by new chunks, the
+    # rest of these extents stays shared; extents of the object only are
+    # patched in place
+    ###
+    def copy_on_write(self, name, offset, data):
+        extents = []
+        patches = []    # (offset in the object, bytes) written in place
+        start = 0
+        for x in self.FILES_INFO[name]:
+            end = start + x['length']
+            first, last = max(start, offset), min(end, offset + len(data))
+            if first >= last:
+                extents.append(x)
+            elif self.owns_extent(x):
+                extents.append(x)
+                patches.append((first, data[first - offset:last - offset]))
+            else:
+                # The bytes before and after the ones written keep referencing the shared extent
+                if first > start:
+                    extents.append(allocation.extent(x['index'], x['disk'], x['offset'], first - start, shared=x['shared']))
+                    self.SHARED[x['shared']]['refs'] += 1
+                new = allocation.extent(self.current_index, self.current_disk_index, 0, last - first)
+                with open(self.PATH + 'temp_range', 'wb') as f:
+                    f.write(data[first - offset:last - offset])
+                self.write_data_from_file(self.PATH + 'temp_range', None, chunk_to_write=[new.copy()])
+                extents.append(new)
+                if end > last:
+                    extents.append(allocation.extent(x['index'], x['disk'], x['offset'] + last - start, end - last, shared=x['shared']))
+                    self.SHARED[x['shared']]['refs'] += 1
+                self.release_extent(name, x)
+            start = end
+
+        self.FILES_INFO[name] = extents
+        for at, part in patches:
+            self.patch_object(name, at, part)
+
+    ###
+    # Objects sharing their extents: clones and snapshots
+    # References to all the extents of an object (or of an object of a snapshot),
+    # with its codec and Merkle tree
+    ###
+    def share_object(self, name, entry=None):
+        if entry is None:
+            entry = {'extents': self.FILES_INFO[name], 'info': self.OBJECT_INFO.get(name), 'tree': self.DIGESTS.get(name)}
+        return {'extents': [self.share_extent(name, x) for x in entry['extents']],
+                'info': None if entry['info'] is None else dict(entry['info']),
+                'tree': None if entry['tree'] is None else entry['tree'].copy()}
+
+    def put_object(self, name, entry):
+        if name in self.FILES_INFO:
+            self.delete_data(name)
+        self.FILES_INFO[name] = entry['extents']
+        if entry['info'] is not None:
+            self.OBJECT_INFO[name] = entry['info']
+        if entry['tree'] is not None:
+            self.DIGESTS[name] = entry['tree']
+
+    ###
+    # Copy an object (of a snapshot if given) under another name without
+    # copying its data: both share its chunks until either is written
+    ###
+    @synchronized
+    def clone(self, source, name, snapshot=None):
+        if self.RESHAPE is not None:
+            raise RuntimeError("Objects can not be cloned while a reshape is running")
+        if snapshot is not None:
+            entry = self.share_object(source, self.SNAPSHOTS[snapshot]['objects'][source])
+        else:
+            entry = self.share_object(source)
+        self.put_object(name, entry)
+        self.commit()
+        return True
+
+    ###
+    # Keep the objects as they are now (all of them, or the ones named), only
+    # their metadata is copied
+    ###
+    @synchronized
+    def snapshot(self, snapshot, names=None):
+        if self.RESHAPE is not None:
+            raise RuntimeError("No snapshot can be taken while a reshape is running")
+        if snapshot in self.SNAPSHOTS:
+            raise ValueError("Snapshot " + str(snapshot) + " already exists")
+        objects = dict((name, self.share_object(name)) for name in (self.FILES_INFO if names is None else names))
+        self.SNAPSHOTS[snapshot] = {'time': time.time(), 'objects': objects}
+        self.commit()
+        return True
+
+    ###
+    # Put the objects back as they were in a snapshot; without names, objects
+    # created since the snapshot are deleted
+    ###
+    @synchronized
+    def restore_snapshot(self, snapshot, names=None):
+        if self.RESHAPE is not None:
+            raise RuntimeError("No snapshot can be restored while a reshape is running")
+        objects = self.SNAPSHOTS[snapshot]['objects']
+        if names is None:
+            for name in [name for name in self.FILES_INFO if name not in objects]:
+                self.delete_data(name)
+            names = list(objects)
+        for name in names:
+            self.put_object(name, self.share_object(name, objects[name]))
+        self.commit()
+        return True
+
+    @synchronized
+    def delete_snapshot(self, snapshot):
+        for name, entry in self.SNAPSHOTS.pop(snapshot)['objects'].items():
+            for x in entry['extents']:
+                self.release_extent(name, x)
+        self.commit()
+        return True
+
+    @synchronized
+    def read_snapshot(self, snapshot, name):
+        entry = self.SNAPSHOTS[snapshot]['objects'][name]
+        data = b''.join(self.read_extent(x) for x in entry['extents'])
+        if entry['info'] is not None:
+            data = self.CODECS[entry['info']['codec']][1](data)
+        return data
+
+    ###
+    # Snapshots with their number of objects and bytes
+    ###
+    def snapshots(self):
+        result = {}
+        for snapshot, x in self.SNAPSHOTS.items():
+            result[snapshot] = {'time': x['time'], 'objects': len(x['objects']),
+                                'bytes': sum(y['length'] for entry in x['objects'].values() for y in entry['extents'])}
+        return result
+
+    ###
+    # Add data after the last byte of an object: the rest of its last chunk is
+    # filled first, then its last extent grows over the next chunks if nothing
+    # was written after it, a new extent is added otherwise
+    ###
+    def extend_object(self, name, data):
+        done = 0
+        last = self.FILES_INFO[name][-1] if len(self.FILES_INFO[name]) > 0 else None
+        if last is not None and 'pack' not in last and 'fingerprint' not in last and 'shared' not in last:
+            end = last['offset'] + last['length']
+            slack = min((-end) % self.CHUNK_SIZE, len(data))
+            if slack > 0:
+                last['length'] += slack
+                size = sum(x['length'] for x in self.FILES_INFO[name])
+                self.patch_object(name, size - slack, data[:slack])
+                done = slack
+            following = last['index'] * self.P_INDEX + last['disk'] + -(-(end + slack) // self.CHUNK_SIZE)
+            if done < len(data) and following == self.current_index * self.P_INDEX + self.current_disk_index:
+                with open(self.PATH + 'temp_range', 'wb') as f:
+                    f.write(data[done:])
+                self.write_data_from_file(self.PATH + 'temp_range', None,
+                                          chunk_to_write=[allocation.extent(self.current_index, self.current_disk_index, 0, len(data) - done)])
+                last['length'] += len(data) - done
+                done = len(data)
+
+        if done < len(data):
+            with open(self.PATH + 'temp_range', 'wb') as f:
+                f.write(data[done:])
+            self.write_data_from_file(self.PATH + 'temp_range', name)
+
+    ###
+    # Merkle tree of an object, computed from its data if it was never recorded
+    ###
+    def merkle(self, name):
+        holder = self.holder(name)
+        if name not in holder.DIGESTS:
+            holder.DIGESTS[name] = merkle.merkle_tree.from_bytes(holder.read_object(name), holder.DIGEST_BLOCK_SIZE)
+        return holder.DIGESTS[name]
+
+    ###
+    # Digest of the data of an object (root of its Merkle tree), equal
+    # digests mean equal data
+    ###
+    @synchronized
+    def digest(self, name):
+        return self.merkle(name).hexdigest()
+
+    ###
+    # Objects whose stored data no longer match their Merkle tree, re-reading
+    # all of them: {name: [(offset, length), ...]} of the blocks that differ
+    ###
+    @synchronized
+    def audit(self, names=None):
+        damaged = {}
+        for name in (self.objects() if names is None else names):
+            holder = self.holder(name)
+            if name not in holder.DIGESTS:
+                continue
+            ranges = merkle.merkle_tree.from_bytes(holder.read_object(name), holder.DIGESTS[name].BLOCK_SIZE).diff(holder.DIGESTS[name])
+            if len(ranges) > 0:
+                damaged[name] = ranges
+        return damaged
+
+    ###
+    # Names of the objects stored, including the ones moved by a reshape
+    ###
+    def objects(self):
+        names = list(self.FILES_INFO)
+        if self.RESHAPE is not None:
+            names.extend(name for name in self.RESHAPE.target.FILES_INFO if name not in self.FILES_INFO)
+        return names
+
+    ###
+    # Ranges of the objects of this RAID6 that differ on another one,
+    # comparing their Merkle trees only: {name: [(offset, length), ...]}
+    # An object missing on the other RAID6 differs as a whole
+    ###
+    @synchronized
+    def diff(self, other, names=None):
+        theirs = set(other.objects())
+        changes = {}
+        for name in (self.objects() if names is None else names):
+            mine = self.merkle(name)
+            ranges = mine.diff(other.merkle(name) if name in theirs else None)
+            if len(ranges) > 0 or name not in theirs:
+                changes[name] = ranges
+        return changes
+
+    ###
+    # Make the objects of another RAID6 match the ones of this RAID6, sending
+    # only the ranges that differ; compressed objects, and objects larger on
+    # the other RAID6, are sent whole
+    # delete=True also deletes the objects of the other RAID6 missing here
+    # Return the number of objects and bytes sent
+    ###
+    @synchronized
+    def sync_to(self, other, names=None, delete=False):
+        theirs = set(other.objects())
+        sent = {'objects': 0, 'bytes': 0}
+        for name, ranges in self.diff(other, names).items():
+            codec, level = self.holder(name).compression(name)
+            if name in theirs and codec is None and name not in other.holder(name).OBJECT_INFO and \
+                    other.merkle(name).size <= self.merkle(name).size:
+                for offset, length in ranges:
+                    other.write_range(name, offset, self.read_range(name, offset, length))
+                    sent['bytes'] += length
+            else:
+                data = self.read_object(name)
+                if name in theirs:
+                    other.delete_data(name)
+                # An empty object has no extent to write
+                if len(data) == 0:
+                    other.write_many({name: data})
+                else:
+                    with open(other.PATH + 'temp_sync', 'wb') as f:
+                        f.write(data)
+                    other.write_data_from_file(other.PATH + 'temp_sync', name, compress=codec, level=level)
+                sent['bytes'] += len(data)
+            sent['objects'] += 1
+
+        if delete:
+            mine = set(self.objects())
+            for name in theirs:
+                if name not in mine:
+                    other.delete_data(name)
+        return sent
+
+    ###
+    # Move the objects to a new geometry (more disks, another chunk size or
+    # number of parity disks) in the background, while they keep being served
+    # Once done the RAID6 must be reopened with the new geometry
+    ###
+    @synchronized
+    def reshape(self, number_of_disk=None, chunk_size=None, parity_disks=None):
+        if self.RESHAPE is not None:
+            raise RuntimeError("A reshape is already running")
+        if len(self.SNAPSHOTS) > 0:
+            raise RuntimeError("Snapshots must be deleted before a reshape")
+        geometry = (self.NUMBER_OF_DISKS if number_of_disk is None else number_of_disk,
+                    self.CHUNK_SIZE if chunk_size is None else chunk_size,
+                    self.PARITY_DISKS if parity_disks is None else parity_disks)
+        path = self.PATH + 'reshape_' + str(int(time.time() * 1000)) + '/'
+        self.RESHAPE = reshape.reshape_job(self, geometry, path)
+        self.commit()
+        self.RESHAPE.start()
+        return self.RESHAPE
+
+    ###
+    # During a reshape, the RAID6 serving an object
+    ###
+    def holder(self, name):
+        if self.RESHAPE is not None and self.RESHAPE.migrated(name):
+            return self.RESHAPE.target
+        return self
+
+    ###
+    # End of a reshape: drop the old disks and take the geometry, disks and
+    # metadata of the RAID6 the objects were moved to
+    # The root, lock, settings, spares, journal and background workers of the
+    # RAID6 are kept, the threads working on the old disks are stopped first
+    ###
+    @synchronized
+    def adopt(self, target):
+        self.SPARE_MANAGER.stop()
+        target.SPARE_MANAGER.stop()
+        self.checkpoint()
+        self.PREFETCHER.close()
+        target.PREFETCHER.close()
+        self.LANES.shutdown()
+        if target.JOURNAL is not None:
+            target.JOURNAL.close()
+        for location in self.DISK_PATHS:
+            self.BACKEND.destroy(location)
+        self.BACKEND.close()
+
+        geometry = ('NUMBER_OF_DISKS', 'CHUNK_SIZE', 'PARITY_DISKS', 'P_INDEX', 'Q_INDEX', 'WRITING_INFO', 'VALUE_SIZE',
+                    'VALUE_SHIFT', 'parity', 'erasure', 'DISK_PATHS', 'BACKEND', 'LATENCY', 'LANES')
+        metadata = ('current_index', 'current_disk_index', 'FILES_INFO', 'ERASED_INFO', 'DISKS_INFO', 'LAZY_PARITY',
+                    'READ_COUNT', 'REBUILDING', 'PACKS', 'OBJECT_INFO', 'DIGESTS', 'STRIPES', 'SHARED', 'SNAPSHOTS')
+        for field in geometry + metadata:
+            setattr(self, field, getattr(target, field))
+        self.RESHAPE = None
+        self.QUEUED = []
+        self.CACHE.clear()
+        self.BITMAP = target.BITMAP if self.JOURNAL is None else None
+        if self.BITMAP is not None:
+            os.replace(self.BITMAP.FILE, self.PATH + 'bitmap')
+            self.BITMAP.FILE = self.PATH + 'bitmap'
+
+        self.BACKEND.sync()
+        self.save_metadata()
+        if self.JOURNAL is not None:
+            # The saved metadata has the new geometry, the journal restarts from it
+            self.JOURNAL.truncate()
+            self.metadata_delta()
+        if os.path.exists(target.PATH + 'metadata'):
+            os.remove(target.PATH + 'metadata')
+        if len(self.SPARES) > 0 or len(self.REBUILDING) > 0:
+            self.SPARE_MANAGER.start()
@@ -0,0 +1,313 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+import functools
+import backend
+import controller
+
+
+###
+# Latency distributions, each returns a function drawing a delay in seconds
+###
+def constant(seconds):
+    return lambda rng: seconds
+
+def uniform(low, high):
+    return lambda rng: rng.uniform(low, high)
+
+def exponential(mean):
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+def lognormal(median, sigma):
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+# Usually base, sometimes a much longer stall
+def spikes(base, spike, probability):
+    return lambda rng: spike if rng.random() < probability else base
+
+
+class faulty_backend(backend.disk_backend):
+    '''
+    Backend wrapping another one and injecting faults in its disks: added
+    latency, transient read errors, bit flips in the chunks read, torn
+    writes and the loss of a whole disk at a given time
+    Faults follow the location of a disk, a spare swapped in is healthy
+    '''
+    def __init__(self, paths, chunk_bytes, inner='memory', seed=None):
+        backend.disk_backend.__init__(self, paths, chunk_bytes)
+        if isinstance(inner, str):
+            inner = backend.BACKENDS[inner]
+        self.inner = inner(paths, chunk_bytes)
+        self.VOLATILE = self.inner.VOLATILE
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.faults = {}    # location: {latency, read_errors, bit_flips, torn_writes}
+        self.losses = {}    # location: time at which the disk is lost
+        self.injected = {'latency': 0, 'read_errors': 0, 'bit_flips': 0, 'torn_writes': 0, 'losses': 0}
+
+    ###
+    # Inject faults in a disk, probabilities are per chunk read or written
+    # latency is a distribution like exponential(0.002), added to each read and write
+    ###
+    def inject(self, disk, latency=None, read_errors=0, bit_flips=0, torn_writes=0):
+        self.faults[self.paths[disk]] = {'latency': latency, 'read_errors': read_errors,
+                                         'bit_flips': bit_flips, 'torn_writes': torn_writes}
+
+    ###
+    # Lose a disk after delay seconds
+    ###
+    def lose_at(self, disk, delay):
+        self.losses[self.paths[disk]] = time.time() + delay
+
+    ###
+    # Apply a fault profile: {'inject': {disk: {faults}}, 'lose': {disk: delay}}
+    ###
+    def apply(self, profile):
+        for disk, faults in profile.get('inject', {}).items():
+            self.inject(disk, **faults)
+        for disk, delay in profile.get('lose', {}).items():
+            self.lose_at(disk, delay)
+
+    def clear(self):
+        self.faults = {}
+        self.losses = {}
+
+    ###
+    # Faults of a disk for one access, losing it first if its time has come
+    ###
+    def before_access(self, disk):
+        location = self.paths[disk]
+        loss = self.losses.get(location)
+        if loss is not None and time.time() >= loss:
+            with self.lock:
+                if self.losses.pop(location, None) is not None:
+                    self.injected['losses'] += 1
+                    self.inner.destroy(location)
+        faults = self.faults.get(location)
+        if faults is not None and faults['latency'] is not None:
+            with self.lock:
+                delay = faults['latency'](self.rng)
+                self.injected['latency'] += 1
+            time.sleep(max(0, delay))
+        return faults
+
+    def draw(self, probability, kind):
+        if probability <= 0:
+            return False
+        with self.lock:
+            if self.rng.random() >= probability:
+                return False
+            self.injected[kind] += 1
+            return True
+
+    def read_chunk(self, disk, index):
+        faults = self.before_access(disk)
+        if faults is not None and self.draw(faults['read_errors'], 'read_errors'):
+            raise IOError("Injected read error on disk " + str(disk))
+        raw = self.inner.read_chunk(disk, index)
+        if faults is not None and len(raw) > 0 and self.draw(faults['bit_flips'], 'bit_flips'):
+            with self.lock:
+                bit = self.rng.randrange(len(raw) * 8)
+            raw = bytearray(raw)
+            raw[bit // 8] ^= 1 << (bit % 8)
+            raw = bytes(raw)
+        return raw
+
+    def write_chunk(self, disk, index, raw):
+        faults = self.before_access(disk)
+        if faults is not None and len(raw) > 0 and self.draw(faults['torn_writes'], 'torn_writes'):
+            # Only the start of the chunk reaches the disk, the rest keeps its old content
+            with self.lock:
+                cut = self.rng.randrange(len(raw))
+            try:
+                old = self.inner.read_chunk(disk, index)
+            except OSError:
+                old = b''
+            raw = raw[:cut] + old[cut:len(raw)]
+        self.inner.write_chunk(disk, index, raw)
+
+    def discard(self, disk, index):
+        self.before_access(disk)
+        self.inner.discard(disk, index)
+
+    def exists(self, disk, index=None):
+        if self.paths[disk] in self.losses:
+            self.before_access(disk)
+        return self.inner.exists(disk, index)
+
+    def create(self, location):
+        self.inner.create(location)
+
+    def destroy(self, location):
+        self.inner.destroy(location)
+
+    def sync(self):
+        self.inner.sync()
+
+    def close(self):
+        self.inner.close()
+
+
+PROFILES = {'healthy': {},
+            'slow_disk': {'inject': {2: {'latency': lognormal(0.002, 1.0)}}},
+            'latency_spikes': {'inject': dict((disk, {'latency': spikes(0.0001, 0.02, 0.01)}) for disk in range(8))},
+            'transient_errors': {'inject': {1: {'read_errors': 0.002}}},
+            'bit_flips': {'inject': {4: {'bit_flips': 0.01}}},
+            'torn_writes': {'inject': {5: {'torn_writes': 0.05}}},
+            'disk_loss': {'lose': {3: 0.5}},
+            'double_disk_loss': {'lose': {1: 0.2, 6: 0.4}}}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+###
+# Throughput and latency of a list of (seconds, bytes) operations
+###
+def summarize(operations, elapsed, errors=0, corrupted=0):
+    latencies = [x[0] for x in operations]
+    return {'operations': len(operations),
+            'MB/s': sum(x[1] for x in operations) / max(elapsed, 1e-9) / 1e6,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'p999_ms': percentile(latencies, 99.9) * 1000,
+            'max_ms': max(latencies) * 1000 if len(latencies) > 0 else 0,
+            'errors': errors,
+            'corrupted': corrupted}
+
+###
+# Replace and rebuild the disks lost so far, as an operator would once the
+# loss is noticed; probing the disks makes the losses due happen
+# Return the disks rebuilt
+###
+def recover(raid):
+    lost = [disk for disk in range(raid.NUMBER_OF_DISKS) if not raid.BACKEND.exists(disk)]
+    if len(lost) > 0:
+        raid.recovering_disks(lost)
+    return lost
+
+###
+# Read back every acknowledged object, return the (seconds, bytes) of the
+# reads, the number of objects that could not be read and of those corrupted
+###
+def verify(raid, contents):
+    operations, errors, corrupted = [], 0, 0
+    for name, expected in contents.items():
+        t = time.time()
+        try:
+            data = raid.read_object(name)
+            operations.append((time.time() - t, len(expected)))
+            corrupted += data != expected
+        except Exception:
+            errors += 1
+    return operations, errors, corrupted
+
+###
+# Write then read objects on a RAID6 whose disks suffer a fault profile, then
+# lose a disk and rebuild it, measuring each phase
+# Disks lost by the profile are rebuilt as soon as they are noticed, an object
+# whose write was cut by a loss is not acknowledged and is written again
+# Reads count the acknowledged objects that could not be read back or were
+# corrupted, after every loss of the profile happened
+# Everything runs in a temporary directory, on the memory backend by default
+###
+def run_scenario(profile, objects=32, object_size=64 * 1024, number_of_disk=8, chunk_size=128, inner='memory', seed=0):
+    if isinstance(profile, str):
+        profile = PROFILES[profile]
+    root = tempfile.mkdtemp()
+    stdout = sys.stdout
+    # The controller reports every recovery on stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        raid = controller.RAID6(number_of_disk, chunk_size, path=os.path.join(root, 'disks'),
+                                backend=functools.partial(faulty_backend, inner=inner, seed=seed))
+        raid.CACHE.resize(0)
+        rng = random.Random(seed)
+        contents = {}
+        for i in range(objects):
+            contents['object_' + str(i)] = bytes(rng.getrandbits(8) for loop in range(object_size))
+            with open(os.path.join(root, 'object_' + str(i)), 'wb') as f:
+                f.write(contents['object_' + str(i)])
+        raid.BACKEND.apply(profile)
+
+        results = {}
+        acknowledged = {}
+        recovered = []
+        operations, errors = [], 0
+        start = time.time()
+        for name in contents:
+            t = time.time()
+            recovered.extend(recover(raid))
+            first = raid.current_index
+            try:
+                raid.write_data_from_file(os.path.join(root, name), name)
+            except Exception:
+                # The indexes reached by the write may hold new data under old parity
+                try:
+                    recovered.extend(recover(raid))
+                    for index in range(first, min(raid.current_index + 1, len(raid.DISKS_INFO))):
+                        raid.restore_parity(index)
+                    if name in raid.FILES_INFO:
+                        raid.delete_data(name)
+                    raid.write_data_from_file(os.path.join(root, name), name)
+                except Exception:
+                    errors += 1
+                    continue
+            operations.append((time.time() - t, object_size))
+            acknowledged[name] = contents[name]
+        results['write'] = summarize(operations, time.time() - start, errors)
+
+        # Losses of the profile not due yet happen before the objects are read
+        pending = list(raid.BACKEND.losses.values())
+        if len(pending) > 0:
+            time.sleep(max(0, max(pending) - time.time()))
+        recovered.extend(recover(raid))
+
+        start = time.time()
+        operations, errors, corrupted = verify(raid, acknowledged)
+        results['read'] = summarize(operations, time.time() - start, errors, corrupted)
+
+        # Rebuild of a disk lost now, on top of the profile, then every object is checked
+        disk = number_of_disk - 1
+        raid.BACKEND.fail(disk)
+        start = time.time()
+        try:
+            raid.recovering_disks([disk])
+            errors = 0
+        except Exception:
+            errors = 1
+        elapsed = time.time() - start
+        raid.BACKEND.clear()
+        operations, lost, corrupted = verify(raid, acknowledged)
+        results['rebuild'] = summarize([(elapsed, raid.current_index * chunk_size)], elapsed, errors + lost, corrupted)
+        results['injected'] = dict(raid.BACKEND.injected)
+        results['recovered'] = recovered
+        raid.SPARE_MANAGER.stop()
+        return results
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(root, ignore_errors=True)
+
+
+###
+# python faults.py [profile ...]
+###
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(PROFILES)
+    print('%-18s %-8s %6s %9s %9s %9s %9s %7s %9s' % ('profile', 'phase', 'ops', 'MB/s', 'p50 ms', 'p99 ms', 'p99.9 ms', 'errors', 'corrupted'))
+    for name in names:
+        results = run_scenario(name)
+        for phase in ('write', 'read', 'rebuild'):
+            r = results[phase]
+            print('%-18s %-8s %6d %9.3f %9.2f %9.2f %9.2f %7d %9d' % (name, phase, r['operations'], r['MB/s'], r['p50_ms'],
+                                                                      r['p99_ms'], r['p999_ms'], r['errors'], r['corrupted']))
+        print('%-18s injected %s' % (name, results['injected']))
@@ -3,6 +3,11 @@ import sys
 import functools
 from functools import reduce
 
+try:
+    import numpy
+except ImportError: # the array methods fall back to plain lists
+    numpy = None
+
 # The following list of primitive polynomials are the Conway Polynomials
 # from the list at
 # http://sporadic.stanford.edu/reference/databases/sage/databases/conway.html and
@@ -90,6 +95,11 @@ class FField:
     ConvertListToElement
     TestFullDivision
     TestInverse
+    AddArray
+    MultiplyArray
+    ScaleBuffer
+    DotProduct
+    InverseArray
 
     Most of these methods take integers or longs representing field
     elements as arguments and return integers representing the desired
@@ -119,6 +129,14 @@ class FField:
 >>> d
 7
 
+    The *Array methods and ScaleBuffer/DotProduct work on whole buffers
+    of field elements at once (NumPy arrays when NumPy is installed,
+    lists otherwise):
+
+>>> F = ffield.FField(8)
+>>> list(F.ScaleBuffer(2, [1, 2, 128]))
+[2, 4, 29]
+
     See documentation on the appropriate method for further details.
     """
 
@@ -143,6 +161,8 @@ class FField:
         """
 
         self.n = n
+        self.logTable = None # built on first use by PrepareLogTables
+        self.scaleRows = {}
         if (gen):
             self.generator = gen
         else:
@@ -435,6 +455,194 @@ class FField:
                            + repr(aInv) + ', prod=' + repr(prod),
                            'gen=' + repr(self.generator))
 
+    def PrepareLogTables(self):
+        """
+        Builds the logarithm and exponential tables of the field with
+        respect to the element x (the integer 2), which generates the
+        multiplicative group since the generator polynomial is primitive.
+        The exponential table is stored twice so that log(a) + log(b)
+        never needs to be reduced modulo 2^n - 1.
+
+        Tables are only built for fields up to GF(2^16); the array
+        methods use the scalar Multiply/Inverse for larger fields.
+        """
+
+        if (self.logTable is not None or self.n > 16):
+            return
+        fieldSize = 1 << self.n
+        order = fieldSize - 1
+        expTable = [0]*(2*order)
+        logTable = [0]*fieldSize
+        x = 1
+        for i in range(order):
+            if (i > 0 and x == 1):
+                raise ValueError('x does not generate GF(2^' + repr(self.n)
+                                 + ') with generator ' + repr(self.generator))
+            expTable[i] = x
+            logTable[x] = i
+            x = x << 1
+            if (x & fieldSize):
+                x = x ^ self.generator
+        expTable[order:] = expTable[:order]
+
+        if (numpy is not None):
+            self.expTable = numpy.array(expTable, dtype=self.ArrayType())
+            self.logTable = numpy.array(logTable, dtype=numpy.int32)
+        else:
+            self.expTable = expTable
+            self.logTable = logTable
+
+    def ArrayType(self):
+        """
+        Returns the smallest NumPy unsigned dtype holding every element
+        of the field (object for fields larger than GF(2^64)).
+        """
+
+        for bits, dtype in ((8, 'uint8'), (16, 'uint16'),
+                            (32, 'uint32'), (64, 'uint64')):
+            if (self.n <= bits):
+                return numpy.dtype(dtype)
+        return numpy.dtype(object)
+
+    def AsArray(self, values):
+        """
+        Converts a sequence of field elements (list, bytes, bytearray or
+        array) to the buffer type used by the array methods.
+        """
+
+        if (numpy is not None):
+            return numpy.asarray(values, dtype=self.ArrayType())
+        return list(values)
+
+    def ScaleRow(self, c):
+        """
+        Returns the lookup tables used to multiply a buffer by the
+        constant c.  For fields up to GF(2^8) this is one table indexed
+        by the element; for GF(2^16) it is a pair of 256 entry tables
+        for the low and high byte (c*v = c*lo(v) + c*(hi(v) << 8)).
+        """
+
+        try:
+            return self.scaleRows[c]
+        except KeyError:
+            pass
+        self.PrepareLogTables()
+        logC = int(self.logTable[c])
+        expTable = self.expTable
+        logTable = self.logTable
+        low = [0] + [int(expTable[logC + int(logTable[v])])
+                     for v in range(1, min(256, 1 << self.n))]
+        if (self.n <= 8):
+            row = (bytes(low + [0]*(256 - len(low))),)
+        else:
+            high = [0] + [int(expTable[logC + int(logTable[v << 8])])
+                          for v in range(1, 1 << (self.n - 8))]
+            row = (low, high)
+        if (numpy is not None):
+            row = tuple(numpy.array(list(t), dtype=self.ArrayType())
+                        for t in row)
+        if (len(self.scaleRows) >= 1024):
+            self.scaleRows.clear()
+        self.scaleRows[c] = row
+        return row
+
+    def AddArray(self, a, b):
+        """
+        Adds two buffers of field elements element-wise (XOR).
+        """
+
+        if (numpy is not None):
+            return numpy.bitwise_xor(self.AsArray(a), self.AsArray(b))
+        return [x ^ y for x, y in zip(a, b)]
+
+    def MultiplyArray(self, a, b):
+        """
+        Multiplies two buffers of field elements element-wise and returns
+        the resulting buffer.
+        """
+
+        a = self.AsArray(a)
+        b = self.AsArray(b)
+        if (len(a) != len(b)):
+            raise ValueError('MultiplyArray needs buffers of the same length')
+        self.PrepareLogTables()
+        if (self.logTable is None):
+            return self.AsArray([self.Multiply(int(x), int(y))
+                                 for x, y in zip(a, b)])
+        if (numpy is not None):
+            result = self.expTable[self.logTable[a] + self.logTable[b]]
+            result[(a == 0) | (b == 0)] = 0
+            return result
+        expTable = self.expTable
+        logTable = self.logTable
+        return [expTable[logTable[x] + logTable[y]] if (x and y) else 0
+                for x, y in zip(a, b)]
+
+    def ScaleBuffer(self, c, buf):
+        """
+        Multiplies every element of buf by the field element c and
+        returns the resulting buffer.
+        """
+
+        if (c == 0):
+            return self.AsArray([0]*len(buf))
+        if (c == 1):
+            return self.AsArray(buf).copy()
+        if (self.n > 16):
+            return self.AsArray([self.Multiply(c, int(x)) for x in buf])
+        row = self.ScaleRow(c)
+        if (numpy is not None):
+            buf = self.AsArray(buf)
+            if (self.n <= 8):
+                return row[0][buf]
+            return row[0][buf & 0xff] ^ row[1][buf >> 8]
+        if (self.n <= 8):
+            return list(bytes(buf).translate(row[0]))
+        low, high = row
+        return [low[x & 0xff] ^ high[x >> 8] for x in buf]
+
+    def DotProduct(self, coefficients, buffers):
+        """
+        Returns the sum (XOR) of coefficients[i] * buffers[i], each
+        product being computed with ScaleBuffer.  This is the inner loop
+        of every parity or recovery computation.
+        """
+
+        result = None
+        for c, buf in zip(coefficients, buffers):
+            if (c == 0):
+                continue
+            product = self.ScaleBuffer(c, buf)
+            if (result is None):
+                result = product
+            elif (numpy is not None):
+                result ^= product
+            else:
+                result = [x ^ y for x, y in zip(result, product)]
+        if (result is None):
+            size = len(buffers[0]) if len(buffers) else 0
+            return self.AsArray([0]*size)
+        return result
+
+    def InverseArray(self, a):
+        """
+        Computes the multiplicative inverse of every element of a.
+        Raises ZeroDivisionError if a contains 0.
+        """
+
+        a = self.AsArray(a)
+        if (0 in a):
+            raise ZeroDivisionError('0 has no inverse in GF(2^'
+                                    + repr(self.n) + ')')
+        self.PrepareLogTables()
+        if (self.logTable is None):
+            return self.AsArray([self.Inverse(int(x)) for x in a])
+        order = (1 << self.n) - 1
+        if (numpy is not None):
+            return self.expTable[order - self.logTable[a]]
+        return [self.expTable[order - self.logTable[x]] for x in a]
+
+
 class LUT:
     """
     Lookup table used to speed up some finite field operations.
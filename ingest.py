@@ -0,0 +1,232 @@
+import os
+import time
+import argparse
+import concurrent.futures
+import parity
+import merkle
+import allocation
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # Python < 3.8, the stripes are encoded in this process
+    shared_memory = None
+
+BATCH_BYTES = 16 * 1024 * 1024      # Data written, and metadata committed, at once
+READERS = 8                         # Threads reading the files
+
+ENCODERS = {}   # (number of disks, parity disks): parity encoder of this process
+
+
+###
+# Files under a directory, [(name, path), ...] sorted by name
+# Names are the paths relative to the directory, with '/' separators
+###
+def walk(root):
+    files = []
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                files.append((os.path.relpath(path, root).replace(os.sep, '/'), path))
+    return sorted(files)
+
+###
+# Read the files with several threads, yielding (name, data, tree) in order
+# Only a few files per thread are read ahead, a large tree is never held in memory
+###
+def read_files(files, readers, block_size):
+    def read(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        return data, merkle.merkle_tree.from_bytes(data, block_size)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=readers, thread_name_prefix='ingest') as pool:
+        pending = []
+        for name, path in files:
+            pending.append((name, pool.submit(read, path)))
+            if len(pending) >= 4 * readers:
+                name, future = pending.pop(0)
+                yield (name,) + future.result()
+        for name, future in pending:
+            yield (name,) + future.result()
+
+###
+# Parity encoder for a geometry, built once per process
+###
+def encoder(number_of_disks, parity_disks):
+    key = (number_of_disks, parity_disks)
+    if key not in ENCODERS:
+        if parity_disks == 2:
+            ENCODERS[key] = parity.parity(number_of_disks)
+        else:
+            ENCODERS[key] = parity.reed_solomon(number_of_disks - parity_disks, parity_disks)
+    return ENCODERS[key]
+
+###
+# Parity chunks of count whole stripes of buffer from byte start on
+###
+def encode_buffer(buffer, start, count, number_of_disks, chunk_size, parity_disks):
+    engine = encoder(number_of_disks, parity_disks)
+    data_disks = number_of_disks - parity_disks
+    parities = []
+    for s in range(count):
+        base = start + s * data_disks * chunk_size
+        data = [list(buffer[base + j * chunk_size:base + (j + 1) * chunk_size]) for j in range(data_disks)]
+        parities.append([[int(x) for x in chunk] for chunk in engine.encode(data)])
+    return parities
+
+###
+# Same as encode_buffer in a worker process, the buffer being a shared memory block
+###
+def encode_shared(name, start, count, number_of_disks, chunk_size, parity_disks):
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        return encode_buffer(memory.buf, start, count, number_of_disks, chunk_size, parity_disks)
+    finally:
+        memory.close()
+
+###
+# Parity of every stripe of buffer, spread over the worker processes
+###
+def encode(raid, buffer, pool, workers):
+    stripe = raid.P_INDEX * raid.CHUNK_SIZE
+    stripes = len(buffer) // stripe
+    geometry = (raid.NUMBER_OF_DISKS, raid.CHUNK_SIZE, raid.PARITY_DISKS)
+    if pool is None or stripes < 2:
+        return encode_buffer(buffer, 0, stripes, *geometry)
+
+    memory = shared_memory.SharedMemory(create=True, size=len(buffer))
+    try:
+        memory.buf[:len(buffer)] = buffer
+        step = -(-stripes // (4 * workers))
+        futures = [pool.submit(encode_shared, memory.name, s * stripe, min(step, stripes - s), *geometry)
+                   for s in range(0, stripes, step)]
+        parities = []
+        for future in futures:
+            parities.extend(future.result())
+        return parities
+    finally:
+        memory.close()
+        memory.unlink()
+
+###
+# Store a batch of files [(name, data, tree), ...] in whole stripes from the
+# next free index and commit their metadata once
+# Files smaller than a chunk are packed together first, the others follow
+# each from the start of a chunk so they own their chunks
+###
+def store_batch(raid, batch, pool, workers):
+    with raid.LOCK:
+        if raid.RESHAPE is not None:
+            for name, data, tree in batch:
+                if name in raid.FILES_INFO:
+                    raid.delete_data(name)
+            return store_batch(raid.RESHAPE.target, batch, pool, workers)
+        for name, data, tree in batch:
+            if name in raid.FILES_INFO:
+                raid.delete_data(name)
+
+        buffer = bytearray()
+        placements = []     # (name, data, tree, offset in buffer, packed)
+        for name, data, tree in batch:
+            if len(data) < raid.CHUNK_SIZE:
+                placements.append((name, data, tree, len(buffer), True))
+                buffer += data
+        packed = len(buffer)
+        for name, data, tree in batch:
+            if len(data) >= raid.CHUNK_SIZE:
+                buffer += bytes(-len(buffer) % raid.CHUNK_SIZE)
+                placements.append((name, data, tree, len(buffer), False))
+                buffer += data
+        length = len(buffer)
+
+        first = raid.current_index
+        if length > 0:
+            buffer += bytes(-length % (raid.P_INDEX * raid.CHUNK_SIZE))
+            first = raid.write_stripes(buffer, encode(raid, buffer, pool, workers), length)
+
+        pack_id = None
+        if packed > 0:
+            pack_id = max(raid.PACKS) + 1 if len(raid.PACKS) > 0 else 0
+            raid.PACKS[pack_id] = {'extent': allocation.extent(first, 0, 0, packed), 'objects': set()}
+        for name, data, tree, offset, in_pack in placements:
+            if len(data) == 0:
+                raid.FILES_INFO[name] = []
+            elif in_pack:
+                raid.FILES_INFO[name] = [allocation.extent(first, 0, offset, len(data), pack_id)]
+                raid.PACKS[pack_id]['objects'].add(name)
+            else:
+                position = first * raid.P_INDEX + offset // raid.CHUNK_SIZE
+                raid.FILES_INFO[name] = [allocation.extent(position // raid.P_INDEX, position % raid.P_INDEX, 0, len(data))]
+            raid.DIGESTS[name] = tree
+        raid.commit()
+
+###
+# Store every file under root as an object named prefix + its relative path
+# Files are read by reader threads, packed in whole stripes, the parity of the
+# stripes is computed by worker processes (all the processors by default, 0
+# to compute it in this process) and the stripes are written on all the
+# disks at once; metadata is committed once per batch of batch_bytes
+# Return {'files': ..., 'bytes': ..., 'seconds': ..., 'MB/s': ...}
+###
+def ingest(raid, root, prefix='', readers=READERS, workers=None, batch_bytes=BATCH_BYTES):
+    start = time.time()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = None
+    if workers > 1 and shared_memory is not None:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    files = 0
+    size = 0
+    try:
+        batch = []
+        batch_size = 0
+        for name, data, tree in read_files(walk(root), readers, raid.DIGEST_BLOCK_SIZE):
+            batch.append((prefix + name, data, tree))
+            batch_size += len(data)
+            files += 1
+            size += len(data)
+            if batch_size >= batch_bytes:
+                store_batch(raid, batch, pool, workers)
+                batch = []
+                batch_size = 0
+        if len(batch) > 0:
+            store_batch(raid, batch, pool, workers)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if raid.JOURNAL is not None:
+        raid.JOURNAL.wait()
+
+    seconds = time.time() - start
+    return {'files': files, 'bytes': size, 'seconds': seconds,
+            'MB/s': size / seconds / 1024 / 1024 if seconds > 0 else 0}
+
+
+if __name__ == '__main__':
+    import controller
+
+    parser = argparse.ArgumentParser(description="Store every file of a directory tree on a RAID6")
+    parser.add_argument('root', help="directory to store")
+    parser.add_argument('--prefix', default='', help="prepended to the names of the objects")
+    parser.add_argument('--path', default='disks/', help="root of the disks of the RAID6")
+    parser.add_argument('--disks', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=128)
+    parser.add_argument('--parity-disks', type=int, default=2)
+    parser.add_argument('--backend', default='directory', choices=['directory', 'image', 'memory'])
+    parser.add_argument('--reset', action='store_true', help="start from empty disks")
+    parser.add_argument('--readers', type=int, default=READERS)
+    parser.add_argument('--workers', type=int, default=None, help="parity processes, all the processors by default")
+    parser.add_argument('--batch-mb', type=float, default=BATCH_BYTES / 1024 / 1024)
+    args = parser.parse_args()
+
+    raid = controller.RAID6(args.disks, args.chunk_size, args.parity_disks, reset=args.reset,
+                            path=args.path, backend=args.backend)
+    try:
+        stats = ingest(raid, args.root, args.prefix, args.readers, args.workers, int(args.batch_mb * 1024 * 1024))
+    finally:
+        raid.close()
+    print('%d files, %.1f MB in %.2f s: %.3f MB/s' % (stats['files'], stats['bytes'] / 1024 / 1024,
+                                                      stats['seconds'], stats['MB/s']))
@@ -0,0 +1,151 @@
+import os
+import struct
+import threading
+import zlib
+
+# Record header: type, disk, index, payload length
+HEADER = struct.Struct('<cIqI')
+CRC = struct.Struct('<I')
+
+CHUNK_RECORD = b'C'     # New content of one chunk
+METADATA_RECORD = b'M'  # Pickled changes of the RAID6 metadata made by an operation
+COMMIT_RECORD = b'E'    # End of an operation, everything before it can be applied
+
+
+class write_journal:
+    '''
+    Sequential write-ahead log of chunk writes
+    Chunks are only applied to the disks once the operation writing them is
+    committed, so a crash never leaves an index with stale parity
+    Commits are made durable by wait(): the first thread waiting fsyncs the
+    journal, the commits logged meanwhile by other threads share its next
+    fsync (group commit)
+    '''
+    def __init__(self, path, reset=False):
+        self.PATH = path
+        self.FILE = os.path.join(path, 'journal')
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if reset and os.path.exists(self.FILE):
+            os.remove(self.FILE)
+
+        self.pending = {}       # (disk, index): raw chunk, committed or not, not applied yet
+        self.f = open(self.FILE, 'ab')
+        self.size = self.f.tell()   # Bytes of the journal file, chunk and metadata records
+
+        self.condition = threading.Condition()
+        self.committed = 0      # Commits logged
+        self.durable = 0        # Commits fsynced
+        self.syncing = False    # A thread is fsyncing the journal
+
+    def write_record(self, kind, disk, index, payload):
+        header = HEADER.pack(kind, disk, index, len(payload))
+        with self.condition:
+            self.f.write(header + payload + CRC.pack(zlib.crc32(header + payload)))
+            self.size += HEADER.size + len(payload) + CRC.size
+
+    ###
+    # Log the new content of a chunk, readers see it immediately through lookup
+    ###
+    def append(self, disk, index, raw):
+        self.write_record(CHUNK_RECORD, disk, index, raw)
+        self.pending[(disk, index)] = raw
+
+    def lookup(self, disk, index):
+        return self.pending.get((disk, index))
+
+    ###
+    # Mark the end of an operation, it is durable once wait() returns
+    ###
+    def commit(self, metadata):
+        self.write_record(METADATA_RECORD, 0, 0, metadata)
+        self.write_record(COMMIT_RECORD, 0, 0, b'')
+        with self.condition:
+            self.committed += 1
+
+    ###
+    # Return once every commit logged so far is on disk
+    # A single thread fsyncs at a time, the others wait for it, and the ones
+    # whose commits came after its flush fsync together once it is done
+    ###
+    def wait(self):
+        with self.condition:
+            target = self.committed
+            while self.durable < target and self.syncing:
+                self.condition.wait()
+            if self.durable >= target:
+                return
+            self.syncing = True
+            target = self.committed
+            self.f.flush()
+            fileno = self.f.fileno()
+        try:
+            os.fsync(fileno)
+        finally:
+            with self.condition:
+                self.syncing = False
+                self.durable = max(self.durable, target)
+                self.condition.notify_all()
+
+    def sync(self):
+        with self.condition:
+            while self.syncing:
+                self.condition.wait()
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.durable = self.committed
+            self.condition.notify_all()
+
+    ###
+    # Empty the journal once every pending chunk is safely on the disks
+    ###
+    def truncate(self):
+        with self.condition:
+            while self.syncing:
+                self.condition.wait()
+            self.f.close()
+            self.f = open(self.FILE, 'wb')
+            self.size = 0
+        self.sync()
+        self.pending = {}
+
+    ###
+    # Read back the journal and return the chunks and the metadata changes,
+    # in order, of the committed operations, a torn or uncommitted tail is ignored
+    ###
+    def replay(self):
+        with self.condition:
+            self.f.flush()
+        chunks = {}
+        metadata = []
+        operation = {}
+        operation_metadata = None
+        with open(self.FILE, 'rb') as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                kind, disk, index, length = HEADER.unpack(header)
+                payload = f.read(length)
+                crc = f.read(CRC.size)
+                if len(payload) < length or len(crc) < CRC.size or CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                    break
+
+                if kind == CHUNK_RECORD:
+                    operation[(disk, index)] = payload
+                elif kind == METADATA_RECORD:
+                    operation_metadata = payload
+                elif kind == COMMIT_RECORD:
+                    chunks.update(operation)
+                    if operation_metadata is not None:
+                        metadata.append(operation_metadata)
+                    operation = {}
+                    operation_metadata = None
+                else:
+                    break
+        return chunks, metadata
+
+    def close(self):
+        self.sync()
+        self.f.close()
@@ -0,0 +1,44 @@
+import threading
+import concurrent.futures
+
+
+class member_lanes:
+    '''
+    One I/O thread per member disk
+    The chunk reads and writes of an index are issued to all its disks at once
+    and waited for together, so an index costs the latency of its slowest disk
+    rather than the sum of the latencies of its disks
+    Each disk serves its requests in order, like a device queue
+    '''
+    def __init__(self, number_of_disks):
+        self.lanes = [None] * number_of_disks
+        self.backlog = [0] * number_of_disks    # Requests queued or running on each disk
+        self.lock = threading.Lock()
+
+    def submit(self, disk, function, *args):
+        with self.lock:
+            if self.lanes[disk] is None:
+                self.lanes[disk] = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='disk_' + str(disk))
+            self.backlog[disk] += 1
+        future = self.lanes[disk].submit(function, *args)
+        future.add_done_callback(lambda future: self.done(disk))
+        return future
+
+    def done(self, disk):
+        with self.lock:
+            self.backlog[disk] -= 1
+
+    ###
+    # Run calls [(disk, function, args), ...] on their disks and wait for all of
+    # them, returning the result of each call or the exception it raised
+    ###
+    def run(self, calls):
+        futures = [self.submit(disk, function, *args) for disk, function, args in calls]
+        concurrent.futures.wait(futures)
+        return [future.exception() if future.exception() is not None else future.result() for future in futures]
+
+    def shutdown(self):
+        for lane in self.lanes:
+            if lane is not None:
+                lane.shutdown(wait=True)
+        self.lanes = [None] * len(self.lanes)
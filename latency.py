@@ -0,0 +1,71 @@
+import threading
+from collections import deque
+
+
+class disk_latency:
+    '''
+    Latency statistics of the chunk reads of each disk
+    Keeps an EWMA and a window of recent samples for the percentiles, and
+    flags the disks that are persistently slower than the others
+    '''
+    def __init__(self, number_of_disks, window=256, alpha=0.1):
+        self.ALPHA = alpha
+        self.SLOW_FACTOR = 3.0      # A disk is slow when its EWMA is this many times the median
+        self.MIN_SAMPLES = 32       # Samples needed before a disk can be flagged
+
+        self.lock = threading.Lock()
+        self.ewma = [None] * number_of_disks
+        self.samples = [deque(maxlen=window) for _ in range(number_of_disks)]
+        self.reads = [0] * number_of_disks
+        self.hedged = [0] * number_of_disks     # Reads of the disk replaced by a reconstruction
+
+    def record(self, disk, seconds):
+        with self.lock:
+            if self.ewma[disk] is None:
+                self.ewma[disk] = seconds
+            else:
+                self.ewma[disk] = (1 - self.ALPHA) * self.ewma[disk] + self.ALPHA * seconds
+            self.samples[disk].append(seconds)
+            self.reads[disk] += 1
+
+    def record_hedged(self, disk):
+        with self.lock:
+            self.hedged[disk] += 1
+
+    def percentile(self, disk, p):
+        values = sorted(self.samples[disk])
+        if len(values) == 0:
+            return None
+        return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+    ###
+    # Time after which an index read stops waiting for its slowest chunks:
+    # factor times the median of the p95 latency of the disks
+    ###
+    def budget(self, factor=2.0, minimum=0.001):
+        with self.lock:
+            p95 = sorted(x for x in (self.percentile(disk, 95) for disk in range(len(self.samples))) if x is not None)
+        if len(p95) == 0:
+            return None
+        return max(minimum, factor * p95[len(p95) // 2])
+
+    def slow_disks(self):
+        with self.lock:
+            known = sorted(x for x in self.ewma if x is not None)
+            if len(known) == 0:
+                return []
+            median = known[len(known) // 2]
+            return [disk for disk in range(len(self.ewma))
+                    if self.ewma[disk] is not None and len(self.samples[disk]) >= self.MIN_SAMPLES
+                    and self.ewma[disk] > self.SLOW_FACTOR * median]
+
+    def stats(self):
+        slow = self.slow_disks()
+        with self.lock:
+            return dict((disk, {'ewma': self.ewma[disk],
+                                'p50': self.percentile(disk, 50),
+                                'p95': self.percentile(disk, 95),
+                                'p99': self.percentile(disk, 99),
+                                'reads': self.reads[disk],
+                                'hedged': self.hedged[disk],
+                                'slow': disk in slow}) for disk in range(len(self.ewma)))
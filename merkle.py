@@ -0,0 +1,150 @@
+import hashlib
+
+
+###
+# Digests of the tree: blocks of the object and nodes are hashed with a
+# different prefix so a node can never be taken for a block
+###
+def block_digest(data):
+    return hashlib.blake2b(b'\x00' + data, digest_size=16).digest()
+
+def node_digest(left, right):
+    return hashlib.blake2b(b'\x01' + left + right, digest_size=16).digest()
+
+
+class merkle_tree:
+    '''
+    Merkle tree of the data of an object: a leaf per BLOCK_SIZE bytes, each
+    node the digest of its two children, the last node of a level is moved
+    up as is when it has no sibling
+    Two objects with the same root hold the same data; comparing two trees
+    from the root only visits the nodes above the blocks that differ
+    '''
+    def __init__(self, block_size, leaves=[], size=0):
+        self.BLOCK_SIZE = block_size
+        self.size = size            # Bytes of the object
+        self.levels = [list(leaves)]
+        self.recompute(range(len(self.levels[0])))
+
+    @classmethod
+    def from_bytes(cls, data, block_size):
+        return cls(block_size, [block_digest(data[i:i + block_size]) for i in range(0, len(data), block_size)], len(data))
+
+    @classmethod
+    def from_file(cls, file, block_size):
+        leaves = []
+        size = 0
+        with open(file, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if len(block) == 0:
+                    break
+                leaves.append(block_digest(block))
+                size += len(block)
+        return cls(block_size, leaves, size)
+
+    ###
+    # Recompute the nodes above the changed leaves only
+    ###
+    def recompute(self, changed):
+        level = 0
+        changed = set(changed)
+        while len(self.levels[level]) > 1:
+            below = self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            above = self.levels[level + 1]
+            count = (len(below) + 1) // 2
+            del above[count:]
+            above.extend([None] * (count - len(above)))
+            changed = set(i // 2 for i in changed) | set(i for i in range(count) if above[i] is None)
+            for i in changed:
+                if 2 * i + 1 < len(below):
+                    above[i] = node_digest(below[2 * i], below[2 * i + 1])
+                else:
+                    above[i] = below[2 * i]
+            level += 1
+        del self.levels[level + 1:]
+
+    ###
+    # Replace the leaves from the first one on by the digests of data, which
+    # starts on a block boundary; the object now holds size bytes
+    ###
+    def update(self, first, data, size):
+        leaves = self.levels[0]
+        if first > len(leaves):
+            raise ValueError("Blocks " + str(len(leaves)) + " to " + str(first - 1) + " are missing")
+        count = -(-size // self.BLOCK_SIZE)
+        new = [block_digest(data[i:i + self.BLOCK_SIZE]) for i in range(0, len(data), self.BLOCK_SIZE)]
+        changed = set(i for i in range(first, first + len(new)) if i >= len(leaves) or leaves[i] != new[i - first])
+        leaves.extend([None] * (first + len(new) - len(leaves)))
+        leaves[first:first + len(new)] = new
+        if count < len(self.levels[0]):
+            changed.add(count - 1)
+        del leaves[count:]
+        self.size = size
+        self.recompute(i for i in changed if i < count)
+
+    ###
+    # Copy whose updates leave this tree as it is, without hashing anything
+    ###
+    def copy(self):
+        tree = merkle_tree(self.BLOCK_SIZE, size=self.size)
+        tree.levels = [list(level) for level in self.levels]
+        return tree
+
+    def root(self):
+        if len(self.levels[0]) == 0:
+            return block_digest(b'')
+        return self.levels[-1][0]
+
+    def hexdigest(self):
+        return self.root().hex()
+
+    ###
+    # Node at a level, the root stands for itself at the levels above it
+    ###
+    def node(self, level, i):
+        if level >= len(self.levels):
+            return self.levels[-1][0] if i == 0 and len(self.levels[0]) > 0 else None
+        return self.levels[level][i] if i < len(self.levels[level]) else None
+
+    ###
+    # Blocks of this object that differ from another one, [(offset, length), ...]
+    ###
+    def diff(self, other):
+        if other is None or other.BLOCK_SIZE != self.BLOCK_SIZE:
+            return [(0, self.size)] if self.size > 0 else []
+        blocks = []
+        top = max(len(self.levels), len(other.levels)) - 1
+        stack = [(top, 0)]
+        while len(stack) > 0:
+            level, i = stack.pop()
+            mine = self.node(level, i)
+            if mine is None or mine == other.node(level, i):
+                continue
+            if level == 0:
+                blocks.append(i)
+                continue
+            stack.append((level - 1, 2 * i + 1))
+            stack.append((level - 1, 2 * i))
+
+        # Consecutive blocks are merged in one range
+        ranges = []
+        for i in sorted(blocks):
+            offset = i * self.BLOCK_SIZE
+            length = min(self.BLOCK_SIZE, self.size - offset)
+            if len(ranges) > 0 and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+            else:
+                ranges.append((offset, length))
+        return ranges
+
+    def __eq__(self, other):
+        return isinstance(other, merkle_tree) and self.size == other.size and self.root() == other.root()
+
+    def __reduce__(self):
+        return (merkle_tree, (self.BLOCK_SIZE, self.levels[0], self.size))
+
+    def __repr__(self):
+        return 'merkle_tree(' + self.hexdigest() + ', ' + str(self.size) + ' bytes)'
@@ -1,3 +1,5 @@
+import sys
+import array
 import gf
 
 DEBUG = False
@@ -5,9 +7,18 @@ DEBUG = False
 BYTE_SIZE = 8
 CHUNK_SIZE = BYTE_SIZE
 
+# Array type of each lane size in bytes, values of a chunk packed in a big integer
+LANE_TYPES = {}
+for code in 'BHILQ':
+    LANE_TYPES.setdefault(array.array(code).itemsize, code)
+
 class parity:
     def __init__(self, number_of_disk=8):
         self.F = gf.FField(number_of_disk)
+        self.LANE_BYTES = (number_of_disk + 7) // 8
+        self.LANE_TYPE = LANE_TYPES.get(self.LANE_BYTES)     # None: too wide, Q is computed byte by byte
+        self.REDUCTION = self.F.generator ^ (1 << number_of_disk)   # Generator without its x^n term
+        self.masks = {}     # Chunk length: (1 in every lane, lower n - 1 bits of every lane)
 
     def compute_P(self,list_chunks):
         c = list_chunks[0]
@@ -16,7 +27,14 @@ class parity:
         return c
 
 
-    def compute_Q(self,list_chunks):
+    # positions are the places of the chunks in the stripe when some (zero) chunks are left out
+    def compute_Q(self,list_chunks,positions=None):
+        if positions is not None:
+            c = 0
+            for i, x in zip(positions, list_chunks):
+                c = c ^ self.F.Multiply(2**i, x)
+            return c
+
         c = list_chunks[0]
         for i in range(1,len(list_chunks)):
             c = c ^ self.F.Multiply(2**i, list_chunks[i]) 
@@ -24,6 +42,74 @@ class parity:
         return c
             
 
+    ###
+    # A chunk packed in a big integer, one lane of LANE_BYTES per value, and back
+    ###
+    def pack(self, chunk):
+        return int.from_bytes(array.array(self.LANE_TYPE, chunk).tobytes(), sys.byteorder)
+
+    def unpack(self, value, length):
+        values = array.array(self.LANE_TYPE)
+        values.frombytes(value.to_bytes(length * self.LANE_BYTES, sys.byteorder))
+        return values.tolist()
+
+    def lane_masks(self, length):
+        if length not in self.masks:
+            self.masks[length] = (self.pack([1] * length), self.pack([(1 << (self.F.n - 1)) - 1] * length))
+        return self.masks[length]
+
+    ###
+    # Multiply every value of a packed chunk by g = 2 at once: the lanes are
+    # shifted left, those whose top bit is shifted out get the reduction
+    # polynomial XORed in (the product of the top bits by the polynomial
+    # stays inside each lane)
+    ###
+    def xtime(self, value, length):
+        ones, low = self.lane_masks(length)
+        return ((value & low) << 1) ^ (((value >> (self.F.n - 1)) & ones) * self.REDUCTION)
+
+    ###
+    # P and Q chunks of the data chunks of a stripe
+    # Q = g^0 D_0 + g^1 D_1 + ... is evaluated with Horner's rule,
+    # Q = ((D_k-1 g + D_k-2) g + ...) g + D_0, on whole packed chunks, so each
+    # step is an xtime and an XOR of big integers instead of a multiply per value
+    # Chunks of zeros add nothing to P and Q, only the others are accumulated
+    ###
+    def encode(self, data_chunks):
+        if self.LANE_TYPE is None:
+            return self.encode_bytewise(data_chunks)
+        length = max([len(x) for x in data_chunks] + [0])
+        P = 0
+        Q = 0
+        for chunk in reversed(data_chunks):
+            if Q != 0:
+                Q = self.xtime(Q, length)
+            if any(chunk):
+                value = self.pack(chunk)
+                P ^= value
+                Q ^= value
+        return [self.unpack(P, length), self.unpack(Q, length)]
+
+    ###
+    # Same as encode, byte by byte
+    ###
+    def encode_bytewise(self, data_chunks):
+        length = max([len(x) for x in data_chunks] + [0])
+        used = [j for j, x in enumerate(data_chunks) if any(x)]
+        columns = [[] for loop in range(length)]
+        positions = [[] for loop in range(length)]
+        for j in used:
+            for i in range(len(data_chunks[j])):
+                columns[i].append(data_chunks[j][i])
+                positions[i].append(j)
+
+        P = []
+        Q = []
+        for x, position in zip(columns, positions):
+            P.append(self.compute_P(x) if len(x) > 0 else 0)
+            Q.append(self.compute_Q(x, position) if len(x) > 0 else 0)
+        return [P, Q]
+
     def recover_one_chunk_with_P(self,remaining_chunks, P_chunk):
         c = P_chunk
         for x in remaining_chunks:
@@ -55,7 +141,146 @@ class parity:
         D_1 = self.F.Multiply(self.F.Inverse(2**missing_chunk_1 ^ 2**missing_chunk_2), self.F.Multiply(2**missing_chunk_2, A) ^ B)
         D_2 = A ^ D_1
         return D_1,D_2
-    
+
+
+class reed_solomon:
+    '''
+    Systematic k data + m parity erasure code over GF(2^8)
+    Any k of the k + m chunks of a stripe are enough to rebuild the others
+    '''
+    def __init__(self, data_disks, parity_disks, matrix='cauchy', field_size=8):
+        self.K = data_disks
+        self.M = parity_disks
+        self.F = gf.FField(field_size)
+        if self.K < 1 or self.M < 1 or self.K + self.M > 2**field_size:
+            raise ValueError("Invalid geometry: " + str(self.K) + "+" + str(self.M))
+
+        if matrix == 'cauchy':
+            self.MATRIX = self.cauchy_matrix()
+        elif matrix == 'vandermonde':
+            self.MATRIX = self.vandermonde_matrix()
+        else:
+            raise ValueError("Unknown encoding matrix: " + str(matrix))
+
+        # erasure pattern (tuple of surviving rows used) -> inverted matrix
+        self.DECODE_CACHE = {}
+
+    ###
+    # Parity row i, column j is 1 / (x_i + y_j) with x_i = K + i and y_j = j
+    # Every square sub-matrix of a Cauchy matrix is invertible
+    ###
+    def cauchy_matrix(self):
+        return [[self.F.Inverse((self.K + i) ^ j) for j in range(self.K)] for i in range(self.M)]
+
+    ###
+    # Vandermonde matrix on the points 0..K+M-1, made systematic by multiplying
+    # it by the inverse of its top K x K block
+    ###
+    def vandermonde_matrix(self):
+        rows = []
+        for r in range(self.K + self.M):
+            row = []
+            value = 1
+            for c in range(self.K):
+                row.append(value)
+                value = self.F.Multiply(value, r)
+            rows.append(row)
+        rows[0] = [1] + [0] * (self.K - 1)  # 0^0 = 1, 0^c = 0
+        top_inverse = self.invert_matrix(rows[:self.K])
+        return [self.multiply_row(row, top_inverse) for row in rows[self.K:]]
+
+    def multiply_row(self, row, matrix):
+        result = []
+        for c in range(len(matrix[0])):
+            value = 0
+            for i in range(len(row)):
+                value ^= self.F.Multiply(row[i], matrix[i][c])
+            result.append(value)
+        return result
+
+    ###
+    # Gauss-Jordan elimination over the field
+    ###
+    def invert_matrix(self, matrix):
+        n = len(matrix)
+        work = [list(row) + [1 if i == j else 0 for j in range(n)] for i, row in enumerate(matrix)]
+        for col in range(n):
+            pivot = None
+            for r in range(col, n):
+                if work[r][col] != 0:
+                    pivot = r
+                    break
+            if pivot is None:
+                raise ValueError("Singular matrix")
+            work[col], work[pivot] = work[pivot], work[col]
+            inverse = self.F.Inverse(work[col][col])
+            work[col] = [self.F.Multiply(inverse, x) for x in work[col]]
+            for r in range(n):
+                if r != col and work[r][col] != 0:
+                    factor = work[r][col]
+                    work[r] = [x ^ self.F.Multiply(factor, y) for x, y in zip(work[r], work[col])]
+        return [row[n:] for row in work]
+
+    ###
+    # Generator row of chunk r of the stripe (identity for data chunks)
+    ###
+    def generator_row(self, r):
+        if r < self.K:
+            return [1 if j == r else 0 for j in range(self.K)]
+        return self.MATRIX[r - self.K]
+
+    ###
+    # Compute the M parity chunks of K equally sized data chunks
+    ###
+    # Chunks of zeros add nothing to the parity and are left out
+    def encode(self, data_chunks):
+        used = [j for j, chunk in enumerate(data_chunks) if any(chunk)]
+        if len(used) == 0:
+            return [self.F.AsArray([0] * len(data_chunks[0])) for row in self.MATRIX]
+        return [self.F.DotProduct([row[j] for j in used], [data_chunks[j] for j in used]) for row in self.MATRIX]
+
+    ###
+    # Return the decoding matrix for the given surviving rows, inverting it
+    # only the first time an erasure pattern is seen
+    ###
+    def decoding_matrix(self, rows):
+        rows = tuple(rows)
+        try:
+            return self.DECODE_CACHE[rows]
+        except KeyError:
+            matrix = self.invert_matrix([self.generator_row(r) for r in rows])
+            self.DECODE_CACHE[rows] = matrix
+            return matrix
+
+    ###
+    # Rebuild the K data chunks from a list of K + M chunks where the
+    # missing ones are None
+    ###
+    def decode(self, chunks):
+        present = [r for r in range(self.K + self.M) if chunks[r] is not None]
+        if len(present) < self.K:
+            raise IOError("Unrecoverable error")
+
+        data = list(chunks[:self.K])
+        if all(x is not None for x in data):
+            return data
+
+        rows = present[:self.K]
+        matrix = self.decoding_matrix(rows)
+        survivors = [chunks[r] for r in rows]
+        for j in range(self.K):
+            if data[j] is None:
+                data[j] = self.F.DotProduct(matrix[j], survivors)
+        return data
+
+    ###
+    # Rebuild every missing chunk (data and parity) of a stripe
+    ###
+    def reconstruct(self, chunks):
+        data = self.decode(chunks)
+        if all(x is not None for x in chunks[self.K:]):
+            return data + list(chunks[self.K:])
+        return data + self.encode(data)
 
 
 if (DEBUG):
@@ -0,0 +1,292 @@
+import os
+import shutil
+import pickle
+import bisect
+import hashlib
+import functools
+import threading
+import concurrent.futures
+import controller
+
+UNIT_SIZE = 1024 * 1024     # Bytes of an object stored in one group
+POINTS = 64                 # Points of each group on the hash ring
+
+GROUP = None    # RAID6 of a group, in the worker process of the group
+
+
+###
+# Work done by the worker of a group, on its RAID6
+###
+def open_group(settings):
+    global GROUP
+    GROUP = controller.RAID6(**settings)
+
+def in_group(function, args):
+    return function(GROUP, *args)
+
+def store_unit(raid, name, data):
+    if name in raid.FILES_INFO:
+        raid.delete_data(name)
+    with open(raid.PATH + 'temp_unit', 'wb') as f:
+        f.write(data)
+    return raid.write_data_from_file(raid.PATH + 'temp_unit', name)
+
+def load_unit(raid, name, offset, length):
+    return raid.read_range(name, offset, length)
+
+def remove_unit(raid, name):
+    return raid.delete_data(name)
+
+def call_method(raid, method, *args):
+    return functools.reduce(getattr, method.split('.'), raid)(*args)
+
+def group_status(raid):
+    return {'units': len(raid.FILES_INFO),
+            'bytes': sum(raid.object_size(name) for name in raid.FILES_INFO),
+            'next_index': raid.current_index,
+            'spares': raid.SPARE_MANAGER.status()}
+
+def close_group(raid):
+    raid.close()
+
+###
+# Position of a name on the hash ring
+###
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class hash_ring:
+    '''
+    Consistent hashing of names over groups: each group owns POINTS points
+    of a ring of 64-bit hashes and a name goes to the group of the first
+    point after its own hash
+    A new group only takes the names falling right before its points, about
+    1 / (groups + 1) of them, the others stay where they are
+    '''
+    def __init__(self, groups=0, points=POINTS):
+        self.POINTS = points
+        self.hashes = []    # Points of the ring, sorted
+        self.groups = []    # Group owning each point
+        for group in range(groups):
+            self.add(group)
+
+    def add(self, group):
+        for point in range(self.POINTS):
+            position = ring_hash(str(group) + ':' + str(point))
+            i = bisect.bisect(self.hashes, position)
+            self.hashes.insert(i, position)
+            self.groups.insert(i, group)
+
+    def group_of(self, name):
+        return self.groups[bisect.bisect(self.hashes, ring_hash(name)) % len(self.hashes)]
+
+
+class group_worker:
+    '''
+    One RAID6 group served by its own worker process, standing in for a
+    node: calls to the group run one after the other in that process, calls
+    to different groups run at the same time
+    With processes=False the group is served by a thread of this process
+    '''
+    def __init__(self, settings, processes=True):
+        self.SETTINGS = settings    # Arguments of the RAID6 of the group
+        self.raid = None
+        if processes:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=open_group, initargs=(settings,))
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='group')
+            self.raid = controller.RAID6(**settings)
+
+    ###
+    # Run function(RAID6 of the group, *args) in the worker, return its future
+    ###
+    def submit(self, function, *args):
+        if self.raid is None:
+            return self.executor.submit(in_group, function, args)
+        return self.executor.submit(function, self.raid, *args)
+
+    def call(self, function, *args):
+        return self.submit(function, *args).result()
+
+    def close(self):
+        self.call(close_group)
+        self.executor.shutdown()
+
+
+class RAID6Pool:
+    '''
+    Several independent RAID6 groups used as one store, like RAID-60: an
+    object is cut in units of UNIT_SIZE bytes and each unit is stored in the
+    group chosen by consistent hashing of its name, so the units of an
+    object are read and written by all the groups at once
+    Each group has its own directory (a node), disks, metadata and worker
+    process; a failed disk is rebuilt by its group only, the groups rebuilding
+    at the same time, and every group keeps the GF(2^disks) of its own disks
+    '''
+    def __init__(self, groups=4, number_of_disk=8, chunk_size=128, parity_disks=2, path='pool/', backend='directory',
+                 reset=True, unit_size=UNIT_SIZE, processes=True):
+        self.PATH = os.path.join(path, '')
+        self.UNIT_SIZE = unit_size
+        self.PROCESSES = processes      # Groups served by worker processes, threads otherwise
+        self.SETTINGS = {'number_of_disk': number_of_disk, 'chunk_size': chunk_size,
+                         'parity_disks': parity_disks, 'backend': backend}
+        self.OBJECTS = {}   # name: {'size': bytes, 'groups': [group of each unit]}
+        self.LOCK = threading.RLock()
+
+        if reset:
+            shutil.rmtree(self.PATH, ignore_errors=True)
+        os.makedirs(self.PATH, exist_ok=True)
+        if not reset and os.path.exists(self.PATH + 'metadata'):
+            with open(self.PATH + 'metadata', 'rb') as f:
+                info = pickle.load(f)
+            groups = info['groups']
+            self.UNIT_SIZE = info['unit_size']
+            self.OBJECTS = info['OBJECTS']
+
+        self.groups = [self.open_group(group, reset) for group in range(groups)]
+        self.ring = hash_ring(groups)
+        self.save_metadata()
+
+    def open_group(self, group, reset):
+        settings = dict(self.SETTINGS, path=self.PATH + 'group_' + str(group) + '/', reset=reset)
+        return group_worker(settings, self.PROCESSES)
+
+    def save_metadata(self):
+        with open(self.PATH + 'metadata.tmp', 'wb') as f:
+            f.write(pickle.dumps({'groups': len(self.groups), 'unit_size': self.UNIT_SIZE, 'OBJECTS': self.OBJECTS}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.PATH + 'metadata.tmp', self.PATH + 'metadata')
+
+    ###
+    # Name of a unit of an object in its group, and its length
+    ###
+    def unit_name(self, name, unit):
+        return name + '#' + str(unit)
+
+    def unit_length(self, name, unit):
+        return min(self.UNIT_SIZE, self.OBJECTS[name]['size'] - unit * self.UNIT_SIZE)
+
+    ###
+    # Wait for calls to the groups, raising the first error
+    ###
+    def wait(self, futures):
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+    ###
+    # Store an object, its units being written by their groups at once
+    ###
+    def write(self, name, data):
+        with self.LOCK:
+            units = [data[i:i + self.UNIT_SIZE] for i in range(0, len(data), self.UNIT_SIZE)]
+            groups = [self.ring.group_of(self.unit_name(name, unit)) for unit in range(len(units))]
+            futures = [self.groups[group].submit(store_unit, self.unit_name(name, unit), units[unit])
+                       for unit, group in enumerate(groups)]
+            # Units of the previous object that are not overwritten
+            if name in self.OBJECTS:
+                for unit, group in enumerate(self.OBJECTS[name]['groups']):
+                    if unit >= len(groups) or groups[unit] != group:
+                        futures.append(self.groups[group].submit(remove_unit, self.unit_name(name, unit)))
+            self.wait(futures)
+            self.OBJECTS[name] = {'size': len(data), 'groups': groups}
+            self.save_metadata()
+            return True
+
+    def write_from_file(self, file, name):
+        with open(file, 'rb') as f:
+            return self.write(name, f.read())
+
+    def read(self, name):
+        with self.LOCK:
+            return self.read_range(name, 0, self.OBJECTS[name]['size'])
+
+    ###
+    # Read length bytes of an object from offset, from the units holding them
+    ###
+    def read_range(self, name, offset, length):
+        with self.LOCK:
+            info = self.OBJECTS[name]
+            end = min(info['size'], offset + length)
+            futures = []
+            for unit in range(offset // self.UNIT_SIZE, -(-end // self.UNIT_SIZE)):
+                start = max(offset, unit * self.UNIT_SIZE) - unit * self.UNIT_SIZE
+                stop = min(end, (unit + 1) * self.UNIT_SIZE) - unit * self.UNIT_SIZE
+                futures.append(self.groups[info['groups'][unit]].submit(load_unit, self.unit_name(name, unit), start, stop - start))
+            return b''.join(self.wait(futures))
+
+    def print_to_file(self, filename, name):
+        with open(filename, 'wb') as f:
+            f.write(self.read(name))
+
+    def delete(self, name):
+        with self.LOCK:
+            info = self.OBJECTS.pop(name)
+            self.wait([self.groups[group].submit(remove_unit, self.unit_name(name, unit))
+                       for unit, group in enumerate(info['groups'])])
+            self.save_metadata()
+            return True
+
+    ###
+    # Objects and their size
+    ###
+    def objects(self):
+        with self.LOCK:
+            return dict((name, info['size']) for name, info in self.OBJECTS.items())
+
+    ###
+    # Add a group and move to it the units it now owns on the ring
+    ###
+    def add_group(self):
+        with self.LOCK:
+            group = len(self.groups)
+            self.groups.append(self.open_group(group, True))
+            self.ring.add(group)
+            self.save_metadata()
+            return self.rebalance()
+
+    ###
+    # Move every unit not stored in the group the ring gives it, return the
+    # number of units moved; each object is moved by all the groups at once
+    ###
+    def rebalance(self):
+        with self.LOCK:
+            moved = 0
+            for name, info in self.OBJECTS.items():
+                moves = [(unit, group, self.ring.group_of(self.unit_name(name, unit))) for unit, group in enumerate(info['groups'])]
+                moves = [x for x in moves if x[1] != x[2]]
+                loads = [self.groups[old].submit(load_unit, self.unit_name(name, unit), 0, self.unit_length(name, unit))
+                         for unit, old, new in moves]
+                self.wait([self.groups[new].submit(store_unit, self.unit_name(name, unit), load.result())
+                           for (unit, old, new), load in zip(moves, loads)])
+                for unit, old, new in moves:
+                    info['groups'][unit] = new
+                self.save_metadata()
+                self.wait([self.groups[old].submit(remove_unit, self.unit_name(name, unit)) for unit, old, new in moves])
+                moved += len(moves)
+            return moved
+
+    ###
+    # Rebuild failed disks, {group: [disks], ...}, every group at once
+    ###
+    def rebuild(self, failures):
+        futures = dict((group, self.groups[group].submit(call_method, 'recovering_disks', disks))
+                       for group, disks in failures.items())
+        return dict((group, future.result()) for group, future in futures.items())
+
+    ###
+    # Call a method of the RAID6 of a group, e.g. call(2, 'BACKEND.fail', 3)
+    ###
+    def call(self, group, method, *args):
+        return self.groups[group].call(call_method, method, *args)
+
+    def status(self):
+        futures = [group.submit(group_status) for group in self.groups]
+        return dict((group, future.result()) for group, future in enumerate(futures))
+
+    def close(self):
+        with self.LOCK:
+            self.save_metadata()
+            for group in self.groups:
+                group.close()
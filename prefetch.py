@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class read_ahead:
+    '''
+    Sequential read-ahead for a RAID6
+    Once indexes are read one after the other, the next ones are read from
+    the disks by background threads into a bounded pool of buffers
+    The window grows while the disks are slower than the reader
+    '''
+    def __init__(self, raid, workers=4, min_window=2, max_window=64):
+        self.raid = raid
+        self.WORKERS = workers
+        self.MIN_WINDOW = min_window
+        self.MAX_WINDOW = max_window
+        self.window = min_window
+
+        self.lock = threading.Lock()
+        self.executor = None
+        self.buffers = {}       # index: chunks read, by position in the index
+        self.inflight = {}      # index: event set once the index is read
+        self.stale = set()      # Indexes written while being read, their buffer is dropped
+
+        self.last_index = None
+        self.streak = 0         # Number of sequential accesses in a row
+        self.last_access = None
+        self.access_interval = None     # EWMA of the time between two sequential accesses
+        self.fetch_time = None          # EWMA of the time to read one index
+
+        self.hits = 0
+        self.waits = 0
+        self.wasted = 0
+
+    ###
+    # Record a read of the user and prefetch the next indexes when it is sequential
+    ###
+    def access(self, index):
+        now = time.time()
+        with self.lock:
+            if self.last_index is not None and index == self.last_index + 1:
+                self.streak += 1
+                self.access_interval = self.ewma(self.access_interval, now - self.last_access)
+            elif index != self.last_index:
+                self.streak = 0
+            self.last_index = index
+            self.last_access = now
+            if self.streak < 2:
+                return
+            self.adapt()
+            last = min(index + self.window, self.raid.current_index)
+            to_fetch = [i for i in range(index + 1, last + 1) if i not in self.buffers and i not in self.inflight]
+            for i in to_fetch:
+                self.inflight[i] = threading.Event()
+            if len(to_fetch) > 0 and self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.WORKERS)
+            executor = self.executor
+
+        for i in to_fetch:
+            executor.submit(self.fetch, i)
+
+    def ewma(self, average, value, alpha=0.2):
+        if average is None:
+            return value
+        return (1 - alpha) * average + alpha * value
+
+    ###
+    # Keep enough indexes in flight to cover the time needed to read one
+    ###
+    def adapt(self):
+        if self.fetch_time is None or self.access_interval is None:
+            return
+        needed = int(self.fetch_time / max(self.access_interval, 1e-6) * self.WORKERS) + self.MIN_WINDOW
+        self.window = max(self.MIN_WINDOW, min(self.MAX_WINDOW, needed))
+
+    def fetch(self, index):
+        start = time.time()
+        chunks = self.raid.read_members(index)
+
+        with self.lock:
+            self.fetch_time = self.ewma(self.fetch_time, time.time() - start)
+            event = self.inflight.pop(index, None)
+            if event is None:
+                return
+            # Buffers read while the index was written are stale
+            if index in self.stale:
+                self.stale.discard(index)
+            else:
+                self.buffers[index] = chunks
+                while len(self.buffers) > 2 * self.MAX_WINDOW:
+                    self.buffers.pop(min(self.buffers))
+                    self.wasted += 1
+        event.set()
+
+    ###
+    # Return the chunks of a prefetched index (None if not prefetched), waiting
+    # for it if it is being read
+    ###
+    def take(self, index):
+        with self.lock:
+            event = self.inflight.get(index)
+            if event is not None:
+                self.waits += 1
+        if event is not None:
+            event.wait(1.0)
+        with self.lock:
+            chunks = self.buffers.pop(index, None)
+            if chunks is not None:
+                self.hits += 1
+            # Buffers behind the reader will not be used anymore
+            for old in [i for i in self.buffers if i < index]:
+                self.buffers.pop(old)
+                self.wasted += 1
+            return chunks
+
+    def invalidate(self, index):
+        with self.lock:
+            self.buffers.pop(index, None)
+            if index in self.inflight:
+                self.stale.add(index)
+
+    ###
+    # Stop the reader threads, waiting for the reads running, and drop the buffers
+    ###
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.buffers = {}
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'waits': self.waits, 'wasted': self.wasted,
+                    'window': self.window, 'buffers': len(self.buffers)}
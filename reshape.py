@@ -0,0 +1,132 @@
+import threading
+import time
+
+
+class reshape_job:
+    '''
+    Online migration of a RAID6 to a new geometry (number of disks, chunk size,
+    parity disks)
+    Objects are moved one at a time, in disk order, to a RAID6 with the new
+    geometry built next to the old disks; the cursor is saved with the metadata
+    so an interrupted reshape resumes where it stopped
+    Objects already moved, and objects written during the reshape, are served
+    by the new geometry, the others by the old one
+    Once every object is moved the old disks are dropped and the RAID6 takes
+    the new geometry
+    '''
+    def __init__(self, raid, geometry, path, order=None, cursor=0, throttle=0.001):
+        self.raid = raid
+        self.GEOMETRY = tuple(geometry)     # (number of disks, chunk size, parity disks)
+        self.PATH = path                    # Root of the RAID6 with the new geometry
+        self.THROTTLE = throttle            # Seconds slept between two moved objects
+
+        resume = order is not None
+        number_of_disk, chunk_size, parity_disks = self.GEOMETRY
+        self.target = raid.__class__(number_of_disk, chunk_size, parity_disks, reset=not resume,
+                                     path=path, backend=raid.BACKEND_FACTORY)
+        self.target.DEDUP = raid.DEDUP
+        if order is None:
+            order = sorted(raid.FILES_INFO, key=raid.object_position)
+        self.order = list(order)    # Objects to move, in disk order
+        self.cursor = cursor        # Objects of order already moved (or skipped)
+
+        # An object found on both sides was being moved when the reshape was
+        # interrupted, the old geometry still holds the valid copy
+        for name in list(self.target.FILES_INFO):
+            if name in raid.FILES_INFO:
+                self.target.delete_data(name)
+
+        self.stopped = threading.Event()
+        self.worker = None
+        self.done = threading.Event()
+
+    def state(self):
+        return {'geometry': self.GEOMETRY, 'path': self.PATH, 'order': self.order, 'cursor': self.cursor}
+
+    ###
+    # Whether an object is served by the new geometry
+    ###
+    def migrated(self, name):
+        return name in self.target.FILES_INFO and name not in self.raid.FILES_INFO
+
+    def start(self):
+        if self.worker is not None:
+            return
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.worker is not None and self.worker is not threading.current_thread():
+            self.worker.join()
+        self.worker = None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    ###
+    # Take the RAID6 lock, giving up if the reshape is stopped meanwhile
+    # (close holds the lock while waiting for this thread)
+    ###
+    def lock(self):
+        while not self.raid.LOCK.acquire(timeout=0.1):
+            if self.stopped.is_set():
+                return False
+        return True
+
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.step():
+                self.finish()
+                return
+            time.sleep(self.THROTTLE)
+
+    ###
+    # Move the object at the cursor, holding the RAID6 lock so user operations
+    # see it on one side or the other
+    # Return False once every object is moved
+    ###
+    def step(self):
+        if not self.lock():
+            return True
+        try:
+            # Objects deleted or rewritten since the reshape started are not there anymore
+            while self.cursor < len(self.order) and self.order[self.cursor] not in self.raid.FILES_INFO:
+                self.cursor += 1
+            if self.cursor >= len(self.order):
+                return False
+            self.move(self.order[self.cursor])
+            self.cursor += 1
+            self.raid.commit()
+            return True
+        finally:
+            self.raid.LOCK.release()
+
+    def move(self, name):
+        raid = self.raid
+        data = raid.read_object(name)
+        codec, level = raid.compression(name)
+        with open(raid.PATH + 'temp_reshape', 'wb') as f:
+            f.write(data)
+        self.target.write_data_from_file(raid.PATH + 'temp_reshape', name, compress=codec, level=level)
+        self.target.READ_COUNT[name] = raid.READ_COUNT.get(name, 0)
+        # The copy must be durable before the old one is dropped; until then
+        # both sides hold the object and reads keep using the old one
+        self.target.flush_bitmap()
+        raid.delete_data(name)
+
+    def finish(self):
+        if not self.lock():
+            return
+        try:
+            if self.raid.RESHAPE is self:
+                self.raid.adopt(self.target)
+        finally:
+            self.raid.LOCK.release()
+        self.done.set()
+        print("[✓] Reshaped to (disks, chunk size, parity disks) =", self.GEOMETRY)
+
+    def status(self):
+        return {'geometry': self.GEOMETRY, 'moved': self.cursor, 'objects': len(self.order),
+                'done': self.done.is_set()}
@@ -0,0 +1,143 @@
+import threading
+import time
+
+
+class spare_manager:
+    '''
+    Watch the member disks of a RAID6, swap a hot spare in when one of them
+    fails and rebuild it in the background while reads are served degraded
+    '''
+    def __init__(self, raid, interval=1.0, throttle=0.001):
+        self.raid = raid
+        self.INTERVAL = interval    # Seconds between two probes of the member disks
+        self.THROTTLE = throttle    # Seconds slept between two rebuilt indexes
+
+        self.PROGRESS = {}          # disk: [indexes rebuilt, indexes to rebuild]
+        self.stopped = threading.Event()
+        self.monitor = None
+        self.workers = {}           # disk: rebuild thread
+
+    ###
+    # Start probing the members, and resume rebuilds interrupted by a restart
+    ###
+    def start(self):
+        if self.monitor is not None:
+            return
+        self.stopped.clear()
+        self.monitor = threading.Thread(target=self.run, daemon=True)
+        self.monitor.start()
+        for disk in list(self.raid.REBUILDING):
+            self.start_rebuild(disk)
+
+    def stop(self):
+        self.stopped.set()
+        if self.monitor is not None:
+            self.monitor.join()
+            self.monitor = None
+        for worker in list(self.workers.values()):
+            worker.join()
+
+    def run(self):
+        while not self.stopped.wait(self.INTERVAL):
+            failed = self.probe()
+            if len(failed) > 0:
+                self.replace(failed)
+
+    ###
+    # Members whose directory disappeared or is not writable anymore
+    ###
+    def probe(self):
+        failed = []
+        for disk in range(self.raid.NUMBER_OF_DISKS):
+            if disk in self.raid.REBUILDING:
+                continue
+            if not self.raid.BACKEND.exists(disk):
+                failed.append(disk)
+        return failed
+
+    ###
+    # Swap a spare in for each failed disk and start rebuilding it
+    # Return False, without swapping anything, when there is not enough spares
+    # or more disks are lost than the parity can cover
+    ###
+    def replace(self, disks):
+        if not self.lock():
+            return False
+        try:
+            disks = [disk for disk in disks if disk not in self.raid.REBUILDING]
+            if len(disks) == 0:
+                return True
+            if len(disks) > len(self.raid.SPARES) or len(disks) + len(self.raid.REBUILDING) > self.raid.PARITY_DISKS:
+                return False
+            for disk in disks:
+                spare = self.raid.SPARES.pop(0)
+                print("[!] Error disk:", disk, "; Replaced by spare", spare)
+                self.raid.BACKEND.replace(disk, spare)
+                self.raid.REBUILDING[disk] = set()
+            self.raid.commit()
+        finally:
+            self.raid.LOCK.release()
+        for disk in disks:
+            self.start_rebuild(disk)
+        return True
+
+    ###
+    # Take the RAID6 lock, giving up if the manager is stopped meanwhile
+    # (close holds the lock while waiting for the threads of the manager)
+    ###
+    def lock(self):
+        while not self.raid.LOCK.acquire(timeout=0.1):
+            if self.stopped.is_set():
+                return False
+        return True
+
+    def start_rebuild(self, disk):
+        worker = threading.Thread(target=self.rebuild, args=(disk,), daemon=True)
+        self.workers[disk] = worker
+        worker.start()
+
+    ###
+    # Rebuild the live indexes of a disk one at a time, releasing the RAID6
+    # lock between two indexes so user operations keep being served
+    ###
+    def rebuild(self, disk):
+        if not self.lock():
+            return
+        try:
+            order = self.raid.rebuild_order()
+        finally:
+            self.raid.LOCK.release()
+        self.PROGRESS[disk] = [0, len(order)]
+        for index in order:
+            if not self.lock():
+                return
+            try:
+                if self.stopped.is_set():
+                    return
+                self.raid.rebuild_index(index)
+            finally:
+                self.raid.LOCK.release()
+            self.PROGRESS[disk][0] += 1
+            time.sleep(self.THROTTLE)
+
+        if not self.lock():
+            return
+        try:
+            self.raid.REBUILDING.pop(disk, None)
+            self.raid.commit()
+        finally:
+            self.raid.LOCK.release()
+        self.workers.pop(disk, None)
+        print("[✓] Disk", disk, "rebuilt on", self.raid.DISK_PATHS[disk])
+
+    ###
+    # Redundancy state of the RAID6, progress of the running rebuilds and
+    # members persistently slower than the others, worth replacing
+    ###
+    def status(self):
+        rebuilding = dict((disk, tuple(self.PROGRESS.get(disk, (0, 0)))) for disk in self.raid.REBUILDING)
+        return {'state': 'rebuilding' if len(rebuilding) > 0 else 'optimal',
+                'tolerated_failures': self.raid.PARITY_DISKS - len(rebuilding),
+                'rebuilding': rebuilding,
+                'spares': list(self.raid.SPARES),
+                'slow_disks': self.raid.LATENCY.slow_disks()}
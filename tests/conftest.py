@@ -0,0 +1,40 @@
+import glob
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+###
+# gf.py caches its tables (ffield.lut.<n>) in the working directory, the tests
+# share one directory so that the tables are built once per run
+###
+@pytest.fixture(scope='session', autouse=True)
+def workdir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('work'))
+    for lut in glob.glob(os.path.join(ROOT, 'ffield.lut.*')):
+        shutil.copy(lut, directory)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    yield directory
+    os.chdir(cwd)
+
+
+###
+# Write bytes to a file of the test directory and return its path
+###
+@pytest.fixture
+def make_file(tmp_path):
+    count = [0]
+
+    def make(data):
+        count[0] += 1
+        path = str(tmp_path / ('input_' + str(count[0])))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    return make
@@ -0,0 +1,55 @@
+import os
+import pickle
+
+import allocation
+import controller
+
+
+def test_disk_usage_reads_like_a_list_of_rows():
+    usage = allocation.disk_usage(8, 128)
+    usage.set(0, 1, 128)
+    usage.set(100, 7, 5)
+    assert len(usage) == 101
+    assert usage[0] == [0, 128, 0, 0, 0, 0, 0, 0] and usage[-1][7] == 5
+    assert usage.get(100, 7) == 5
+    assert usage.indexes_with_data([1, 7]) == [0, 100] and usage.indexes_with_data([2]) == []
+    assert usage.disk_total(1) == 128
+    usage.set_zero(3, 2, True)
+    assert usage.is_zero(3, 2) and usage.zero_chunks() == 1
+
+    copy = pickle.loads(pickle.dumps(usage))
+    assert list(copy) == list(usage) and copy.is_zero(3, 2)
+    assert list(allocation.disk_usage.from_rows(list(usage), 8, 128)) == list(usage)
+
+
+def test_disk_usage_changes_are_applied_elsewhere():
+    usage = allocation.disk_usage(8, 128)
+    usage.set(5, 0, 100)
+    copy = allocation.disk_usage(8, 128)
+    copy.apply_changes(*usage.changes())
+    usage.set(70, 3, 12)
+    usage.set_zero(5, 1, True)
+    copy.apply_changes(*usage.changes())
+    assert list(copy) == list(usage) and copy.is_zero(5, 1)
+    assert usage.changes() == (71, {})
+
+
+def test_extents_read_like_dicts():
+    x = allocation.extent(3, 2, 10, 500, pack=7)
+    assert x['index'] == 3 and x['pack'] == 7 and 'fingerprint' not in x
+    assert dict(x) == {'index': 3, 'disk': 2, 'offset': 10, 'length': 500, 'pack': 7}
+    assert allocation.extent.from_dict(dict(x)) == x
+    assert pickle.loads(pickle.dumps(x)) == x
+
+
+def test_metadata_reopens(tmp_path, make_file):
+    path = str(tmp_path / 'disks')
+    raid = controller.RAID6(8, 128, path=path)
+    data = os.urandom(30000)
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.write_many({'b': b'small'})
+    raid.close()
+    reopened = controller.RAID6(8, 128, path=path, reset=False)
+    assert list(reopened.DISKS_INFO) == list(raid.DISKS_INFO)
+    assert reopened.FILES_INFO == raid.FILES_INFO
+    assert reopened.read_object('a') == data and reopened.read_object('b') == b'small'
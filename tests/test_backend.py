@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import controller
+
+
+@pytest.mark.parametrize('backend', ['directory', 'image', 'memory'])
+@pytest.mark.parametrize('parity_disks', [2, 3])
+def test_backends_round_trip_and_rebuild(tmp_path, make_file, backend, parity_disks):
+    path = str(tmp_path / 'disks')
+    raid = controller.RAID6(8, 128, parity_disks, path=path, backend=backend)
+    raid.CACHE.resize(0)
+    data = os.urandom(50000)
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.BACKEND.fail(2)
+    raid.BACKEND.fail(5)
+    assert raid.read_object('a') == data
+    new = os.urandom(50000)
+    raid.update_data_from_file(make_file(new), 'a')
+    assert raid.read_object('a') == new
+    raid.close()
+
+    if backend != 'memory':
+        reopened = controller.RAID6(8, 128, parity_disks, path=path, backend=backend, reset=False)
+        assert reopened.read_object('a') == new
+        reopened.close()
+
+
+def test_arrays_in_memory_leave_no_metadata(tmp_path, make_file):
+    path = str(tmp_path / 'disks')
+    raid = controller.RAID6(8, 128, path=path, backend='memory')
+    other = controller.RAID6(8, 128, path=str(tmp_path / 'other'), backend='memory')
+    raid.write_many({'a': b'x' * 3000})
+    raid.write_data_from_file(make_file(os.urandom(50000)), 'b')
+    assert 'a' not in other.FILES_INFO
+    raid.BACKEND.fail(2)
+    assert len(raid.read_object('b')) == 50000
+    raid.close()
+    assert 'metadata' not in os.listdir(path) and 'bitmap' not in os.listdir(path)
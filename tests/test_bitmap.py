@@ -0,0 +1,38 @@
+import os
+
+import controller
+
+
+def test_unclean_stop_resyncs_the_dirty_regions(tmp_path, make_file):
+    path = str(tmp_path / 'disks')
+    raid = controller.RAID6(8, 128, path=path)
+    data = os.urandom(40000)
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.close()
+    assert raid.BITMAP.dirty_regions() == []
+
+    # Stopped while writing index 100: its data changed, not its parity
+    raid.write_data_from_file(make_file(os.urandom(60000)), 'b')
+    raid.save_metadata()
+    raid.write_chunk(2, 100, [1] * 128)
+    region = 100 // raid.BITMAP.REGION_SIZE
+    assert region in raid.BITMAP.dirty_regions()
+    del raid
+
+    reopened = controller.RAID6(8, 128, reset=False, path=path)
+    assert reopened.BITMAP.dirty_regions() == []
+    chunks, (P, Q) = reopened.read_one_chunk(100)
+    assert P == [reopened.parity.compute_P([x[k] for x in chunks]) for k in range(128)]
+    assert reopened.read_object('a') == data
+    reopened.close()
+
+
+def test_recovery_keeps_the_indexes_being_written_dirty(tmp_path):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    raid.write_many({'a': b'x' * 3000})
+    raid.flush_bitmap()
+    raid.BITMAP.writing.add(999999)
+    raid.BACKEND.destroy(raid.DISK_PATHS[2])
+    assert raid.read_object('a') == b'x' * 3000
+    assert 999999 in raid.BITMAP.writing
+    assert not any(index in raid.BITMAP.writing for index in raid.lost_indexes([2]))
@@ -0,0 +1,35 @@
+import os
+
+import cache
+import controller
+
+
+def test_lru_eviction_respects_the_byte_budget():
+    lru = cache.stripe_cache(100)
+    lru.put(1, 'one', 40)
+    lru.put(2, 'two', 40)
+    assert lru.get(1) == 'one'
+    lru.put(3, 'three', 40)     # Evicts 2, the least recently used
+    assert lru.get(2) is None and lru.get(1) == 'one' and lru.get(3) == 'three'
+    lru.put(4, 'too big', 101)
+    assert lru.get(4) is None
+    lru.invalidate(1)
+    assert lru.get(1) is None
+    lru.resize(0)
+    assert lru.stats()['bytes'] == 0 and lru.stats()['entries'] == 0
+
+
+def test_reads_hit_the_cache_and_writes_invalidate_it(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    data = os.urandom(10000)
+    raid.write_data_from_file(make_file(data), 'a')
+    assert raid.read_object('a') == data
+    hits = raid.CACHE.stats()['hits']
+    assert raid.read_object('a') == data
+    assert raid.CACHE.stats()['hits'] > hits
+
+    new = os.urandom(10000)
+    raid.update_data_from_file(make_file(new), 'a')
+    assert raid.CACHE.stats()['invalidations'] > 0
+    assert raid.read_object('a') == new
+    raid.close()
@@ -0,0 +1,48 @@
+import json
+import os
+
+import controller
+
+
+def payload(count):
+    return json.dumps([{'id': i, 'name': 'item ' + str(i), 'tags': ['a', 'b']} for i in range(count)]).encode()
+
+
+def test_compressed_objects_round_trip_and_survive_disk_loss(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    data = payload(3000)
+    raid.write_data_from_file(make_file(data), 'zlib', compress='zlib', level=9)
+    raid.write_data_from_file(make_file(data), 'lzma', compress='lzma')
+    raw = os.urandom(50000)
+    raid.write_data_from_file(make_file(raw), 'raw', compress='zlib')
+    assert raid.OBJECT_INFO['zlib']['stored'] < len(data) // 4
+    assert 'raw' not in raid.OBJECT_INFO    # Incompressible, stored as it is
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[0])
+    raid.BACKEND.destroy(raid.DISK_PATHS[4])
+    raid.CACHE.clear()
+    assert raid.read_object('zlib') == data
+    assert raid.read_range('lzma', 1000, 5000) == data[1000:6000]
+    assert raid.read_object('raw') == raw
+
+
+def test_rewrites_keep_the_codec_and_level(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    data = payload(2000)
+    raid.write_data_from_file(make_file(data), 'a', compress='lzma', level=1)
+
+    raid.write_range('a', 10, b'0123456789')
+    data = data[:10] + b'0123456789' + data[20:]
+    raid.append('a', b' appended')
+    data += b' appended'
+    assert raid.OBJECT_INFO['a']['codec'] == 'lzma' and raid.OBJECT_INFO['a']['level'] == 1
+    assert raid.read_object('a') == data
+
+    data = payload(2500)
+    raid.update_data_from_file(make_file(data), 'a')
+    assert raid.OBJECT_INFO['a']['codec'] == 'lzma' and raid.OBJECT_INFO['a']['level'] == 1
+    assert raid.read_object('a') == data
+
+    raid.update_data_from_file(make_file(data), 'a', compress='zlib', level=9)
+    assert raid.OBJECT_INFO['a']['codec'] == 'zlib' and raid.OBJECT_INFO['a']['level'] == 9
+    assert raid.read_object('a') == data
@@ -0,0 +1,35 @@
+import os
+
+import controller
+
+
+def test_identical_stripes_are_stored_once(tmp_path, make_file):
+    path = str(tmp_path / 'disks')
+    raid = controller.RAID6(8, 128, path=path)
+    raid.DEDUP = True
+    stripe = os.urandom(6 * 128)
+    data = stripe * 4 + b'tail'
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.write_data_from_file(make_file(data), 'b')
+    stats = raid.dedup_stats()
+    assert stats['stripes'] == 1 and stats['references'] == 8
+    assert stats['saved_bytes'] == 7 * 6 * 128
+    assert raid.read_object('a') == data and raid.read_object('b') == data
+
+    # Writing one object leaves the other alone
+    raid.write_range('a', 10, b'XYZ')
+    assert raid.read_object('a') == data[:10] + b'XYZ' + data[13:]
+    assert raid.read_object('b') == data
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[1])
+    raid.BACKEND.destroy(raid.DISK_PATHS[6])
+    raid.CACHE.clear()
+    assert raid.read_object('b') == data
+    raid.close()
+
+    reopened = controller.RAID6(8, 128, path=path, reset=False)
+    assert reopened.read_object('b') == data
+    reopened.delete_data('a')
+    assert reopened.dedup_stats()['references'] == 4
+    reopened.delete_data('b')
+    assert reopened.STRIPES == {}
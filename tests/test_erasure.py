@@ -0,0 +1,36 @@
+import itertools
+import os
+import random
+import shutil
+
+import pytest
+
+import controller
+import parity
+
+
+@pytest.mark.parametrize('matrix', ['cauchy', 'vandermonde'])
+def test_reed_solomon_rebuilds_any_erasures(matrix):
+    rng = random.Random(0)
+    code = parity.reed_solomon(5, 3, matrix)
+    data = [code.F.AsArray([rng.randrange(256) for loop in range(32)]) for j in range(5)]
+    stripe = [list(x) for x in data] + [list(x) for x in code.encode(data)]
+    for lost in itertools.combinations(range(8), 3):
+        chunks = [None if r in lost else code.F.AsArray(stripe[r]) for r in range(8)]
+        assert [[int(v) for v in x] for x in code.reconstruct(chunks)] == stripe
+
+    with pytest.raises(IOError):
+        code.decode([None] * 4 + [code.F.AsArray(x) for x in stripe[4:]])
+
+
+def test_array_survives_as_many_losses_as_parity_disks(tmp_path, make_file):
+    rng = random.Random(1)
+    raid = controller.RAID6(8, 128, 3, path=str(tmp_path / 'disks'))
+    objects = {'a': os.urandom(20000), 'b': os.urandom(3000)}
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+    for disk in rng.sample(range(8), 3):
+        shutil.rmtree(str(tmp_path / 'disks' / ('disk_' + str(disk))))
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
+    raid.close()
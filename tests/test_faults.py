@@ -0,0 +1,13 @@
+import pytest
+
+import faults
+
+
+@pytest.mark.parametrize('profile, losses', [('healthy', 0), ('disk_loss', 1), ('double_disk_loss', 2)])
+def test_lost_disks_lose_no_acknowledged_object(profile, losses):
+    results = faults.run_scenario(profile, objects=8, object_size=16 * 1024)
+    assert results['injected']['losses'] == losses
+    assert len(results['recovered']) == losses
+    assert results['write']['errors'] == 0 and results['write']['operations'] == 8
+    for phase in ('read', 'rebuild'):
+        assert results[phase]['errors'] == 0 and results[phase]['corrupted'] == 0
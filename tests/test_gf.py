@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+import gf
+
+
+def as_list(values):
+    return [int(x) for x in values]
+
+
+def test_array_ops_match_scalar_ops():
+    rng = random.Random(0)
+    for n in (8, 16):
+        F = gf.FField(n, useLUT=0)
+        a = [rng.randrange(1 << n) for loop in range(200)]
+        b = [rng.randrange(1 << n) for loop in range(200)]
+        a[0] = b[1] = 0
+        assert as_list(F.AddArray(a, b)) == [x ^ y for x, y in zip(a, b)]
+        assert as_list(F.MultiplyArray(a, b)) == [F.Multiply(x, y) for x, y in zip(a, b)]
+        c = rng.randrange(2, 1 << n)
+        assert as_list(F.ScaleBuffer(c, a)) == [F.Multiply(c, x) for x in a]
+        assert as_list(F.ScaleBuffer(0, a)) == [0] * len(a)
+        assert as_list(F.ScaleBuffer(1, a)) == a
+
+
+def test_dot_product_and_inverse():
+    rng = random.Random(1)
+    F = gf.FField(8, useLUT=0)
+    coefficients = [0, 1, 7, 200]
+    buffers = [[rng.randrange(256) for loop in range(64)] for c in coefficients]
+    expected = [0] * 64
+    for c, buf in zip(coefficients, buffers):
+        expected = [x ^ F.Multiply(c, y) for x, y in zip(expected, buf)]
+    assert as_list(F.DotProduct(coefficients, buffers)) == expected
+    assert as_list(F.DotProduct([0, 0], buffers[:2])) == [0] * 64
+
+    values = [rng.randrange(1, 256) for loop in range(100)]
+    inverses = as_list(F.InverseArray(values))
+    assert [F.Multiply(x, y) for x, y in zip(values, inverses)] == [1] * 100
+    with pytest.raises(ZeroDivisionError):
+        F.InverseArray([3, 0])
@@ -0,0 +1,28 @@
+import functools
+import os
+
+import pytest
+
+import controller
+import faults
+
+
+@pytest.mark.parametrize('parity_disks', [2, 3])
+def test_slow_disk_is_read_around(tmp_path, make_file, parity_disks):
+    raid = controller.RAID6(8, 128, parity_disks, path=str(tmp_path / 'disks'),
+                            backend=functools.partial(faults.faulty_backend, inner='memory'))
+    raid.HEDGED_READS = True
+    raid.CACHE.resize(0)
+    data = os.urandom(60000)
+    raid.write_data_from_file(make_file(data), 'a')
+    assert raid.read_object('a') == data
+
+    raid.BACKEND.inject(3, latency=faults.constant(0.02))
+    assert raid.read_object('a') == data
+    assert raid.LATENCY.stats()[3]['hedged'] > 0
+    assert 3 in raid.SPARE_MANAGER.status()['slow_disks']
+
+    # Hedged reads still rebuild around a lost disk
+    raid.BACKEND.destroy(raid.DISK_PATHS[5])
+    assert raid.read_object('a') == data
+    raid.close()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import backend
+import controller
+
+
+def stored_chunks(raid):
+    return sum(1 for disk in range(8) for index in range(len(raid.DISKS_INFO)) if raid.BACKEND.exists(disk, index))
+
+
+@pytest.mark.parametrize('name', ['directory', 'image', 'memory'])
+def test_zero_chunks_are_holes(tmp_path, make_file, name):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend=name)
+    sparse = bytearray(100000)
+    sparse[50000:50100] = os.urandom(100)
+    sparse = bytes(sparse)
+    raid.write_data_from_file(make_file(sparse), 'sparse')
+    assert raid.DISKS_INFO.zero_chunks() > 0
+    assert stored_chunks(raid) < 8 * len(raid.DISKS_INFO) // 4
+    raid.CACHE.clear()
+    assert raid.read_object('sparse') == sparse
+
+    # A chunk written with data, then with zeros again
+    raid.write_range('sparse', 5000, b'hello')
+    assert raid.read_object('sparse') == sparse[:5000] + b'hello' + sparse[5005:]
+    raid.write_range('sparse', 5000, bytes(5))
+    assert raid.read_object('sparse') == sparse
+
+    raid.BACKEND.fail(2)
+    raid.BACKEND.fail(5)
+    raid.CACHE.clear()
+    assert raid.read_object('sparse') == sparse
+    raid.recovering_disks([2, 5])
+    raid.BACKEND.fail(0)
+    raid.BACKEND.fail(7)
+    raid.CACHE.clear()
+    assert raid.read_object('sparse') == sparse
+
+
+@pytest.mark.skipif(backend.fallocate is None, reason="fallocate is not available")
+def test_discarded_chunks_free_the_space_of_an_image(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend='image')
+    data = os.urandom(300000)
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.BACKEND.sync()
+    image = raid.DISK_PATHS[0] + 'image'
+    before = os.stat(image).st_blocks
+    raid.write_range('a', 0, bytes(len(data)))
+    raid.BACKEND.sync()
+    if os.stat(image).st_blocks >= before:
+        pytest.skip("the filesystem does not punch holes")
+    assert os.stat(image).st_blocks < before // 2
+    assert raid.read_object('a') == bytes(len(data))
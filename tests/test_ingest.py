@@ -0,0 +1,56 @@
+import os
+import random
+
+import pytest
+
+import controller
+import merkle
+
+
+###
+# Tree of files of every size around a chunk, some of them zeros
+###
+def make_tree(root):
+    rng = random.Random(1)
+    files = {}
+    for directory in ['', 'a/', 'a/b/', 'c/']:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        for i in range(8):
+            size = rng.choice([0, 5, 127, 128, 129, 700, 3000, 20000])
+            data = bytes(size) if i % 4 == 3 else os.urandom(size)
+            files[directory + 'f' + str(i)] = data
+            with open(os.path.join(root, directory, 'f' + str(i)), 'wb') as f:
+                f.write(data)
+    return files
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_ingest_round_trip_and_disk_loss(tmp_path, parallel):
+    files = make_tree(str(tmp_path / 'tree'))
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend='memory')
+    raid.PARALLEL_IO = parallel
+    raid.write_data('hello', 'before')
+    stats = raid.ingest(str(tmp_path / 'tree'), prefix='x/', workers=0, batch_bytes=20000)
+    assert stats['files'] == len(files)
+    assert stats['bytes'] == sum(len(data) for data in files.values())
+
+    raid.CACHE.clear()
+    for name, data in files.items():
+        assert raid.read_object('x/' + name) == data
+        assert raid.digest('x/' + name) == merkle.merkle_tree.from_bytes(data, raid.DIGEST_BLOCK_SIZE).hexdigest()
+    assert raid.read_object('before') == b'hello'
+    assert not raid.audit()
+
+    # Ingesting again replaces the objects
+    raid.ingest(str(tmp_path / 'tree'), prefix='x/', workers=0)
+    raid.BACKEND.fail(1)
+    raid.BACKEND.fail(5)
+    raid.CACHE.clear()
+    for name, data in files.items():
+        assert raid.read_object('x/' + name) == data
+    raid.recovering_disks([1, 5])
+    raid.BACKEND.fail(0)
+    raid.BACKEND.fail(7)
+    raid.CACHE.clear()
+    for name, data in files.items():
+        assert raid.read_object('x/' + name) == data
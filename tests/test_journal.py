@@ -0,0 +1,48 @@
+import os
+
+import controller
+
+
+def open_raid(tmp_path, reset):
+    return controller.RAID6(8, 128, journal_path=str(tmp_path / 'journal'), reset=reset, path=str(tmp_path / 'disks'))
+
+
+def test_committed_operations_are_replayed_after_a_crash(tmp_path, make_file):
+    raid = open_raid(tmp_path, True)
+    objects = dict(('object_' + str(i), os.urandom(1000 + 300 * i)) for i in range(10))
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+    raid.checkpoint()
+
+    # After the checkpoint, only the journal knows about these
+    raid.delete_data('object_0')
+    del objects['object_0']
+    raid.append('object_1', b'appended')
+    objects['object_1'] += b'appended'
+    raid.write_data_from_file(make_file(b'new object'), 'new')
+    objects['new'] = b'new object'
+    assert len(raid.JOURNAL.pending) > 0
+
+    # Reopened without closing the first one, as after a crash
+    reopened = open_raid(tmp_path, False)
+    assert sorted(reopened.FILES_INFO) == sorted(objects)
+    for name, data in objects.items():
+        assert reopened.read_object(name) == data
+    reopened.close()
+
+
+def test_commits_journal_the_metadata_changed_only(tmp_path, make_file):
+    raid = open_raid(tmp_path, True)
+    for i in range(200):
+        raid.write_data_from_file(make_file(os.urandom(2000)), 'object_' + str(i))
+    size = raid.JOURNAL.size
+    raid.append('object_0', b'0123456789')
+    # The chunks of one index and the changed entries, not the metadata of every object
+    assert raid.JOURNAL.size - size < 4 * 1024
+    assert raid.JOURNAL.size - size < len(raid.metadata()) // 4
+    raid.close()
+
+    reopened = open_raid(tmp_path, False)
+    assert reopened.object_size('object_0') == 2010
+    assert reopened.read_range('object_0', 2000, 10) == b'0123456789'
+    reopened.close()
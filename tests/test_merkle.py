@@ -0,0 +1,49 @@
+import os
+import random
+
+import controller
+import merkle
+
+
+def test_sync_sends_only_the_ranges_that_differ(tmp_path, make_file):
+    rng = random.Random(3)
+    source = controller.RAID6(8, 128, path=str(tmp_path / 'source'))
+    replica = controller.RAID6(8, 256, path=str(tmp_path / 'replica'), backend='memory')
+    objects = dict(('object_' + str(i), os.urandom(rng.randrange(1, 60000))) for i in range(4))
+    for name, data in objects.items():
+        source.write_data_from_file(make_file(data), name)
+    source.write_many({'small': b'hello' * 30, 'empty': b''})
+    objects.update({'small': b'hello' * 30, 'empty': b''})
+    source.sync_to(replica)
+    assert source.diff(replica) == {}
+
+    data = bytearray(objects['object_0'])
+    data[100:110] = b'0123456789'
+    objects['object_0'] = bytes(data)
+    source.write_range('object_0', 100, b'0123456789')
+    assert source.merkle('object_0') == merkle.merkle_tree.from_bytes(objects['object_0'], source.DIGEST_BLOCK_SIZE)
+    assert list(source.diff(replica)) == ['object_0']
+    sent = source.sync_to(replica)
+    assert sent['objects'] == 1 and sent['bytes'] <= source.DIGEST_BLOCK_SIZE
+
+    source.delete_data('object_1')
+    del objects['object_1']
+    replica.write_many({'extra': b'zz'})
+    source.sync_to(replica, delete=True)
+    assert source.diff(replica) == {} and sorted(replica.objects()) == sorted(objects)
+    for name, data in objects.items():
+        assert replica.read_object(name) == data
+
+
+def test_audit_finds_the_damaged_blocks(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    data = os.urandom(30000)
+    raid.write_data_from_file(make_file(data), 'a')
+    assert raid.audit() == {}
+
+    # Data and parity agree again, only the tree knows the chunk changed
+    raid.write_chunk(1, 1, [1] * 128)     # First data chunk of index 1
+    raid.restore_parity(1)
+    raid.CACHE.clear()
+    damaged = raid.audit()
+    assert list(damaged) == ['a'] and damaged['a'][0][0] < raid.DIGEST_BLOCK_SIZE
@@ -0,0 +1,32 @@
+import os
+import random
+
+import controller
+
+
+def test_small_objects_share_indexes(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    objects = dict(('object_' + str(i), os.urandom(random.randrange(0, 400))) for i in range(300))
+    before = raid.current_index
+    raid.write_many(objects)
+    # One index holds 6 data chunks of 128 bytes
+    assert raid.current_index - before <= sum(len(x) for x in objects.values()) // (6 * 128) + 2
+    assert raid.read_many(list(objects)) == objects
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[2])
+    raid.BACKEND.destroy(raid.DISK_PATHS[7])
+    raid.CACHE.clear()
+    assert raid.read_many(list(objects)) == objects
+
+    # A pack is freed with its last object
+    for name in list(objects)[::2]:
+        raid.delete_data(name)
+    assert len(raid.PACKS) == 1
+    for name in list(objects)[1::2]:
+        raid.delete_data(name)
+    assert len(raid.PACKS) == 0
+
+    raid.write_many({'x': b'abc', 'y': b'defg'})
+    data = os.urandom(5000)
+    raid.update_data_from_file(make_file(data), 'x')
+    assert raid.read_many(['x', 'y']) == {'x': data, 'y': b'defg'}
@@ -0,0 +1,39 @@
+import functools
+import os
+
+import pytest
+
+import controller
+import faults
+
+
+@pytest.mark.parametrize('parity_disks', [2, 3])
+def test_parallel_io_round_trip_and_recovery(tmp_path, make_file, parity_disks):
+    raid = controller.RAID6(8, 128, parity_disks, path=str(tmp_path / 'disks'),
+                            backend=functools.partial(faults.faulty_backend, inner='memory'))
+    raid.PARALLEL_IO = True
+    raid.CACHE.resize(0)
+    for disk in range(8):
+        raid.BACKEND.inject(disk, latency=faults.constant(0.0005))
+    data = os.urandom(30000)
+    raid.write_data_from_file(make_file(data), 'a')
+    raid.write_many({'b': b'small'})
+    assert raid.read_object('a') == data
+    raid.BACKEND.clear()
+
+    raid.BACKEND.fail(5)
+    raid.recovering_disks([5])
+    assert raid.read_object('a') == data
+    raid.BACKEND.fail(1)
+    raid.BACKEND.fail(6)
+    raid.recovering_disks([1, 6])
+    assert raid.read_object('a') == data and raid.read_object('b') == b'small'
+
+    # The chunks written in parallel match those written one after the other
+    serial = controller.RAID6(8, 128, parity_disks, path=str(tmp_path / 'serial'), backend='memory')
+    serial.write_data_from_file(make_file(data), 'a')
+    serial.write_many({'b': b'small'})
+    for index in range(raid.current_index):
+        for disk in range(8):
+            assert raid.read_chunk(disk, index) == serial.read_chunk(disk, index)
+    raid.close()
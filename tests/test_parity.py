@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+import parity
+
+
+@pytest.mark.parametrize('number_of_disk', [8, 9, 12, 16])
+def test_horner_encode_matches_bytewise(number_of_disk):
+    rng = random.Random(number_of_disk)
+    p = parity.parity(number_of_disk)
+    k = number_of_disk - 2
+    for length in (1, 7, 128):
+        # Chunks of zeros and shorter chunks (the end of an object) included
+        chunks = [[rng.randrange(256) for loop in range(length)] for j in range(k)]
+        chunks[1] = [0] * length
+        chunks[-1] = chunks[-1][:length // 2]
+        assert p.encode(chunks) == p.encode_bytewise(chunks)
+        assert p.encode([[0] * length] * k) == [[0] * length, [0] * length]
+
+    # Values up to the size of the field, as rebuilt parity chunks are fed back
+    chunks = [[rng.randrange(1 << number_of_disk) for loop in range(16)] for j in range(k)]
+    assert p.encode(chunks) == p.encode_bytewise(chunks)
+
+
+def test_encoded_stripe_rebuilds_two_chunks():
+    rng = random.Random(0)
+    p = parity.parity(8)
+    chunks = [[rng.randrange(256) for loop in range(32)] for j in range(6)]
+    P, Q = p.encode(chunks)
+    for i in range(32):
+        column = [x[i] for x in chunks]
+        assert p.recover_one_chunk_with_Q(column, Q[i], 4) == column[4]
+        assert p.recover_two_chunk(column, P[i], Q[i], 1, 4) == (column[1], column[4])
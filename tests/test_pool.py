@@ -0,0 +1,42 @@
+import os
+
+import pool
+
+
+def test_pool_round_trip_loss_and_rebuild(tmp_path):
+    path = str(tmp_path / 'pool') + '/'
+    raid = pool.RAID6Pool(groups=3, chunk_size=256, path=path, unit_size=4096, processes=False, backend='memory')
+    objects = {}
+    for i, size in enumerate([0, 10, 4096, 5000, 30000, 70000, 9000, 12345]):
+        objects['o' + str(i)] = os.urandom(size)
+        raid.write('o' + str(i), objects['o' + str(i)])
+    raid.write('o3', b'shorter')
+    objects['o3'] = b'shorter'
+
+    def check():
+        for name, data in objects.items():
+            assert raid.read(name) == data
+        assert raid.objects() == dict((name, len(data)) for name, data in objects.items())
+
+    check()
+    data = objects['o4']
+    for offset, length in [(0, 10), (4000, 200), (len(data) - 5, 100)]:
+        assert raid.read_range('o4', offset, length) == data[offset:offset + length]
+
+    # New group, the units moved to it keep their content
+    raid.add_group()
+    check()
+    raid.delete('o1')
+    del objects['o1']
+    check()
+
+    assert raid.status()[1]['units'] > 0
+    raid.call(1, 'BACKEND.fail', 2)
+    raid.call(1, 'BACKEND.fail', 5)
+    raid.call(1, 'CACHE.resize', 0)
+    check()
+    raid.rebuild({1: [2, 5]})
+    raid.call(1, 'BACKEND.fail', 0)
+    raid.call(1, 'BACKEND.fail', 7)
+    check()
+    raid.close()
@@ -0,0 +1,23 @@
+import os
+
+import controller
+
+
+def test_sequential_reads_are_prefetched(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    raid.CACHE.resize(0)
+    data = os.urandom(200000)
+    raid.write_data_from_file(make_file(data), 'big')
+    assert raid.read_object('big') == data
+    assert raid.PREFETCHER.stats()['hits'] > 0
+
+    # Indexes written after being prefetched are read again
+    new = os.urandom(200000)
+    raid.update_data_from_file(make_file(new), 'big')
+    assert raid.read_object('big') == new
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[1])
+    assert raid.read_object('big') == new
+
+    raid.close()
+    assert raid.PREFETCHER.executor is None
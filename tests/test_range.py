@@ -0,0 +1,54 @@
+import os
+import random
+
+import pytest
+
+import controller
+import merkle
+
+
+@pytest.mark.parametrize('parity_disks', [2, 3])
+def test_range_writes_keep_the_parity_right(tmp_path, make_file, parity_disks):
+    rng = random.Random(7)
+    raid = controller.RAID6(8, 128, parity_disks, path=str(tmp_path / 'disks'), backend='memory')
+    objects = dict(('object_' + str(i), os.urandom(rng.randrange(1, 20000))) for i in range(3))
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+    raid.write_many({'packed': b'a' * 300})
+    objects['packed'] = b'a' * 300
+    raid.write_data_from_file(make_file(b'q' * 1000), 'last')
+    objects['last'] = b'q' * 1000
+
+    # Appends to the last object grow its extent
+    for loop in range(10):
+        data = os.urandom(rng.randrange(0, 900))
+        raid.append('last', data)
+        objects['last'] += data
+    assert len(raid.FILES_INFO['last']) == 1
+
+    for loop in range(60):
+        name = rng.choice(list(objects))
+        data = bytearray(objects[name])
+        offset = rng.randrange(len(data) + 500)
+        new = os.urandom(rng.randrange(0, 2000))
+        if offset > len(data):
+            data.extend(bytes(offset - len(data)))
+        data[offset:offset + len(new)] = new
+        raid.write_range(name, offset, new)
+        objects[name] = bytes(data)
+    raid.append('new', b'created')
+    objects['new'] = b'created'
+
+    def check():
+        raid.CACHE.clear()
+        for name, data in objects.items():
+            assert raid.read_object(name) == data
+            assert raid.merkle(name) == merkle.merkle_tree.from_bytes(data, raid.DIGEST_BLOCK_SIZE)
+    check()
+    raid.BACKEND.fail(1)
+    raid.BACKEND.fail(4)
+    check()
+    raid.recovering_disks([1, 4])
+    raid.BACKEND.fail(0)
+    raid.BACKEND.fail(6)
+    check()
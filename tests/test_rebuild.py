@@ -0,0 +1,27 @@
+import os
+
+import controller
+
+
+def test_rebuild_skips_free_indexes_and_reuses_them(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'))
+    objects = dict(('object_' + str(i), os.urandom(20000)) for i in range(6))
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+    for i in range(5):
+        raid.delete_data('object_' + str(i))
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[2])
+    raid.BACKEND.destroy(raid.DISK_PATHS[5])
+    assert raid.read_object('object_5') == objects['object_5']
+    # The indexes of the deleted objects were not rebuilt
+    assert len(raid.LAZY_PARITY) > 0
+    assert not any(index in raid.LAZY_PARITY for index in raid.rebuild_order())
+
+    # Free indexes written again get their parity back
+    data = os.urandom(50000)
+    raid.write_data_from_file(make_file(data), 'new')
+    raid.BACKEND.destroy(raid.DISK_PATHS[1])
+    raid.CACHE.clear()
+    assert raid.read_object('new') == data
+    assert raid.read_object('object_5') == objects['object_5']
@@ -0,0 +1,44 @@
+import os
+
+import controller
+
+
+def test_reshape_keeps_the_objects_and_the_controller_state(tmp_path, make_file):
+    path = str(tmp_path / 'disks')
+    journal = str(tmp_path / 'journal')
+    raid = controller.RAID6(8, 128, journal_path=journal, path=path)
+    raid.HEDGED_READS = True
+    lock, cache, prefetcher = raid.LOCK, raid.CACHE, raid.PREFETCHER
+    old_lanes = raid.LANES
+    objects = dict(('object_' + str(i), os.urandom(1000 * (i + 1))) for i in range(10))
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+    raid.write_data_from_file(make_file(b'abc' * 5000), 'compressed', compress='zlib')
+    objects['compressed'] = b'abc' * 5000
+
+    job = raid.reshape(10, 256)
+    # Served while the objects are moved
+    raid.delete_data('object_0')
+    del objects['object_0']
+    objects['new'] = os.urandom(5000)
+    raid.write_data_from_file(make_file(objects['new']), 'new')
+    assert raid.read_object('object_5') == objects['object_5']
+    assert job.wait(60)
+
+    assert (raid.NUMBER_OF_DISKS, raid.CHUNK_SIZE, raid.RESHAPE) == (10, 256, None)
+    assert raid.LOCK is lock and raid.CACHE is cache and raid.PREFETCHER is prefetcher
+    assert raid.HEDGED_READS and raid.JOURNAL is not None
+    assert len(raid.LANES.lanes) == 10 and all(lane is None for lane in old_lanes.lanes)
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
+
+    raid.BACKEND.fail(3)
+    raid.CACHE.resize(0)
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
+    raid.close()
+
+    reopened = controller.RAID6(10, 256, journal_path=journal, path=path, reset=False)
+    for name, data in objects.items():
+        assert reopened.read_object(name) == data
+    reopened.close()
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+import controller
+
+
+@pytest.mark.parametrize('lost', [[3], [0, 6]])
+def test_snapshot_of_deleted_objects_survives_a_rebuild(tmp_path, make_file, lost):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend='memory')
+    a, b = os.urandom(30000), os.urandom(5000)
+    raid.write_data_from_file(make_file(a), 'a')
+    raid.write_data_from_file(make_file(b), 'b')
+    raid.snapshot('s')
+    raid.delete_data('a')
+    raid.update_data_from_file(make_file(os.urandom(5000)), 'b')
+    raid.write_data('after', 'c')
+
+    for disk in lost:
+        raid.BACKEND.fail(disk)
+    raid.recovering_disks(lost)
+    assert all(index not in raid.LAZY_PARITY for x in raid.SNAPSHOTS['s']['objects']['a']['extents']
+               for index in raid.extent_indexes(x))
+
+    # Rebuilding one more disk needs the chunks rebuilt so far
+    for disk in range(8):
+        if disk not in lost:
+            raid.BACKEND.fail(disk)
+            raid.recovering_disks([disk])
+            break
+    raid.CACHE.clear()
+    assert raid.read_snapshot('s', 'a') == a
+    assert raid.read_snapshot('s', 'b') == b
+    raid.write_data_from_file(make_file(os.urandom(20000)), 'd')
+    raid.restore_snapshot('s')
+    raid.CACHE.clear()
+    assert raid.read_object('a') == a
+    assert raid.read_object('b') == b
+    assert 'c' not in raid.FILES_INFO
+
+
+def test_clone_is_copied_on_write_and_rebuilt(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend='memory')
+    a = os.urandom(20000)
+    raid.write_data_from_file(make_file(a), 'a')
+    raid.clone('a', 'b')
+    raid.write_range('b', 1000, b'x' * 3000)
+    raid.delete_data('a')
+    b = a[:1000] + b'x' * 3000 + a[4000:]
+
+    raid.BACKEND.fail(2)
+    raid.recovering_disks([2])
+    raid.BACKEND.fail(5)
+    raid.BACKEND.fail(7)
+    raid.CACHE.clear()
+    assert raid.read_object('b') == b
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+
+import controller
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    assert condition()
+
+
+def test_failed_disks_are_rebuilt_on_spares(tmp_path, make_file):
+    spares = [str(tmp_path / ('spare_' + str(i))) for i in range(2)]
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), spares=spares)
+    raid.SPARE_MANAGER.INTERVAL = 0.05
+    objects = dict(('object_' + str(i), os.urandom(30000)) for i in range(3))
+    for name, data in objects.items():
+        raid.write_data_from_file(make_file(data), name)
+
+    raid.BACKEND.destroy(raid.DISK_PATHS[3])
+    raid.BACKEND.destroy(raid.DISK_PATHS[6])
+    spares = [os.path.join(x, '') for x in spares]
+    wait_for(lambda: raid.DISK_PATHS[3] in spares and raid.DISK_PATHS[6] in spares)
+    # Served degraded and written to while rebuilding
+    objects['new'] = os.urandom(30000)
+    raid.write_data_from_file(make_file(objects['new']), 'new')
+    assert raid.read_object('object_0') == objects['object_0']
+    wait_for(lambda: len(raid.REBUILDING) == 0)
+
+    # The spares hold the right chunks: two other disks can now fail
+    raid.BACKEND.destroy(raid.DISK_PATHS[0])
+    raid.BACKEND.destroy(raid.DISK_PATHS[1])
+    raid.CACHE.clear()
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
+    raid.close()
+
+
+def test_close_does_not_wait_for_the_monitor_holding_the_lock(tmp_path, make_file):
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), spares=[str(tmp_path / 'spare')])
+    raid.write_data_from_file(make_file(os.urandom(20000)), 'a')
+    raid.SPARE_MANAGER.INTERVAL = 0.05
+
+    def run():
+        with raid.LOCK:
+            raid.SPARE_MANAGER.probe = lambda: [3]
+            time.sleep(0.5)     # The monitor now waits for the lock to swap the spare in
+            raid.close()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(20)
+    assert not thread.is_alive()
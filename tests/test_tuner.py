@@ -0,0 +1,42 @@
+import os
+import random
+
+import controller
+import tuner
+
+PROFILE = dict(tuner.DEFAULT_PROFILE, objects=4, operations=20,
+               object_sizes=[(1000, 1), (5000, 1)], range_sizes=[(100, 1)])
+
+
+def test_tune_ranks_the_geometries():
+    trace = tuner.synthetic_trace(PROFILE, seed=1)
+    assert trace == tuner.synthetic_trace(PROFILE, seed=1)
+    assert [x[0] for x in trace[:4]] == ['write'] * 4
+    results = tuner.tune(trace, disks=[8, 12], chunk_sizes=[128, 512])
+    assert sorted((x['disks'], x['chunk_size']) for x in results) == [(8, 128), (8, 512), (12, 128), (12, 512)]
+    assert [x['MB/s'] for x in results] == sorted((x['MB/s'] for x in results), reverse=True)
+
+
+def test_updates_of_every_size_read_back(tmp_path, make_file):
+    rng = random.Random(5)
+    raid = controller.RAID6(8, 128, path=str(tmp_path / 'disks'), backend='memory')
+    objects = {}
+    for step in range(100):
+        name = 'object_' + str(rng.randrange(6))
+        data = os.urandom(rng.choice([0, 1, 127, 128, 129, 700, 3000, 20000]))
+        if name in objects and rng.random() < 0.8:
+            raid.update_data_from_file(make_file(data), name)
+        elif name in objects:
+            raid.delete_data(name)
+            del objects[name]
+            continue
+        else:
+            raid.write_data_from_file(make_file(data), name)
+        objects[name] = data
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
+
+    raid.BACKEND.fail(4)
+    raid.CACHE.clear()
+    for name, data in objects.items():
+        assert raid.read_object(name) == data
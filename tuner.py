@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import controller
+
+###
+# Synthetic workload profile
+# object_sizes: [(size in bytes, weight), ...] sizes of the objects written
+# reads: fraction of the operations reading, the others write or update
+# range_reads: fraction of the reads only reading a range of the object
+# range_sizes: [(size in bytes, weight), ...] sizes of the ranges read
+###
+DEFAULT_PROFILE = {'objects': 16,
+                   'operations': 100,
+                   'object_sizes': [(4 * 1024, 4), (64 * 1024, 3), (256 * 1024, 1)],
+                   'reads': 0.7,
+                   'range_reads': 0.3,
+                   'range_sizes': [(512, 1), (4096, 2), (32 * 1024, 1)]}
+
+DISKS = [8, 12, 16]     # Values are bytes, stored in GF(2^disks): at least 8 disks
+CHUNK_SIZES = [128, 512, 1024, 4096]
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+###
+# Operations of a workload: ['write', name, size], ['update', name, size],
+# ['read', name], ['range', name, offset, length] and ['delete', name]
+# The objects are first written, then the operations are mixed
+###
+def synthetic_trace(profile=DEFAULT_PROFILE, seed=0):
+    rng = random.Random(seed)
+    sizes = {}
+    trace = []
+    for i in range(profile['objects']):
+        sizes['object_' + str(i)] = weighted(rng, profile['object_sizes'])
+        trace.append(['write', 'object_' + str(i), sizes['object_' + str(i)]])
+    for loop in range(profile['operations']):
+        name = rng.choice(list(sizes))
+        if rng.random() < profile['reads']:
+            if rng.random() < profile['range_reads']:
+                length = min(weighted(rng, profile['range_sizes']), sizes[name])
+                trace.append(['range', name, rng.randrange(sizes[name] - length + 1), length])
+            else:
+                trace.append(['read', name])
+        else:
+            sizes[name] = weighted(rng, profile['object_sizes'])
+            trace.append(['update', name, sizes[name]])
+    return trace
+
+###
+# A recorded trace is a JSON list of operations (see synthetic_trace)
+###
+def load_trace(file):
+    with open(file) as f:
+        return json.load(f)
+
+###
+# Run a trace on a RAID6, returning the bytes and seconds spent reading and writing
+###
+def replay(raid, trace, root, seed=0):
+    size = max([x[2] for x in trace if x[0] in ('write', 'update')] + [1])
+    payload = random.Random(seed).getrandbits(8 * size).to_bytes(size, 'little')
+    file = os.path.join(root, 'payload')
+    totals = {'read': [0, 0.0], 'write': [0, 0.0]}
+    for operation in trace:
+        kind, name = operation[0], operation[1]
+        if kind in ('write', 'update'):
+            with open(file, 'wb') as f:
+                f.write(payload[:operation[2]])
+            start = time.perf_counter()
+            if kind == 'update' and name in raid.FILES_INFO:
+                raid.update_data_from_file(file, name)
+            else:
+                raid.write_data_from_file(file, name)
+            totals['write'][0] += operation[2]
+            totals['write'][1] += time.perf_counter() - start
+        elif kind == 'read':
+            start = time.perf_counter()
+            totals['read'][0] += len(raid.read_object(name))
+            totals['read'][1] += time.perf_counter() - start
+        elif kind == 'range':
+            start = time.perf_counter()
+            totals['read'][0] += len(raid.read_range(name, operation[2], operation[3]))
+            totals['read'][1] += time.perf_counter() - start
+        elif kind == 'delete':
+            raid.delete_data(name)
+    return totals
+
+###
+# Replay a trace on each candidate geometry and return the measures, best first
+# The read cache is disabled so reads hit the disks, the memory backend
+# (default) leaves the disks out (the writes still read the payload and stage
+# some data in files), 'directory' includes the filesystem
+###
+def tune(trace, disks=DISKS, chunk_sizes=CHUNK_SIZES, backend='memory', seed=0):
+    if min(disks) < 8:
+        raise ValueError("A RAID6 needs at least 8 disks to store bytes")
+    results = []
+    stdout = sys.stdout
+    for number_of_disk in disks:
+        for chunk_size in chunk_sizes:
+            root = tempfile.mkdtemp()
+            # The controller prints every write
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                raid = controller.RAID6(number_of_disk, chunk_size, path=os.path.join(root, 'disks'), backend=backend)
+                raid.CACHE.resize(0)
+                totals = replay(raid, trace, root, seed)
+                raid.close()
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+                shutil.rmtree(root, ignore_errors=True)
+            read_bytes, read_time = totals['read']
+            write_bytes, write_time = totals['write']
+            results.append({'disks': number_of_disk,
+                            'chunk_size': chunk_size,
+                            'read_MB/s': read_bytes / max(read_time, 1e-9) / 1e6,
+                            'write_MB/s': write_bytes / max(write_time, 1e-9) / 1e6,
+                            'MB/s': (read_bytes + write_bytes) / max(read_time + write_time, 1e-9) / 1e6})
+    return sorted(results, key=lambda x: -x['MB/s'])
+
+
+###
+# python tuner.py [--trace trace.json] [--disks 8 12 16] [--chunk-sizes 128 1024 4096] [--backend memory]
+###
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recommend the chunk size and number of disks of a RAID6 for a workload")
+    parser.add_argument('--trace', help="recorded trace (JSON list of operations), a synthetic workload otherwise")
+    parser.add_argument('--disks', type=int, nargs='+', default=DISKS)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=CHUNK_SIZES)
+    parser.add_argument('--backend', default='memory', choices=['memory', 'directory', 'image'])
+    parser.add_argument('--reads', type=float, default=DEFAULT_PROFILE['reads'], help="read fraction of the synthetic workload")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        trace = load_trace(args.trace)
+    else:
+        profile = dict(DEFAULT_PROFILE)
+        profile['reads'] = args.reads
+        trace = synthetic_trace(profile, args.seed)
+
+    results = tune(trace, args.disks, args.chunk_sizes, args.backend, args.seed)
+    print('%6s %11s %11s %11s %11s' % ('disks', 'chunk size', 'read MB/s', 'write MB/s', 'MB/s'))
+    for x in sorted(results, key=lambda x: (x['disks'], x['chunk_size'])):
+        print('%6d %11d %11.3f %11.3f %11.3f' % (x['disks'], x['chunk_size'], x['read_MB/s'], x['write_MB/s'], x['MB/s']))
+    best = results[0]
+    print('Recommended: RAID6(number_of_disk=%d, chunk_size=%d)' % (best['disks'], best['chunk_size']))